@@ -1,23 +1,36 @@
 import os
 from dotenv import load_dotenv
-from haystack_experimental.dataclasses import ChatMessage, ToolCallResult, ToolCall
+from haystack_experimental.dataclasses import ChatMessage, ChatRole, ToolCallResult, ToolCall
 from haystack_experimental.components.generators.chat import OpenAIChatGenerator
 from haystack_experimental.core import AsyncPipeline
 from haystack.utils import Secret
-from custom_components.chat_tool_invoker import ChatToolInvoker
-from custom_components.openai_agent import OpenAIAgent
-from custom_components.agent_visualizer import AgentVisualizer
-from tools import get_tools
-from typing import AsyncGenerator
+from haystack import tracing
+from custom_components.chat_tool_invoker import ChatToolInvoker, discard_unjoined_dispatches
+from custom_components.openai_agent import OpenAIAgent, parse_model_policy
+from custom_components.planning_agent import PlanningAgent
+from custom_components.agent_visualizer import OUTPUT_MODES, AgentVisualizer, summarize_tool_call
+from retrieval import collect_retrieved_ids, has_documents, prefetch_search
+from tools import get_batch_functions, get_tools
+from typing import AsyncGenerator, Callable, List, Optional, Tuple
 
 import asyncio
+import contextlib
+import re
+import time
+import weakref
 from asyncio import Queue
 from haystack.dataclasses import StreamingChunk
+from utils.metrics import CHAT_TIME_TO_FIRST_ANSWER_TOKEN, STREAM_QUEUE_DEPTH
+from utils.progress import ProgressEvent, report_progress
+from utils.session_store import Session, get_session_store, session_key
 
 _pipeline = None
 _tools = None
 _car_simulation_agent = None
 _car_simulation_tools = None
+_collectors = weakref.WeakSet()
+
+STREAM_QUEUE_DEPTH.set_function(lambda: sum(collector.queue.qsize() for collector in list(_collectors)))
 
 class ChunkCollector:
     """
@@ -26,17 +39,21 @@ class ChunkCollector:
 
     def __init__(self):
         self.queue = Queue()
+        _collectors.add(self)
 
     async def generator(self) -> AsyncGenerator[str, None]:
         """
         Generate chunks from the queue.
 
         :returns: AsyncGenerator yielding string chunks
+        :raises Exception: The error of the producer, if it put one on the queue.
         """
         while True:
             chunk = await self.queue.get()
             if chunk is None:
                 break
+            if isinstance(chunk, BaseException):
+                raise chunk
             yield chunk
 
 async def collect_chunk(queue: Queue, chunk: StreamingChunk):
@@ -53,9 +70,25 @@ def initialize_pipeline():
     load_dotenv()
     tools = get_tools()
 
-    tool_invoker = ChatToolInvoker(tools=tools)
-    generator = OpenAIChatGenerator(api_key=Secret.from_token(os.getenv("OPENAI_API_KEY")), model="gpt-4o")
-    llm = OpenAIAgent(generator=generator)
+    tool_invoker = ChatToolInvoker(tools=tools, batch_functions=get_batch_functions())
+    generator = OpenAIChatGenerator(
+        api_key=Secret.from_token(os.getenv("OPENAI_API_KEY")), model=os.getenv("AGENT_MODEL", "gpt-4o")
+    )
+    # e.g. `tool_selection=gpt-4o-mini,plan=gpt-4o-mini` to use the large model only for the answer
+    agent_kwargs = {
+        "generator": generator,
+        "tool_invoker": tool_invoker,
+        "model_policy": parse_model_policy(os.getenv("AGENT_MODEL_POLICY")),
+        # tool calls start while the model is still streaming the rest of its message
+        "eager_tool_calls": os.getenv("AGENT_EAGER_TOOL_CALLS", "true").lower() == "true",
+        # the rewritten question is only a preparation of the search
+        "preparation_tools": ["umformulieren_anfrage"],
+    }
+    # `plan` plans all searches in one call, `iterative` lets the model call one tool round after the other
+    if os.getenv("AGENT_MODE", "iterative").lower() == "plan":
+        llm = PlanningAgent(has_results=has_documents, **agent_kwargs)
+    else:
+        llm = OpenAIAgent(**agent_kwargs)
 
     # Use AsyncPipeline instead of Pipeline
     pipeline = AsyncPipeline()
@@ -80,6 +113,55 @@ def get_pipeline():
     return _pipeline, _tools
 
 
+def get_output_mode(requested: Optional[str] = None) -> str:
+    """
+    Returns how tool calls are shown to the client, the `requested` mode or `CHAT_OUTPUT_MODE` (default `full`).
+
+    :raises ValueError: If the mode is not one of `OUTPUT_MODES`.
+    """
+    output_mode = (requested or os.getenv("CHAT_OUTPUT_MODE", "full")).lower()
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"Unknown output mode '{output_mode}', expected one of {OUTPUT_MODES}")
+    return output_mode
+
+
+# progress lines of the tools, the main argument is shown after the label
+PROGRESS_LABELS = {
+    "umformulieren_anfrage": ("Umformulierung", "originalfrage"),
+    "suche_interne_kenntnisse": ("Suche", "query"),
+}
+
+
+def is_progress_enabled() -> bool:
+    """
+    Returns whether streaming responses report the progress of tool calls, disabled with `CHAT_PROGRESS=false`.
+    """
+    return os.getenv("CHAT_PROGRESS", "true").lower() == "true"
+
+
+def render_progress(event: ProgressEvent) -> str:
+    """
+    Returns the line shown to the user for a progress event, e.g. `*Suche: Wie wird Brot gebacken?*`.
+    """
+    label, argument = PROGRESS_LABELS.get(event.tool_name, (event.tool_name, None))
+    if event.event == "started":
+        value = event.arguments.get(argument) if argument else None
+        return f"*{label}: {value}*\n\n" if value else f"*{label} …*\n\n"
+    if event.error:
+        return f"*{label} fehlgeschlagen ({event.elapsed_ms:.0f} ms)*\n\n"
+    documents = len(re.findall(r"^Document\[\d+\]", str(event.result), re.M))
+    if documents or str(event.result).strip() == "Dokumente:":
+        return f"*{documents} Dokumente gefunden ({event.elapsed_ms:.0f} ms)*\n\n"
+    return f"*{label} abgeschlossen ({event.elapsed_ms:.0f} ms)*\n\n"
+
+
+def latest_question(messages) -> str:
+    """
+    Returns the content of the latest user message of OpenAI chat messages.
+    """
+    return next((str(msg["content"] or "") for msg in reversed(messages) if msg["role"] == "user"), "")
+
+
 def convert_to_chat_message_objects(messages):
     chat_message_objects = []
     for msg in messages:
@@ -96,10 +178,78 @@ def convert_to_chat_message_objects(messages):
     return chat_message_objects
 
 
-async def query_pipeline(messages) -> AsyncGenerator[str, None]:
+async def build_messages(system_message: str, messages) -> Tuple[List[ChatMessage], Optional[Session]]:
+    """
+    Returns the messages for the agent and the stored session of the conversation, if any.
+
+    With a session, the earlier messages come from it, including the tool calls and results of earlier runs, and
+    only the messages after it are converted.
+
+    :param system_message: The system prompt.
+    :param messages: OpenAI chat messages with `role` and `content`.
+    """
+    store = get_session_store()
+    session, known = await asyncio.to_thread(store.find, messages) if store is not None else (None, 0)
+    history = session.messages if session is not None else []
+    new_messages = convert_to_chat_message_objects(messages[known:])
+    return [ChatMessage.from_system(system_message)] + history + new_messages, session
+
+
+def collect_session_ids():
+    """
+    Collects the ids of the documents retrieved in a run for its session. Without a session store nothing is
+    collected, so the searches keep their regular, instrumented path in `retrieval.run_pipeline`.
+    """
+    return collect_retrieved_ids() if get_session_store() is not None else contextlib.nullcontext([])
+
+
+async def save_session(
+    messages,
+    output: str,
+    chat_history: Optional[List[ChatMessage]],
+    document_ids: List[str],
+    previous: Optional[Session],
+):
+    """
+    Stores the session of a finished run under the conversation as the client will resend it.
+
+    :param messages: OpenAI chat messages of the request.
+    :param output: The answer as it was sent to the client.
+    :param chat_history: The messages of the agent after the run.
+    :param document_ids: Ids of the documents retrieved in the run.
+    :param previous: The session the run continued, if any.
+    """
+    store = get_session_store()
+    if store is None or not chat_history:
+        return
+    conversation = [message for message in chat_history if not message.is_from(ChatRole.SYSTEM)]
+    known_ids = previous.document_ids if previous is not None else []
+    session = Session(conversation, known_ids + [doc_id for doc_id in document_ids if doc_id not in known_ids])
+    key = session_key(list(messages) + [{"role": "assistant", "content": output}])
+    await asyncio.to_thread(store.put, key, session)
+
+
+async def query_pipeline(
+    messages,
+    output_mode: Optional[str] = None,
+    started_at: Optional[float] = None,
+    on_finished: Optional[Callable[[], None]] = None,
+) -> AsyncGenerator[str, None]:
     """
     Asynchronously query the pipeline and stream the response.
+
+    Unless disabled with `CHAT_PROGRESS=false`, every tool call is announced with a `ProgressEvent` as soon as it
+    starts and again when it finished, before its result.
+
+    :param messages: OpenAI chat messages with `role` and `content`.
+    :param output_mode: How tool calls are streamed, see `get_output_mode`. Progress events carry no text in mode
+        `none`.
+    :param started_at: `time.perf_counter()` of the request start, for the time to the first answer token.
+    :param on_finished: Called once the agent run finished or was cancelled, e.g. to release its admission slot.
     """
+    output_mode = get_output_mode(output_mode)
+    started_at = started_at or time.perf_counter()
+    answer_started = False
     request_collector = ChunkCollector()
 
     pipeline, tools = get_pipeline()
@@ -139,11 +289,17 @@ async def query_pipeline(messages) -> AsyncGenerator[str, None]:
         - Keine erfundenen Fakten, nutze nur Informationen aus der Frage.
         """
 
-    system_message = [ChatMessage.from_system(system_message)]
-    messages = convert_to_chat_message_objects(messages)
-    messages = system_message + messages
+    client_messages = messages
+    question = latest_question(messages)
+    try:
+        messages, session = await build_messages(system_message, messages)
+    except BaseException:
+        if on_finished is not None:
+            on_finished()
+        raise
 
     async def callback(chunk: StreamingChunk):
+        nonlocal answer_started
         if isinstance(chunk.content, ChatMessage) and chunk.content._content:
             for item in chunk.content._content:
                 if isinstance(item, ToolCallResult):
@@ -152,6 +308,14 @@ async def query_pipeline(messages) -> AsyncGenerator[str, None]:
                     arguments = origin_call.arguments
                     result = item.result
 
+                    if output_mode == "none":
+                        return
+                    if output_mode == "summarized":
+                        await request_collector.queue.put(
+                            summarize_tool_call(tool_name, arguments, result, item.error) + "\n\n"
+                        )
+                        return
+
                     arg_table_rows = "\n".join(
                         f"  | {key} | {value} |" for key, value in arguments.items()
                     )
@@ -171,29 +335,68 @@ async def query_pipeline(messages) -> AsyncGenerator[str, None]:
                     return
 
         # Falls kein ToolCallResult gefunden wurde, normaler Ablauf
+        if not answer_started and isinstance(chunk.content, str) and chunk.content:
+            answer_started = True
+            CHAT_TIME_TO_FIRST_ANSWER_TOKEN.observe(time.perf_counter() - started_at)
         await collect_chunk(request_collector.queue, chunk)
 
+    def on_progress(event: ProgressEvent):
+        event.text = render_progress(event) if output_mode != "none" else ""
+        request_collector.queue.put_nowait(event)
+
     input_data = {
         "llm": {"messages": messages, "tools": tools, "streaming_callback": callback},
         "agent_visualizer": {"tools": tools}
     }
 
+    run = {"chat_history": None, "document_ids": []}
+
     async def pipeline_runner():
-        async for content in pipeline.run(
-                data={
-                    "llm": {"messages": messages, "tools": tools, "streaming_callback": callback},
-                    "agent_visualizer": {"tools": tools},
-                },
-        ):
-            print(f"chunk: {chunk}")# pass
-        await request_collector.queue.put(None)
+        try:
+            # the question is searched while the model is still rewriting it
+            progress = report_progress(on_progress) if is_progress_enabled() else contextlib.nullcontext()
+            with tracing.tracer.trace("agent.run", tags={"agent.streaming": True}), prefetch_search(question), \
+                    collect_session_ids() as document_ids, progress, discard_unjoined_dispatches():
+                run["document_ids"] = document_ids
+                async for result in pipeline.run(
+                        data={
+                            "llm": {"messages": messages, "tools": tools, "streaming_callback": callback},
+                            "agent_visualizer": {"tools": tools, "output_mode": output_mode},
+                        },
+                ):
+                    if result.get("llm", {}).get("chat_history"):
+                        run["chat_history"] = result["llm"]["chat_history"]
+        except Exception as error:  # noqa: BLE001 - re-raised by the consumer of the stream
+            await request_collector.queue.put(error)
+        finally:
+            # always end the stream, otherwise the client waits forever if the pipeline fails
+            await request_collector.queue.put(None)
+
+    task = asyncio.create_task(pipeline_runner())
+    if on_finished is not None:
+        task.add_done_callback(lambda _: on_finished())
+    sent = []
+    try:
+        async for chunk in request_collector.generator():
+            if isinstance(chunk, (str, ProgressEvent)):
+                sent.append(chunk.text if isinstance(chunk, ProgressEvent) else chunk)
+            yield chunk
+    finally:
+        # a client that disconnected stops the agent run with its open OpenAI streams and tool calls
+        task.cancel()
+    await save_session(client_messages, "".join(sent), run["chat_history"], run["document_ids"], session)
 
-    asyncio.create_task(pipeline_runner())
-    async for chunk in request_collector.generator():
-        yield chunk
 
+async def run_pipeline(messages, details: bool = False, output_mode: Optional[str] = None):
+    """
+    Runs the agent on a conversation and returns its output with the tool call visualization.
 
-async def run_pipeline(messages):
+    :param messages: OpenAI chat messages with `role` and `content`.
+    :param details: Return a dictionary with the `output`, the plain `answer` of the model and the token `usage`
+        of the run instead.
+    :param output_mode: How tool calls are shown in the output, see `get_output_mode`.
+    """
+    output_mode = get_output_mode(output_mode)
     pipeline, tools = get_pipeline()
 
     system_message = """
@@ -230,19 +433,34 @@ async def run_pipeline(messages):
     - Keine erfundenen Fakten, nutze nur Informationen aus der Frage.
     """
 
-    system_message = [ChatMessage.from_system(system_message)]
-    messages = convert_to_chat_message_objects(messages)
-    messages = system_message + messages
+    client_messages = messages
+    question = latest_question(messages)
+    messages, session = await build_messages(system_message, messages)
 
     final_result = None
-    async for result in pipeline.run(
-            data={
-                "llm": {"messages": messages, "tools": tools},
-                "agent_visualizer": {"tools": tools},
-            },
-            # include_outputs_from=["llm", "tool_invoker"]
-    ):
-        final_result = result
+    reply = None
+    chat_history = None
+    with tracing.tracer.trace("agent.run", tags={"agent.streaming": False}), prefetch_search(question), \
+            collect_session_ids() as document_ids, discard_unjoined_dispatches():
+        async for result in pipeline.run(
+                data={
+                    "llm": {"messages": messages, "tools": tools},
+                    "agent_visualizer": {"tools": tools, "output_mode": output_mode},
+                },
+                # include_outputs_from=["llm", "tool_invoker"]
+        ):
+            final_result = result
+            if result.get("llm", {}).get("replies"):
+                reply = result["llm"]["replies"][0]
+            if result.get("llm", {}).get("chat_history"):
+                chat_history = result["llm"]["chat_history"]
 
     output = final_result["agent_visualizer"]["output"]
+    await save_session(client_messages, output, chat_history, document_ids, session)
+    if details:
+        return {
+            "output": output,
+            "answer": reply.text if reply else None,
+            "usage": reply.meta.get("run_usage") if reply else None,
+        }
     return output
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""
+Answers a batch of conversations with the agent, e.g. for nightly evaluations or to pre-answer frequent questions.
+
+Reads a JSONL file with one conversation per line, either `{"id": ..., "messages": [...]}` with OpenAI chat messages
+or `{"id": ..., "question": "..."}`, runs up to `--concurrency` agent runs at once and appends one JSON line per
+conversation to the output file as soon as it is answered:
+
+    python -m batch_qa questions.jsonl answers.jsonl --concurrency 8
+
+Identical searches of all conversations are run only once, see `retrieval.shared_searches`. An interrupted batch
+is resumed by running the same command again: conversations whose id is already in the output file are skipped,
+failed ones are retried with `--retry-errors`, the last line of an id counts. Lines without an `id` are identified
+by their line number.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from haystack import logging
+
+from agent import run_pipeline
+from retrieval import shared_searches
+
+logger = logging.getLogger(__name__)
+
+
+def load_conversations(path: Path) -> List[Dict[str, Any]]:
+    conversations = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            messages = entry.get("messages") or [{"role": "user", "content": entry["question"]}]
+            conversations.append({"id": str(entry.get("id", f"line-{number}")), "messages": messages})
+    return conversations
+
+
+def load_answered(path: Path, retry_errors: bool) -> Set[str]:
+    """
+    Returns the ids already in the output file and cuts off a line that was only partly written when the previous
+    run was interrupted.
+    """
+    if not path.exists():
+        return set()
+    with open(path, "rb+") as f:
+        content = f.read()
+        end = content.rfind(b"\n") + 1
+        if end < len(content):
+            f.truncate(end)
+
+    answered = set()
+    for line in content[:end].decode("utf-8").splitlines():
+        if line.strip():
+            record = json.loads(line)
+            if not (retry_errors and record.get("error")):
+                answered.add(record["id"])
+    return answered
+
+
+async def answer(conversation: Dict[str, Any]) -> Dict[str, Any]:
+    started_at = time.perf_counter()
+    record: Dict[str, Any] = {"id": conversation["id"]}
+    try:
+        result = await run_pipeline(conversation["messages"], details=True)
+        record.update(answer=result["answer"], usage=result["usage"], error=None)
+    except Exception as error:  # noqa: BLE001 - one failed conversation must not stop the batch
+        logger.warning("Conversation {id} failed: {error}", id=conversation["id"], error=error)
+        record.update(answer=None, usage=None, error=f"{type(error).__name__}: {error}")
+    record["seconds"] = round(time.perf_counter() - started_at, 3)
+    return record
+
+
+async def run_batch(conversations: List[Dict[str, Any]], output: Path, concurrency: int = 4) -> Dict[str, Any]:
+    """
+    Answers the conversations and appends the answers to `output`.
+
+    :param conversations: Conversations with `id` and `messages`.
+    :param output: JSONL file the answers are appended to, one line per conversation in the order they finish.
+    :param concurrency: Agent runs at the same time.
+    :returns: The number of answered and failed conversations and the elapsed seconds.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for conversation in conversations:
+        queue.put_nowait(conversation)
+    stats = {"answered": 0, "failed": 0}
+    started_at = time.perf_counter()
+
+    with open(output, "a", encoding="utf-8") as f, shared_searches():
+        async def worker():
+            while not queue.empty():
+                record = await answer(queue.get_nowait())
+                # one complete line per conversation, so an interrupted batch can be resumed
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                stats["failed" if record["error"] else "answered"] += 1
+                done = stats["answered"] + stats["failed"]
+                if done % 25 == 0:
+                    logger.info(
+                        "Answered {done} of {total} conversations, {rate:.2f}/s",
+                        done=done,
+                        total=len(conversations),
+                        rate=done / (time.perf_counter() - started_at),
+                    )
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return {**stats, "seconds": time.perf_counter() - started_at}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", type=Path, help="JSONL file with the conversations.")
+    parser.add_argument("output", type=Path, help="JSONL file the answers are appended to.")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("BATCH_CONCURRENCY", "4")),
+        help="Agent runs at the same time, defaults to BATCH_CONCURRENCY or 4.",
+    )
+    parser.add_argument("--retry-errors", action="store_true", help="Answer failed conversations again.")
+    args = parser.parse_args()
+
+    conversations = load_conversations(args.input)
+    answered = load_answered(args.output, args.retry_errors)
+    pending = [conversation for conversation in conversations if conversation["id"] not in answered]
+    print(f"{len(conversations)} conversations, {len(conversations) - len(pending)} already answered")
+
+    stats = asyncio.run(run_batch(pending, args.output, args.concurrency))
+    print(
+        f"answered {stats['answered']}, failed {stats['failed']} in {stats['seconds']:.1f} s "
+        f"({(stats['answered'] + stats['failed']) / stats['seconds'] if stats['seconds'] else 0:.2f}/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
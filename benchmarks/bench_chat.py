@@ -0,0 +1,257 @@
+"""
+End-to-end benchmark of the chat endpoint without external services.
+
+Runs the real `utils/fast_api.py` app and agent pipeline against the scripted OpenAI stand-in from
+`benchmarks/fake_openai.py` and the in-memory document store seeded with the fixture corpus, and reports
+throughput, latency, time to first chunk and time to first answer token for each concurrency level.
+
+    python -m benchmarks.bench_chat --concurrency 1 4 16 --requests 48 --output bench_chat.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    rank = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[rank]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def simulate_search_latency(per_round_trip: float, per_query: float):
+    """
+    Delays the searches of the in-memory store like a remote document store, once per round trip and per query.
+    """
+    from custom_components.batch_bm25_retriever import BatchBM25Retriever
+
+    run_batch = BatchBM25Retriever.run_batch
+
+    def delayed_run_batch(self, queries):
+        time.sleep(per_round_trip + per_query * len(queries))
+        return run_batch(self, queries)
+
+    BatchBM25Retriever.run_batch = delayed_run_batch
+
+
+def load_corpus(corpus_dir: Path):
+    """
+    Reads the fixture corpus as one document per paragraph.
+    """
+    from haystack import Document
+
+    documents = []
+    for path in sorted(corpus_dir.glob("*")):
+        for paragraph in path.read_text(encoding="utf-8").split("\n\n"):
+            if paragraph.strip() and not paragraph.startswith("#"):
+                documents.append(Document(content=paragraph.strip(), meta={"file_path": path.name}))
+    return documents
+
+
+def load_questions(path: Path) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["query"] for line in f if line.strip()]
+
+
+async def run_request(client: httpx.AsyncClient, url: str, question: str, stream: bool) -> Dict[str, Any]:
+    # without tool results in the stream, every content chunk that is not a progress event belongs to the answer
+    payload = {
+        "model": "haystack-agent",
+        "messages": [{"role": "user", "content": question}],
+        "stream": stream,
+        "output_mode": "none",
+    }
+    started_at = time.perf_counter()
+    first_chunk = None
+    first_token = None
+
+    if not stream:
+        response = await client.post(url, json=payload)
+        response.raise_for_status()
+        return {"latency": time.perf_counter() - started_at, "ttfc": None, "ttft": None}
+
+    async with client.stream("POST", url, json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_token is not None or not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - started_at
+            chunk = json.loads(line[6:])
+            if "agent_progress" not in chunk and chunk["choices"][0]["delta"].get("content"):
+                first_token = time.perf_counter() - started_at
+    return {"latency": time.perf_counter() - started_at, "ttfc": first_chunk, "ttft": first_token}
+
+
+async def run_level(url: str, questions: List[str], concurrency: int, requests: int, stream: bool) -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for i in pending:
+            try:
+                results.append(await run_request(client, url, questions[i % len(questions)], stream))
+            except Exception:  # noqa: BLE001 - errors are counted and reported
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started_at
+
+    latencies = [r["latency"] for r in results]
+    ttfcs = [r["ttfc"] for r in results if r["ttfc"] is not None]
+    ttfts = [r["ttft"] for r in results if r["ttft"] is not None]
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": len(results) / elapsed,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p99_s": percentile(latencies, 99),
+        "ttfc_p50_s": percentile(ttfcs, 50),
+        "ttfc_p99_s": percentile(ttfcs, 99),
+        "ttft_p50_s": percentile(ttfts, 50),
+        "ttft_p99_s": percentile(ttfts, 99),
+    }
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level.")
+    parser.add_argument("--no-stream", action="store_true", help="Benchmark non-streaming requests.")
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Let concurrent requests with the same question share one agent run (CHAT_COALESCING).",
+    )
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument(
+        "--model-speed",
+        action="append",
+        default=[],
+        metavar="MODEL=TPS",
+        help="Tokens per second of a specific model, e.g. gpt-4o-mini=200 to benchmark an AGENT_MODEL_POLICY.",
+    )
+    parser.add_argument("--script", type=Path, help="JSON file with the turns played by the fake OpenAI server.")
+    parser.add_argument(
+        "--search-latency",
+        type=float,
+        default=0.0,
+        help="Seconds added to every round trip to the document store, e.g. 0.05 to simulate OpenSearch.",
+    )
+    parser.add_argument(
+        "--search-query-latency",
+        type=float,
+        default=0.0,
+        help="Seconds added per query of a round trip, e.g. for the per-query work of reranking.",
+    )
+    parser.add_argument(
+        "--no-eager-tool-calls",
+        action="store_true",
+        help="Start the tool calls only once the assistant message is complete (AGENT_EAGER_TOOL_CALLS=false).",
+    )
+    parser.add_argument("--corpus", type=Path, default=FIXTURES / "corpus")
+    parser.add_argument("--questions", type=Path, default=FIXTURES / "queries.jsonl")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON, e.g. to compare against a baseline.")
+    args = parser.parse_args()
+
+    from benchmarks.fake_openai import create_app
+
+    script = json.loads(args.script.read_text()) if args.script else None
+    model_speeds = {model: float(speed) for model, _, speed in (entry.partition("=") for entry in args.model_speed)}
+    fake_port = free_port()
+    start_server(
+        create_app(
+            script,
+            tokens_per_second=args.tokens_per_second,
+            first_token_latency=args.first_token_latency,
+            model_tokens_per_second=model_speeds,
+        ),
+        fake_port,
+    )
+
+    # must be set before the app and the pipelines are imported
+    os.environ["DOCUMENT_STORE"] = "memory"
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{fake_port}/v1"
+    # every request runs the agent unless the benchmark is about coalescing
+    os.environ["CHAT_COALESCING"] = "true" if args.coalesce else "false"
+    # all benchmark requests come from one client, set the CHAT_MAX_* variables to benchmark the admission limits
+    os.environ.setdefault("CHAT_MAX_CONCURRENCY", "0")
+    os.environ.setdefault("CHAT_MAX_CONCURRENCY_PER_CLIENT", "0")
+    if args.no_eager_tool_calls:
+        os.environ["AGENT_EAGER_TOOL_CALLS"] = "false"
+    if args.search_latency or args.search_query_latency:
+        simulate_search_latency(args.search_latency, args.search_query_latency)
+
+    from retrieval import get_document_store
+    from utils.fast_api import app
+
+    get_document_store().write_documents(load_corpus(args.corpus))
+    app_port = free_port()
+    start_server(app, app_port)
+
+    url = f"http://127.0.0.1:{app_port}/v1/chat/completions"
+    questions = load_questions(args.questions)
+    stream = not args.no_stream
+
+    # warm up, the pipeline is built lazily on the first request
+    asyncio.run(run_level(url, questions, 1, 1, stream))
+
+    results = []
+    print(
+        f"{'conc':>5} {'reqs':>5} {'err':>4} {'rps':>8} {'p50 s':>8} {'p99 s':>8} "
+        f"{'ttfc p50':>9} {'ttfc p99':>9} {'ttft p50':>9} {'ttft p99':>9}"
+    )
+    for concurrency in args.concurrency:
+        result = asyncio.run(run_level(url, questions, concurrency, args.requests, stream))
+        results.append(result)
+        print(
+            f"{result['concurrency']:>5} {result['requests']:>5} {result['errors']:>4} "
+            f"{result['throughput_rps']:>8.2f} {_fmt(result['latency_p50_s']):>8} {_fmt(result['latency_p99_s']):>8} "
+            f"{_fmt(result['ttfc_p50_s']):>9} {_fmt(result['ttfc_p99_s']):>9} "
+            f"{_fmt(result['ttft_p50_s']):>9} {_fmt(result['ttft_p99_s']):>9}"
+        )
+
+    if args.output:
+        args.output.write_text(json.dumps({"stream": stream, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Retrieval quality and latency benchmark for the indexing and search pipelines.
+
+Ingests the fixture corpus with `retrieval.init_indexing_pipeline` into a fresh document store per configuration,
+runs the labeled queries through `retrieval.create_pipeline`, optionally with the cross-encoder (`--rerank`) and
+context packing (`--pack`), and reports recall@k, MRR, query latency percentiles, estimated prompt tokens, index
+size and ingest throughput:
+
+    python -m benchmarks.bench_retrieval --split-lengths 100 250 --split-overlaps 0 50 --top-k 3 6
+
+A query counts as a hit for a retrieved chunk if the chunk comes from one of the files listed in `relevant`.
+The `opensearch` backend writes to separate `bench_*` indices of the configured OpenSearch instance, the `embedded`
+backend to `bench_*` directories below `EMBEDDED_INDEX_PATH`, which are rebuilt on every run.
+"""
+import argparse
+import itertools
+import json
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.bench_chat import FIXTURES, percentile
+from retrieval import (
+    create_pipeline,
+    ensure_opensearch_index,
+    init_document_store,
+    init_indexing_pipeline,
+    pipeline_inputs,
+)
+
+
+def load_queries(path: Path) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def ingest(document_store, sources: List[Path], split_length: int, split_overlap: int) -> Dict[str, Any]:
+    # without the parsed document cache, so that every configuration measures the conversion
+    indexing_pipeline = init_indexing_pipeline(
+        document_store, split_length=split_length, split_overlap=split_overlap, use_cache=False
+    )
+
+    started_at = time.perf_counter()
+    result = indexing_pipeline.run({"file_type_router": {"sources": sources}})
+    elapsed = time.perf_counter() - started_at
+
+    chunks = document_store.filter_documents()
+    return {
+        "ingest_s": elapsed,
+        "ingest_files_per_s": len(sources) / elapsed,
+        "ingest_chunks_per_s": result["document_writer"]["documents_written"] / elapsed,
+        "ingest_skipped": result["file_converter"]["skipped"],
+        "conversion": result["file_converter"]["stats"],
+        "index_chunks": len(chunks),
+        "index_duplicates": result.get("near_duplicate_filter", {}).get("stats", {}).get("duplicates", 0),
+        "index_words": sum(len((chunk.content or "").split()) for chunk in chunks),
+    }
+
+
+def evaluate(
+    document_store,
+    queries: List[Dict[str, Any]],
+    top_k: int,
+    repeat: int,
+    rerank: bool = False,
+    pack: bool = False,
+    token_budget: Optional[int] = None,
+) -> Dict[str, Any]:
+    pipeline = create_pipeline(document_store, top_k=top_k, rerank=rerank, pack=pack)
+    last_stage = "context_packer" if pack else "ranker" if rerank else "retriever"
+    latencies, recalls, reciprocal_ranks, prompt_tokens = [], [], [], []
+
+    for query in queries:
+        relevant = set(query["relevant"])
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            result = pipeline.run(
+                data=pipeline_inputs(query["query"], top_k, rerank, pack, token_budget),
+                include_outputs_from={last_stage},
+            )
+            latencies.append(time.perf_counter() - started_at)
+
+        sources = [Path(doc.meta.get("file_path", "")).name for doc in result[last_stage]["documents"]]
+        recalls.append(len(relevant & set(sources)) / len(relevant))
+        rank = next((i for i, source in enumerate(sources, start=1) if source in relevant), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        # rough estimate of the tokens the tool result adds to the LLM prompt
+        prompt_tokens.append(len(result["chat_prompt_builder"]["prompt"][0].text) / 4)
+
+    return {
+        "top_k": top_k,
+        "rerank": rerank,
+        "pack": pack,
+        "recall_at_k": sum(recalls) / len(recalls),
+        "mrr": sum(reciprocal_ranks) / len(reciprocal_ranks),
+        "query_p50_ms": percentile(latencies, 50) * 1000,
+        "query_p95_ms": percentile(latencies, 95) * 1000,
+        "query_p99_ms": percentile(latencies, 99) * 1000,
+        "prompt_tokens_est": sum(prompt_tokens) / len(prompt_tokens),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["memory"], choices=["memory", "embedded", "opensearch"])
+    parser.add_argument("--split-lengths", type=int, nargs="+", default=[100, 250])
+    parser.add_argument("--split-overlaps", type=int, nargs="+", default=[0, 50])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[3, 5, 6])
+    parser.add_argument("--rerank", action="store_true", help="Rerank the BM25 candidates with the cross-encoder.")
+    parser.add_argument("--pack", action="store_true", help="Pack the search results into a token budget.")
+    parser.add_argument("--token-budget", type=int, help="Token budget for --pack, defaults to CONTEXT_TOKEN_BUDGET.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query for the latency percentiles.")
+    parser.add_argument("--corpus", type=Path, default=FIXTURES / "corpus")
+    parser.add_argument("--queries", type=Path, default=FIXTURES / "queries.jsonl")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON.")
+    args = parser.parse_args()
+
+    sources = sorted(path for path in args.corpus.glob("**/*") if path.is_file())
+    queries = load_queries(args.queries)
+
+    results = []
+    print(
+        f"{'backend':>10} {'split':>5} {'ovl':>4} {'k':>3} {'recall':>7} {'mrr':>6} {'p50 ms':>7} {'p99 ms':>7} "
+        f"{'tokens':>7} {'chunks':>6} {'chunks/s':>9}"
+    )
+    for backend, split_length, split_overlap in itertools.product(args.backends, args.split_lengths, args.split_overlaps):
+        if split_overlap >= split_length:
+            continue
+        document_store = init_document_store(backend, index=f"bench_{split_length}_{split_overlap}")
+        if backend == "embedded":
+            shutil.rmtree(document_store.path, ignore_errors=True)
+            document_store = init_document_store(backend, index=f"bench_{split_length}_{split_overlap}")
+        if backend == "opensearch":
+            ensure_opensearch_index(document_store)
+        ingest_stats = ingest(document_store, sources, split_length, split_overlap)
+
+        for top_k in args.top_k:
+            result = {
+                "backend": backend,
+                "split_length": split_length,
+                "split_overlap": split_overlap,
+                **ingest_stats,
+                **evaluate(document_store, queries, top_k, args.repeat, args.rerank, args.pack, args.token_budget),
+            }
+            results.append(result)
+            print(
+                f"{backend:>10} {split_length:>5} {split_overlap:>4} {top_k:>3} {result['recall_at_k']:>7.3f} "
+                f"{result['mrr']:>6.3f} {result['query_p50_ms']:>7.2f} {result['query_p99_ms']:>7.2f} "
+                f"{result['prompt_tokens_est']:>7.0f} {result['index_chunks']:>6} {result['ingest_chunks_per_s']:>9.1f}"
+            )
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
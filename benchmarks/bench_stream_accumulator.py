@@ -0,0 +1,246 @@
+"""
+Microbenchmark of the accumulation of a streamed OpenAI response.
+
+Compares the previous approach (a verbatim copy of the stream handling of the base commit: a `StreamingChunk` with a
+meta dict per token, all chunks retained until the end of the stream and then joined and re-walked for tool calls)
+with `OpenAIChatGenerator._handle_stream_response` and its incremental `StreamAccumulator`, and reports
+CPU time, allocated memory and memory retained at the end of the stream per 1k tokens:
+
+    python -m benchmarks.bench_stream_accumulator --tokens 1000 --repeat 200
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from haystack import logging
+from haystack.dataclasses import StreamingChunk
+from haystack.utils import Secret
+from haystack_experimental.dataclasses import ChatMessage, ToolCall
+from haystack_experimental.dataclasses.streaming_chunk import StreamingCallbackT
+from openai import Stream
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice
+
+from custom_components.openai_generator import OpenAIChatGenerator
+
+logger = logging.getLogger(__name__)
+
+
+def make_stream(tokens: int, tool_calls: int) -> List[ChatCompletionChunk]:
+    def chunk(delta: Dict[str, Any], finish=None) -> ChatCompletionChunk:
+        return ChatCompletionChunk.model_validate({
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        })
+
+    if tool_calls:
+        # like OpenAI, tool calls carry the role in their first delta
+        stream = []
+        per_call = max(1, tokens // tool_calls)
+        for index in range(tool_calls):
+            arguments = json.dumps({"query": " ".join(["Brot"] * (per_call - 4)), "top_k": 6})
+            fragments = [arguments[i:i + 4] for i in range(0, len(arguments), 4)]
+            role = {} if stream else {"role": "assistant", "content": None}
+            stream.append(chunk({**role, "tool_calls": [{"index": index, "id": f"call_{index}", "type": "function",
+                                                         "function": {"name": "suche_interne_kenntnisse",
+                                                                      "arguments": ""}}]}))
+            stream.extend(chunk({"tool_calls": [{"index": index, "function": {"arguments": fragment}}]})
+                          for fragment in fragments)
+        stream.append(chunk({}, "tool_calls"))
+    else:
+        stream = [chunk({"role": "assistant", "content": ""})]
+        stream.extend(chunk({"content": f"Wort{i % 50} "}) for i in range(tokens))
+        stream.append(chunk({}, "stop"))
+    return stream
+
+
+class BaseCommitStreaming:
+    """
+    The previous implementation: the stream handling of `OpenAIChatGenerator` as of the base commit, copied
+    verbatim. One `StreamingChunk` with a meta dict per token, all chunks retained until the end of the stream and
+    then joined and re-walked for tool calls.
+    """
+
+    def _handle_stream_response(
+        self,
+        chat_completion: Stream,
+        callback: StreamingCallbackT,
+    ) -> List[ChatMessage]:
+        chunks: List[StreamingChunk] = []
+        chunk = None
+
+        for chunk in chat_completion:  # pylint: disable=not-an-iterable
+            assert (
+                len(chunk.choices) == 1
+            ), "Streaming responses should have only one choice."
+            chunk_delta: StreamingChunk = (
+                self._convert_chat_completion_chunk_to_streaming_chunk(chunk)
+            )
+            chunks.append(chunk_delta)
+
+            callback(chunk_delta)
+
+        return [self._convert_streaming_chunks_to_chat_message(chunk, chunks)]
+
+    def _convert_streaming_chunks_to_chat_message(
+        self, chunk: Any, chunks: List[StreamingChunk]
+    ) -> ChatMessage:
+        """
+        Connects the streaming chunks into a single ChatMessage.
+
+        :param chunk: The last chunk returned by the OpenAI API.
+        :param chunks: The list of all `StreamingChunk` objects.
+        """
+
+        text = "".join([chunk.content for chunk in chunks])
+        tool_calls = []
+
+        # if it's a tool call , we need to build the payload dict from all the chunks
+        if bool(chunks[0].meta.get("tool_calls")):
+            tools_len = len(chunks[0].meta.get("tool_calls", []))
+
+            payloads = [{"arguments": "", "name": ""} for _ in range(tools_len)]
+            for chunk_payload in chunks:
+                deltas = chunk_payload.meta.get("tool_calls") or []
+
+                # deltas is a list of ChoiceDeltaToolCall or ChoiceDeltaFunctionCall
+                for i, delta in enumerate(deltas):
+                    payloads[i]["id"] = delta.id or payloads[i].get("id", "")
+                    if delta.function:
+                        payloads[i]["name"] += delta.function.name or ""
+                        payloads[i]["arguments"] += delta.function.arguments or ""
+
+            for payload in payloads:
+                arguments_str = payload["arguments"]
+                try:
+                    arguments = json.loads(arguments_str)
+                    tool_calls.append(
+                        ToolCall(
+                            id=payload["id"],
+                            tool_name=payload["name"],
+                            arguments=arguments,
+                        )
+                    )
+                except json.JSONDecodeError:
+                    logger.warning(
+                        "OpenAI returned a malformed JSON string for tool call arguments. This tool call "
+                        "will be skipped. To always generate a valid JSON, set `tools_strict` to `True`. "
+                        "Tool call ID: {_id}, Tool name: {_name}, Arguments: {_arguments}",
+                        _id=payload["id"],
+                        _name=payload["name"],
+                        _arguments=arguments_str,
+                    )
+
+        meta = {
+            "model": chunk.model,
+            "index": 0,
+            "finish_reason": chunk.choices[0].finish_reason,
+            "usage": {},  # we don't have usage data for streaming responses
+        }
+
+        return ChatMessage.from_assistant(text=text, tool_calls=tool_calls, meta=meta)
+
+    def _convert_chat_completion_chunk_to_streaming_chunk(
+        self, chunk: ChatCompletionChunk
+    ) -> StreamingChunk:
+        """
+        Converts the streaming response chunk from the OpenAI API to a StreamingChunk.
+
+        :param chunk: The chunk returned by the OpenAI API.
+        :param choice: The choice returned by the OpenAI API.
+        :return: The StreamingChunk.
+        """
+        # we stream the content of the chunk if it's not a tool or function call
+        choice: ChunkChoice = chunk.choices[0]
+        content = choice.delta.content or ""
+        chunk_message = StreamingChunk(content)
+        # but save the tool calls and function call in the meta if they are present
+        # and then connect the chunks in the _convert_streaming_chunks_to_chat_message method
+        chunk_message.meta.update(
+            {
+                "model": chunk.model,
+                "index": choice.index,
+                "tool_calls": choice.delta.tool_calls,
+                "finish_reason": choice.finish_reason,
+            }
+        )
+        return chunk_message
+
+
+def _recording_end_of_stream(stream: List[ChatCompletionChunk], state: Dict[str, int]) -> Iterator[ChatCompletionChunk]:
+    # the memory still held once the last chunk was consumed, before the message is built
+    yield from stream
+    state["retained"] = tracemalloc.get_traced_memory()[0]
+
+
+def baseline(stream: List[ChatCompletionChunk]):
+    state = {"retained": 0}
+    message = BaseCommitStreaming()._handle_stream_response(_recording_end_of_stream(stream, state), lambda _: None)[0]
+    return message.text, message.tool_calls, state["retained"]
+
+
+def incremental(stream: List[ChatCompletionChunk]):
+    state = {"retained": 0}
+    message = _generator()._handle_stream_response(
+        _recording_end_of_stream(stream, state), lambda _: None, time.perf_counter()
+    )[0]
+    return message.text, message.tool_calls, state["retained"]
+
+
+_bench_generator: Optional[OpenAIChatGenerator] = None
+
+
+def _generator() -> OpenAIChatGenerator:
+    global _bench_generator
+    if _bench_generator is None:
+        # no request is sent, the client only needs a key
+        _bench_generator = OpenAIChatGenerator(api_key=Secret.from_token("benchmark"))
+    return _bench_generator
+
+
+def measure(fn: Callable, stream: List[ChatCompletionChunk], repeat: int, tokens: int) -> Dict[str, float]:
+    started_at = time.process_time()
+    for _ in range(repeat):
+        fn(stream)
+    cpu = (time.process_time() - started_at) / repeat
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    _, _, retained = fn(stream)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    scale = 1000 / tokens
+    return {
+        "cpu_ms": cpu * 1000 * scale,
+        "peak_kib": (peak - start) / 1024 * scale,
+        "retained_kib": (retained - start) / 1024 * scale,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'stream':>12} {'impl':>12} {'cpu ms/1k':>10} {'peak KiB/1k':>12} {'retained KiB/1k':>16}")
+    _generator()
+    for name, tool_calls in (("text", 0), ("1 tool call", 1), ("3 tool calls", 3)):
+        stream = make_stream(args.tokens, tool_calls)
+        base_text, base_tool_calls, _ = baseline(stream)
+        text, assembled_tool_calls, _ = incremental(stream)
+        assert (text or "") == (base_text or "")
+        # the previous implementation merged the deltas of parallel tool calls into one and dropped the result
+        if tool_calls <= 1:
+            assert [call.arguments for call in assembled_tool_calls] == [call.arguments for call in base_tool_calls]
+        for impl, fn in (("baseline", baseline), ("incremental", incremental)):
+            result = measure(fn, stream, args.repeat, args.tokens)
+            print(f"{name:>12} {impl:>12} {result['cpu_ms']:>10.3f} {result['peak_kib']:>12.1f} {result['retained_kib']:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Scripted OpenAI-compatible chat completions server for offline benchmarks.
+
+The server answers `/v1/chat/completions` like OpenAI does, streaming and non-streaming, but follows a fixed
+script instead of a model. The script is a list of turns, the turn that is played is the number of assistant
+messages after the latest user message, so every agent run replays the script from the start:
+
+```json
+[
+  {"tool_calls": [{"name": "umformulieren_anfrage", "arguments": {"originalfrage": "{question}"}}]},
+  {"tool_calls": [{"name": "suche_interne_kenntnisse", "arguments": {"query": "{question}", "top_k": 6}}]},
+  {"answer_tokens": 120}
+]
+```
+
+`{question}` is replaced with the latest user message. Once the script is exhausted, the last turn is repeated.
+Calls without tools get the last turn without tool calls, and calls with a JSON schema `response_format`, like
+the planning call of `AGENT_MODE=plan`, get the `plan` of the script (default: one search for the question).
+"""
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+DEFAULT_SCRIPT = [
+    {"tool_calls": [{"name": "umformulieren_anfrage", "arguments": {"originalfrage": "{question}"}}]},
+    {"tool_calls": [{"name": "suche_interne_kenntnisse", "arguments": {"query": "{question}", "top_k": 6}}]},
+    {"answer_tokens": 120},
+]
+
+DEFAULT_PLAN = {"umformulierte_frage": "{question}", "suchanfragen": [{"query": "{question}", "top_k": 6}]}
+
+ANSWER_WORDS = "Das Brot wird aus Mehl Wasser Salz und Hefe hergestellt und anschließend im Ofen gebacken".split()
+
+
+def _fill(value: Any, question: str) -> Any:
+    if isinstance(value, str):
+        return value.replace("{question}", question)
+    if isinstance(value, dict):
+        return {key: _fill(item, question) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, question) for item in value]
+    return value
+
+
+def _split(text: str, size: int) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def create_app(
+    script: Optional[List[Dict[str, Any]]] = None,
+    tokens_per_second: float = 80.0,
+    first_token_latency: float = 0.3,
+    model: str = "gpt-4o",
+    model_tokens_per_second: Optional[Dict[str, float]] = None,
+) -> FastAPI:
+    """
+    Creates the fake OpenAI server.
+
+    :param script: Turns to play per agent run, see the module docstring. Defaults to rewrite, search, answer.
+    :param tokens_per_second: Generation speed after the first token, `0` disables the delay.
+    :param first_token_latency: Delay in seconds before the first token of every call.
+    :param model: Model name reported in the responses of requests without a model.
+    :param model_tokens_per_second: Generation speed of specific models, e.g. a faster small model.
+    """
+    script = script or DEFAULT_SCRIPT
+    speeds = model_tokens_per_second or {}
+    app = FastAPI()
+
+    def select_turn(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        last_user = max(i for i, message in enumerate(messages) if message["role"] == "user")
+        turn = sum(1 for message in messages[last_user:] if message["role"] == "assistant")
+        return script[min(turn, len(script) - 1)], messages[last_user]["content"]
+
+    def plan_tokens(turn: Dict[str, Any], question: str):
+        """
+        Returns the generated output as a list of (text, tool_call_index, tool_call_id, name, argument_fragment).
+        """
+        tokens = []
+        for index, tool_call in enumerate(turn.get("tool_calls", [])):
+            call_id = f"call_{uuid.uuid4().hex[:24]}"
+            arguments = json.dumps(_fill(tool_call["arguments"], question), ensure_ascii=False)
+            fragments = _split(arguments, 4)
+            tokens.append((None, index, call_id, tool_call["name"], fragments[0]))
+            tokens.extend((None, index, None, None, fragment) for fragment in fragments[1:])
+        if "text" in turn:
+            tokens.extend((fragment, None, None, None, None) for fragment in _split(turn["text"], 4))
+        for i in range(turn.get("answer_tokens", 0)):
+            tokens.append((ANSWER_WORDS[i % len(ANSWER_WORDS)] + " ", None, None, None, None))
+        return tokens
+
+    def usage(messages: List[Dict[str, Any]], completion_tokens: int) -> Dict[str, int]:
+        prompt_tokens = sum(len(str(message.get("content") or "")) for message in messages) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body["messages"]
+        # responses report the requested model like OpenAI, so per-model metrics can be checked
+        reported_model = body.get("model") or model
+        speed = speeds.get(reported_model, tokens_per_second)
+        token_delay = 1.0 / speed if speed > 0 else 0.0
+        turn, question = select_turn(messages)
+        if body.get("response_format", {}).get("type") == "json_schema":
+            plan = next((entry["plan"] for entry in script if "plan" in entry), DEFAULT_PLAN)
+            turn = {"text": json.dumps(_fill(plan, question), ensure_ascii=False)}
+        elif not body.get("tools"):
+            turn = next((entry for entry in reversed(script) if not entry.get("tool_calls")), {"answer_tokens": 120})
+        tokens = plan_tokens(turn, question)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        finish_reason = "tool_calls" if turn.get("tool_calls") else "stop"
+
+        if not body.get("stream"):
+            await asyncio.sleep(first_token_latency + token_delay * len(tokens))
+            message: Dict[str, Any] = {"role": "assistant", "content": None}
+            if turn.get("tool_calls"):
+                calls: Dict[int, Dict[str, Any]] = {}
+                for _, index, call_id, name, fragment in tokens:
+                    call = calls.setdefault(index, {"id": call_id, "type": "function",
+                                                    "function": {"name": name, "arguments": ""}})
+                    call["function"]["arguments"] += fragment
+                message["tool_calls"] = list(calls.values())
+            else:
+                message["content"] = "".join(token[0] for token in tokens)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": reported_model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage(messages, len(tokens)),
+            }
+
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": reported_model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(first_token_latency)
+            # like OpenAI, text answers start with an empty role delta while tool calls carry the role in their first delta
+            role: Dict[str, Any] = {"role": "assistant", "content": None}
+            if not turn.get("tool_calls"):
+                yield chunk({"role": "assistant", "content": ""})
+                role = {}
+            for text, index, call_id, name, fragment in tokens:
+                if text is not None:
+                    yield chunk({"content": text})
+                else:
+                    function: Dict[str, Any] = {"arguments": fragment}
+                    tool_call: Dict[str, Any] = {"index": index, "function": function}
+                    if call_id:
+                        tool_call.update({"id": call_id, "type": "function"})
+                        function["name"] = name
+                    yield chunk({**role, "tool_calls": [tool_call]})
+                    role = {}
+                if token_delay:
+                    await asyncio.sleep(token_delay)
+            yield chunk({}, finish_reason)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": reported_model,
+                    "choices": [],
+                    "usage": usage(messages, len(tokens)),
+                }
+                yield f"data: {json.dumps(payload)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
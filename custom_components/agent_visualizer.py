@@ -2,20 +2,76 @@ from typing import Any, Dict, List, Optional
 from haystack import component
 from haystack_experimental.dataclasses import ChatMessage, Tool, ChatRole
 import json
+import re
+
+# `full` shows the complete tool results, `summarized` the arguments and the beginning of each retrieved document,
+# `none` only the answer
+OUTPUT_MODES = ("full", "summarized", "none")
+
+# a document of a search result rendered with `retrieval.USER_MESSAGE_TEMPLATE`
+_DOCUMENT_BLOCK = re.compile(
+    r"^Document\[\d+\](?: \((?P<source>[^\n]*)\))?\n(?P<content>.*?)(?=^Document\[\d+\]|\Z)", re.M | re.S
+)
+
+
+def _shorten(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+
+def summarize_tool_call(
+    tool_name: str, arguments: Dict[str, Any], result: Any, error: bool = False, snippet_chars: int = 160
+) -> str:
+    """
+    Renders a tool call compactly for the client: the tool with its arguments and, for search results, the source
+    and the beginning of each document instead of the full text.
+
+    :param snippet_chars: Characters shown per document or of other results.
+    """
+    parameters = ", ".join(f"{name}: {value}" for name, value in arguments.items())
+    lines = [f"**{tool_name}** ({parameters})"]
+    text = str(result)
+    if error:
+        lines.append(f"- Error: {_shorten(text, snippet_chars)}")
+    elif "Document[" in text or text.strip() == "Dokumente:":
+        documents = list(_DOCUMENT_BLOCK.finditer(text))
+        for document in documents:
+            source = f"*{document.group('source')}*: " if document.group("source") else ""
+            lines.append(f"- {source}{_shorten(document.group('content'), snippet_chars)}")
+        if not documents:
+            lines.append("- No documents found")
+    else:
+        lines.append(f"- {_shorten(text, snippet_chars)}")
+    return "\n".join(lines)
+
 
 @component
 class AgentVisualizer:
-    def __init__(self, tools: Optional[List[Tool]] = None):
+    def __init__(self, tools: Optional[List[Tool]] = None, output_mode: str = "full"):
+        """
+        :param tools: Tools shown in the graph of the `full` output.
+        :param output_mode: Default output mode, one of `OUTPUT_MODES`.
+        """
         self.tools = tools or []
+        self.output_mode = output_mode
 
-    def run(self, messages: List[ChatMessage], tools: Optional[List[Tool]] = None) -> Dict[str, Any]:
+    def run(
+        self, messages: List[ChatMessage], tools: Optional[List[Tool]] = None, output_mode: Optional[str] = None
+    ) -> Dict[str, Any]:
         tool_names = [tool.name for tool in tools] if tools else []
         tool_calls = self.extract_tool_calls(messages)
+        output_mode = output_mode or self.output_mode
 
-        if not tool_calls:
+        if not tool_calls or output_mode == "none":
             return {"output": messages[-1].text if messages else "No messages available"}
 
-        visualization = self.visualize_toolcalls(tool_names, tool_calls)
+        if output_mode == "summarized":
+            visualization = "\n\n".join(
+                summarize_tool_call(call["tool_name"], call["parameters"], call["result"], call["error"])
+                for call in tool_calls
+            )
+        else:
+            visualization = self.visualize_toolcalls(tool_names, tool_calls)
 
         last_message_text = messages[-1].text if messages else "No messages available"
 
@@ -26,7 +82,9 @@ class AgentVisualizer:
     def extract_tool_calls(self, messages: List[ChatMessage]) -> List[Dict[str, Any]]:
         tool_calls = []
 
-        for message in messages:
+        # only the tool calls of the current run, a session history also holds those of earlier turns
+        last_user = max((i for i, message in enumerate(messages) if message.is_from(ChatRole.USER)), default=-1)
+        for message in messages[last_user + 1:]:
             # Check if the message contains a ToolCallResult
             if message.role == ChatRole.TOOL and message.tool_call_result:
                 result = message.tool_call_result
@@ -0,0 +1,90 @@
+from typing import Any, Dict, List, Optional, Tuple
+from haystack import Document, component
+from haystack.document_stores.errors import DocumentStoreError
+from haystack_integrations.document_stores.opensearch import OpenSearchDocumentStore
+
+# BM25 query of the OpenSearch searches, `$query` is replaced with the search query. `create_retriever` passes it
+# as `custom_query` to the `OpenSearchBM25Retriever`, so single and batched searches send the same request.
+OPENSEARCH_BM25_QUERY: Dict[str, Any] = {
+    "query": {
+        "bool": {
+            "must": [{"multi_match": {"query": "$query", "fuzziness": "AUTO", "type": "most_fields", "operator": "OR"}}]
+        }
+    }
+}
+
+
+def _render(template: Any, query: str) -> Any:
+    if isinstance(template, dict):
+        return {key: _render(value, query) for key, value in template.items()}
+    if isinstance(template, list):
+        return [_render(value, query) for value in template]
+    return query if template == "$query" else template
+
+
+def opensearch_search_body(query: str, top_k: int) -> Dict[str, Any]:
+    """
+    Returns the search request of `OpenSearchBM25Retriever` with `OPENSEARCH_BM25_QUERY` as its custom query.
+
+    The size and the excluded embedding are added like `OpenSearchDocumentStore` does for its BM25 searches.
+    """
+    return {**_render(OPENSEARCH_BM25_QUERY, query), "size": top_k, "_source": {"excludes": ["embedding"]}}
+
+
+@component
+class BatchBM25Retriever:
+    """
+    BM25 retriever stage of the search pipeline that can fetch the documents of several queries at once.
+
+    `run_batch` searches all queries in one round trip, a single `_msearch` for OpenSearch. The pipeline is then run
+    once per query with the fetched documents as `documents` input, so reranking, packing and prompt building are the
+    same for single, batched and prefetched searches. Without `documents`, `run` searches with the wrapped retriever.
+    """
+
+    def __init__(self, retriever: Any, document_store: Any):
+        """
+        :param retriever: The BM25 retriever of the document store, see `retrieval.create_retriever`.
+        :param document_store: The store the retriever searches.
+        """
+        self.retriever = retriever
+        self.document_store = document_store
+
+    def run_batch(self, queries: List[Tuple[str, int]]) -> List[List[Document]]:
+        """
+        Runs several BM25 searches at once.
+
+        :param queries: `(query, top_k)` pairs.
+        :returns: The retrieved documents for each query, in the order of `queries`.
+        """
+        if not queries:
+            return []
+        if not isinstance(self.document_store, OpenSearchDocumentStore):
+            # nothing to batch, the in-process stores have no round trips
+            return [self.retriever.run(query=query, top_k=top_k)["documents"] for query, top_k in queries]
+
+        # `_index` and `_deserialize_document` are private to the OpenSearch integration, see `create_retriever`
+        body = []
+        for query, top_k in queries:
+            body.extend(({"index": self.document_store._index}, opensearch_search_body(query, top_k)))
+        responses = self.document_store.client.msearch(body=body)["responses"]
+
+        results = []
+        for (query, _), response in zip(queries, responses):
+            if "error" in response:
+                raise DocumentStoreError(f"Search for '{query}' failed: {response['error']}")
+            results.append([self.document_store._deserialize_document(hit) for hit in response["hits"]["hits"]])
+        return results
+
+    @component.output_types(documents=List[Document])
+    def run(
+        self, query: str, top_k: Optional[int] = None, documents: Optional[List[Document]] = None
+    ) -> Dict[str, Any]:
+        """
+        :param query: The search query.
+        :param top_k: Maximum number of documents, overrides the `top_k` of the wrapped retriever.
+        :param documents: The documents of this query if they were fetched ahead, e.g. by `run_batch`.
+        :returns: The retrieved documents, best first.
+        """
+        if documents is not None:
+            return {"documents": documents if top_k is None else documents[:top_k]}
+        return {"documents": self.retriever.run(query=query, top_k=top_k)["documents"]}
@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+from haystack import Document, component, logging
+from haystack.components.converters.utils import get_bytestream_from_source, normalize_metadata
+from haystack.dataclasses import ByteStream
+from utils.metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+
+def package_versions(*packages: str) -> str:
+    """
+    Returns the installed versions of the given packages as one string, e.g. for a `CachedConverter` version.
+    """
+    versions = []
+    for package in packages:
+        try:
+            versions.append(f"{package}=={version(package)}")
+        except PackageNotFoundError:
+            versions.append(f"{package}==none")
+    return ",".join(versions)
+
+
+@component
+class CachedConverter:
+    """
+    Wraps a file converter and caches its output on disk by file content.
+
+    The cache key is the SHA-256 of the file content and the converter version, made of the converter class, its
+    init parameters and the given `version`. Changing the cleaning or splitting settings of the indexing pipeline
+    therefore only re-runs the cheap stages, while new or changed files and converter updates are converted again.
+    Entries are gzipped JSON files holding the text and the metadata added by the converter.
+    """
+
+    def __init__(self, converter: Any, cache_dir: Union[str, Path], version: str = ""):
+        """
+        :param converter: Converter component with a `run(sources, meta)` method returning `documents`.
+        :param cache_dir: Directory of the cache entries, created on first write.
+        :param version: Versions of the libraries the conversion depends on, see `package_versions`.
+        """
+        self.converter = converter
+        self.cache_dir = Path(cache_dir)
+        self.version = version
+        init_parameters = converter.to_dict().get("init_parameters", {}) if hasattr(converter, "to_dict") else {}
+        self._converter_version = json.dumps(
+            [f"{type(converter).__module__}.{type(converter).__qualname__}", init_parameters, version],
+            sort_keys=True,
+            default=str,
+        )
+
+    def _path(self, data: bytes) -> Path:
+        key = hashlib.sha256(self._converter_version.encode() + b"\0" + data).hexdigest()
+        return self.cache_dir / key[:2] / f"{key}.json.gz"
+
+    def _read(self, path: Path) -> Optional[List[Dict[str, Any]]]:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)["documents"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as error:
+            logger.warning("Ignoring unreadable cache entry {path}: {error}", path=path, error=error)
+            return None
+
+    def _write(self, path: Path, entries: List[Dict[str, Any]]):
+        # files with the same content may be converted on several threads at once
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+                json.dump({"documents": entries}, f, ensure_ascii=False, separators=(",", ":"))
+            # readers never see a partial entry
+            os.replace(tmp_path, path)
+        except OSError as error:
+            # the conversion succeeded, the file is converted again next time
+            logger.warning("Could not write cache entry {path}: {error}", path=path, error=error)
+            tmp_path.unlink(missing_ok=True)
+
+    @component.output_types(documents=List[Document])
+    def run(
+        self,
+        sources: List[Union[str, Path, ByteStream]],
+        meta: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        :param sources: File paths or ByteStream objects to convert.
+        :param meta: Metadata for all documents or one dictionary per source, as for the wrapped converter.
+        :returns: The converted documents, from the cache where possible.
+        """
+        documents = []
+        for source, metadata in zip(sources, normalize_metadata(meta, sources_count=len(sources))):
+            try:
+                bytestream = get_bytestream_from_source(source)
+            except Exception:  # noqa: BLE001 - the converter reports unreadable sources
+                documents.extend(self.converter.run(sources=[source], meta=[metadata])["documents"])
+                continue
+
+            source_meta = {**bytestream.meta, **metadata}
+            path = self._path(bytestream.data)
+            entries = self._read(path)
+            record_cache_lookup("parsed_documents", entries is not None)
+
+            if entries is None:
+                converted = self.converter.run(sources=[bytestream], meta=[metadata])["documents"]
+                # only the text and the metadata added by the converter are cached, the source metadata may differ
+                # for the next file with the same content
+                entries = [
+                    {
+                        "content": document.content,
+                        "meta": {key: value for key, value in document.meta.items() if key not in source_meta},
+                    }
+                    for document in converted
+                ]
+                if converted:
+                    self._write(path, entries)
+
+            documents.extend(
+                Document(content=entry["content"], meta={**entry["meta"], **source_meta}) for entry in entries
+            )
+        return {"documents": documents}
@@ -1,19 +1,197 @@
-from typing import Any, Dict, List
-from haystack import component
-from haystack_experimental.dataclasses import ChatMessage
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from haystack import component, logging, tracing
+from haystack_experimental.dataclasses import ChatMessage, ToolCall
 from haystack_experimental.components.tools import ToolInvoker
+from utils.metrics import TOOL_BATCH_DURATION, TOOL_BATCH_SIZE, TOOL_CALL_DURATION
+from utils.progress import ToolProgress
+
+logger = logging.getLogger(__name__)
+
+# tool calls dispatched within the current `discard_unjoined_dispatches` block, with their invoker
+_run_dispatches: contextvars.ContextVar[Optional[List[Tuple["ChatToolInvoker", str]]]] = contextvars.ContextVar(
+    "run_dispatches", default=None
+)
+
+
+@contextmanager
+def discard_unjoined_dispatches():
+    """
+    Discards the tool calls dispatched within the block that were never joined, e.g. because the agent run was
+    cancelled after the assistant message was complete but before the tool invoker ran. Without it their futures
+    stay on the shared invoker forever.
+    """
+    dispatches: List[Tuple["ChatToolInvoker", str]] = []
+    token = _run_dispatches.set(dispatches)
+    try:
+        yield
+    finally:
+        _run_dispatches.reset(token)
+        for invoker, tool_call_id in dispatches:
+            invoker.discard([tool_call_id])
 
 @component
 class ChatToolInvoker(ToolInvoker):
-    def __init__(self, **kwargs):
+    def __init__(self, batch_functions: Optional[Dict[str, Callable[[List[Dict[str, Any]]], List[Any]]]] = None, **kwargs):
+        """
+        :param batch_functions: Functions that handle several calls of the same tool in one go, by tool name.
+            Each receives the arguments of the calls and returns one result per call. Used when an assistant
+            message contains more than one call of such a tool that was not dispatched early.
+        """
         super(ChatToolInvoker, self).__init__(**kwargs)
+        self.batch_functions = batch_functions or {}
+        # tool calls started by `dispatch` before their assistant message was complete, by tool call id
+        self._dispatched: Dict[str, asyncio.Future] = {}
+
+    def _invoke(self, tool_call: ToolCall, progress: Optional[ToolProgress] = None) -> List[ChatMessage]:
+        progress = progress or ToolProgress(tool_call.tool_name, tool_call.arguments)
+        with tracing.tracer.trace("tool.call", tags={"tool.name": tool_call.tool_name}) as span:
+            span.set_content_tag("tool.arguments", tool_call.arguments)
+            started_at = time.perf_counter()
+            outcome = "error"
+            try:
+                parent_result = super(ChatToolInvoker, self).run([ChatMessage.from_assistant(tool_calls=[tool_call])])
+                error = any(message.tool_call_result.error for message in parent_result["tool_messages"])
+                outcome = "error" if error else "ok"
+            except Exception as exception:
+                progress.finished(str(exception), error=True)
+                raise
+            finally:
+                TOOL_CALL_DURATION.labels(tool=tool_call.tool_name, outcome=outcome).observe(time.perf_counter() - started_at)
+            span.set_tag("tool.error", error)
+            progress.finished(parent_result["tool_messages"][0].tool_call_result.result, error=error)
+            return parent_result["tool_messages"]
+
+    def _invoke_batch(self, tool_calls: List[ToolCall]) -> List[ChatMessage]:
+        tool_name = tool_calls[0].tool_name
+        with tracing.tracer.trace("tool.call_batch", tags={"tool.name": tool_name, "tool.batch_size": len(tool_calls)}) as span:
+            span.set_content_tag("tool.arguments", [tool_call.arguments for tool_call in tool_calls])
+            progresses = [ToolProgress(tool_call.tool_name, tool_call.arguments) for tool_call in tool_calls]
+            started_at = time.perf_counter()
+            try:
+                results = self.batch_functions[tool_name]([tool_call.arguments for tool_call in tool_calls])
+            except Exception as error:  # noqa: BLE001 - the single calls report or raise the error as usual
+                logger.warning(
+                    "Batched call of {tool_name} failed, invoking its {count} calls one by one: {error}",
+                    tool_name=tool_name,
+                    count=len(tool_calls),
+                    error=error,
+                )
+                span.set_tag("tool.error", True)
+                return [
+                    message
+                    for tool_call, progress in zip(tool_calls, progresses)
+                    for message in self._invoke(tool_call, progress)
+                ]
+
+            # the calls did not run alone, so the batch is recorded once instead of once per call
+            TOOL_BATCH_DURATION.labels(tool=tool_name).observe(time.perf_counter() - started_at)
+            TOOL_BATCH_SIZE.labels(tool=tool_name).observe(len(tool_calls))
+            for result, progress in zip(results, progresses):
+                progress.finished(result)
+            span.set_tag("tool.error", False)
+            return [self._prepare_tool_result_message(result, tool_call) for result, tool_call in zip(results, tool_calls)]
+
+    def _group(self, tool_calls: List[ToolCall]) -> List[List[int]]:
+        """
+        Groups the positions of the tool calls into invocations: all calls of a tool with a batch function
+        together, every other call on its own.
+        """
+        groups: List[List[int]] = []
+        batches: Dict[str, List[int]] = {}
+        for position, tool_call in enumerate(tool_calls):
+            if tool_call.tool_name not in self.batch_functions:
+                groups.append([position])
+            elif tool_call.tool_name in batches:
+                batches[tool_call.tool_name].append(position)
+            else:
+                batches[tool_call.tool_name] = [position]
+                groups.append(batches[tool_call.tool_name])
+        return groups
+
+    def _invoke_group(self, tool_calls: List[ToolCall]) -> List[ChatMessage]:
+        if len(tool_calls) == 1:
+            return self._invoke(tool_calls[0])
+        return self._invoke_batch(tool_calls)
+
+    def dispatch(self, tool_call: ToolCall) -> None:
+        """
+        Starts a tool call in the background while the model is still streaming the rest of its message.
+
+        The result is joined by `run_async` once it receives the assistant message with this tool call.
+        Must be called from the event loop.
+
+        :param tool_call: A complete tool call with an id.
+        """
+        if tool_call.id is None or tool_call.id in self._dispatched:
+            return
+        self._dispatched[tool_call.id] = asyncio.ensure_future(asyncio.to_thread(self._invoke, tool_call))
+        dispatches = _run_dispatches.get()
+        if dispatches is not None:
+            dispatches.append((self, tool_call.id))
+
+    def discard(self, tool_call_ids: List[str]) -> None:
+        """
+        Cancels dispatched tool calls whose assistant message will never reach this component, e.g. after an error.
+
+        :param tool_call_ids: Ids of the dispatched tool calls.
+        """
+        for tool_call_id in tool_call_ids:
+            future = self._dispatched.pop(tool_call_id, None)
+            if future is not None:
+                future.cancel()
 
     @component.output_types(tool_messages=List[ChatMessage])
     def run(self, messages: List[ChatMessage], *args, **kwargs) -> Dict[str, Any]:
 
-        parent_result = super(ChatToolInvoker, self).run([messages[-1]], *args, **kwargs)
+        tool_calls = messages[-1].tool_calls
+        results: List[List[ChatMessage]] = [[] for _ in tool_calls]
+        # calls of tools with a batch function share one invocation, every other call gets its own span
+        for group in self._group(tool_calls):
+            group_messages = self._invoke_group([tool_calls[position] for position in group])
+            for position, message in zip(group, group_messages):
+                results[position].append(message)
+        tool_messages = [message for result in results for message in result]
+
+        combined_messages = messages + tool_messages
+
+        return {"tool_messages": combined_messages}
+
+    @component.output_types(tool_messages=List[ChatMessage])
+    async def run_async(self, messages: List[ChatMessage], *args, **kwargs) -> Dict[str, Any]:
+        # tools block, so run them off the event loop and concurrently; unlike the pipeline's executor,
+        # asyncio.to_thread keeps the request's tracing context and does not serialize concurrent requests.
+        # Tool calls dispatched while the model was still streaming are only joined here, the remaining
+        # calls of tools with a batch function share one invocation.
+        tool_calls = messages[-1].tool_calls
+        results: List[List[ChatMessage]] = [[] for _ in tool_calls]
+        dispatched = {}
+        remaining = []
+        for position, tool_call in enumerate(tool_calls):
+            future = self._dispatched.pop(tool_call.id, None) if tool_call.id else None
+            if future is None:
+                remaining.append(position)
+            else:
+                dispatched[position] = future
+
+        async def join(position: int, future: asyncio.Future):
+            results[position].extend(await future)
+
+        async def invoke(group: List[int]):
+            group_messages = await asyncio.to_thread(self._invoke_group, [tool_calls[position] for position in group])
+            for position, message in zip(group, group_messages):
+                results[position].append(message)
+
+        groups = [[remaining[i] for i in group] for group in self._group([tool_calls[p] for p in remaining])]
+        await asyncio.gather(
+            *(join(position, future) for position, future in dispatched.items()),
+            *(invoke(group) for group in groups),
+        )
+        tool_messages = [message for result in results for message in result]
 
-        tool_messages = parent_result["tool_messages"]
         combined_messages = messages + tool_messages
 
         return {"tool_messages": combined_messages}
@@ -0,0 +1,150 @@
+import math
+import re
+from dataclasses import replace
+from typing import Any, Dict, List, Optional
+from haystack import Document, component
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[\"„(]?[A-ZÄÖÜ0-9])")
+_WORD = re.compile(r"\w+")
+_STOP_WORDS = {
+    "der", "die", "das", "den", "dem", "des", "ein", "eine", "einen", "einem", "einer", "und", "oder", "mit", "von",
+    "für", "auf", "aus", "bei", "nach", "wie", "was", "wer", "wann", "warum", "welche", "welcher", "welches", "ist",
+    "sind", "wird", "werden", "hat", "haben", "kann", "können", "nicht", "auch", "sich", "the", "and", "for", "what",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the tokens of a text for GPT-4o, about four characters per token.
+    """
+    return math.ceil(len(text) / 4)
+
+
+def query_terms(query: str) -> List[str]:
+    """
+    Returns the stems of the query words that are worth matching: no stop words, no words shorter than three
+    characters, and the last characters cut off so that inflected forms and compounds match as well.
+    """
+    terms = []
+    for word in _WORD.findall(query.lower()):
+        if len(word) < 3 or word in _STOP_WORDS:
+            continue
+        stem = word[:max(4, len(word) - 2)]
+        if stem not in terms:
+            terms.append(stem)
+    return terms
+
+
+def merge_adjacent(documents: List[Document]) -> List[Document]:
+    """
+    Merges chunks of the same source file that overlap or directly follow each other into one document.
+
+    Merged documents take the position and score of their best chunk. Chunks without the split metadata of the
+    `DocumentSplitter` are kept as they are.
+    """
+    merged: List[Document] = []
+    # index in `merged` of the documents that later chunks may still be merged into, by source
+    by_source: Dict[Any, List[int]] = {}
+    for document in documents:
+        source = document.meta.get("source_id") or document.meta.get("file_path")
+        start = document.meta.get("split_idx_start")
+        if source is None or start is None or document.content is None:
+            merged.append(document)
+            continue
+
+        end = start + len(document.content)
+        for index in by_source.get(source, []):
+            other = merged[index]
+            other_start = other.meta["split_idx_start"]
+            other_end = other_start + len(other.content)
+            if start > other_end or end < other_start:
+                continue
+            if start < other_start:
+                content = document.content + other.content[end - other_start:] if end < other_end else document.content
+            else:
+                content = other.content + document.content[other_end - start:] if end > other_end else other.content
+            merged[index] = replace(
+                other,
+                content=content,
+                meta={**other.meta, "split_idx_start": min(start, other_start)},
+                score=max((score for score in (other.score, document.score) if score is not None), default=None),
+            )
+            break
+        else:
+            by_source.setdefault(source, []).append(len(merged))
+            merged.append(document)
+    return merged
+
+
+def select_passages(content: str, terms: List[str], max_sentences: int) -> str:
+    """
+    Keeps the `max_sentences` sentences of a text that contain the most query terms, in their original order.
+
+    Gaps between the kept sentences are marked with an ellipsis. Texts without any matching sentence are reduced
+    to their beginning.
+    """
+    sentences = [sentence for sentence in _SENTENCE_BOUNDARY.split(content.strip()) if sentence]
+    if len(sentences) <= max_sentences:
+        return content.strip()
+
+    lowered = [sentence.lower() for sentence in sentences]
+    scores = [sum(term in sentence for term in terms) for sentence in lowered]
+    best = sorted(range(len(sentences)), key=lambda position: (-scores[position], position))[:max_sentences]
+    if scores[best[0]] == 0:
+        best = list(range(max_sentences))
+
+    passages = []
+    previous = None
+    for position in sorted(best):
+        if previous is not None and position != previous + 1:
+            passages.append("…")
+        passages.append(sentences[position])
+        previous = position
+    return " ".join(passages)
+
+
+@component
+class ContextPacker:
+    """
+    Shrinks search results to the parts relevant for the query so that tool results stay small.
+
+    Merges adjacent and overlapping chunks of the same file, keeps only the best matching sentences of each
+    document and packs the documents, most relevant first, into a token budget.
+    """
+
+    def __init__(self, token_budget: Optional[int] = 1500, max_sentences: int = 3):
+        """
+        :param token_budget: Maximum estimated tokens of all returned documents, `None` for no limit.
+        :param max_sentences: Sentences kept per document, 0 to keep whole documents.
+        """
+        self.token_budget = token_budget
+        self.max_sentences = max_sentences
+
+    @component.output_types(documents=List[Document])
+    def run(self, query: str, documents: List[Document], token_budget: Optional[int] = None) -> Dict[str, Any]:
+        """
+        :param query: The search query.
+        :param documents: Search results, most relevant first.
+        :param token_budget: Overrides the token budget of the packer for this search.
+        :returns: The packed documents, most relevant first.
+        """
+        token_budget = self.token_budget if token_budget is None else token_budget
+        terms = query_terms(query)
+
+        packed = []
+        used = 0
+        for document in merge_adjacent(documents):
+            content = document.content or ""
+            if self.max_sentences:
+                content = select_passages(content, terms, self.max_sentences)
+            tokens = estimate_tokens(content)
+            if token_budget is not None and used + tokens > token_budget:
+                # fall back to the best sentence alone before leaving the document out
+                content = select_passages(document.content or "", terms, 1)
+                tokens = estimate_tokens(content)
+                if used + tokens > token_budget:
+                    continue
+            used += tokens
+            packed.append(replace(document, content=content))
+
+        return {"documents": packed}
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import Any, Dict, List, Optional, Tuple
+from haystack import Document, component, logging
+from utils.metrics import RERANK_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Models are loaded once per process and shared by all rankers, by model name and quantization
+_models: Dict[Tuple[str, bool], Tuple[Any, Any]] = {}
+_models_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool all reranking runs on.
+
+    It bounds the concurrent inferences to `RERANK_WORKERS` (default 2) so that parallel searches do not
+    oversubscribe the CPU, each inference uses `RERANK_THREADS` threads (default: the CPUs split over the workers).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("RERANK_WORKERS", "2")), thread_name_prefix="rerank"
+            )
+        return _executor
+
+
+def load_model(model: str, quantize: bool = True) -> Tuple[Any, Any]:
+    """
+    Loads a cross-encoder and its tokenizer for CPU inference, or returns the already loaded one.
+
+    :param model: Hugging Face model id or local path of a sequence classification model.
+    :param quantize: Quantize the linear layers to int8, which makes CPU inference about twice as fast.
+    :returns: Tuple of tokenizer and model.
+    """
+    key = (model, quantize)
+    with _models_lock:
+        if key in _models:
+            return _models[key]
+
+        try:
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        except ImportError as error:
+            raise ImportError(
+                "Reranking needs torch and transformers, install them with "
+                "'pip install torch --index-url https://download.pytorch.org/whl/cpu transformers'."
+            ) from error
+
+        started_at = time.perf_counter()
+        workers = int(os.getenv("RERANK_WORKERS", "2"))
+        torch.set_num_threads(int(os.getenv("RERANK_THREADS", max(1, (os.cpu_count() or 1) // workers))))
+
+        tokenizer = AutoTokenizer.from_pretrained(model)
+        cross_encoder = AutoModelForSequenceClassification.from_pretrained(model).eval()
+        if quantize:
+            cross_encoder = torch.quantization.quantize_dynamic(cross_encoder, {torch.nn.Linear}, dtype=torch.qint8)
+
+        _models[key] = (tokenizer, cross_encoder)
+        logger.info(
+            "Loaded cross-encoder {model} (quantized: {quantize}) in {seconds:.1f} s",
+            model=model,
+            quantize=quantize,
+            seconds=time.perf_counter() - started_at,
+        )
+        return _models[key]
+
+
+@component
+class CrossEncoderRanker:
+    """
+    Reranks documents by the relevance a cross-encoder assigns to each query and document pair, on CPU.
+    """
+
+    def __init__(
+        self,
+        model: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+        top_k: int = 3,
+        batch_size: int = 16,
+        max_length: int = 512,
+        quantize: bool = True,
+    ):
+        """
+        :param model: Cross-encoder to use, the default is multilingual and handles German queries.
+        :param top_k: Maximum number of documents to return.
+        :param batch_size: Query and document pairs scored per forward pass.
+        :param max_length: Maximum number of tokens of a query and document pair, longer documents are truncated.
+        :param quantize: Quantize the model to int8.
+        """
+        self.model = model
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.quantize = quantize
+        self._tokenizer = None
+        self._model = None
+
+    def warm_up(self):
+        if self._model is None:
+            self._tokenizer, self._model = load_model(self.model, self.quantize)
+
+    def _score(self, query: str, documents: List[Document]) -> List[float]:
+        import torch
+
+        scores = []
+        with torch.inference_mode():
+            for start in range(0, len(documents), self.batch_size):
+                batch = documents[start:start + self.batch_size]
+                features = self._tokenizer(
+                    [query] * len(batch),
+                    [document.content or "" for document in batch],
+                    padding=True,
+                    truncation="only_second",
+                    max_length=self.max_length,
+                    return_tensors="pt",
+                )
+                logits = self._model(**features).logits
+                # single-logit models score relevance directly, two-logit models score (irrelevant, relevant)
+                batch_scores = logits[:, 0] if logits.shape[-1] == 1 else logits[:, -1]
+                scores.extend(batch_scores.tolist())
+        return scores
+
+    @component.output_types(documents=List[Document])
+    def run(self, query: str, documents: List[Document], top_k: Optional[int] = None) -> Dict[str, Any]:
+        """
+        :param query: The search query.
+        :param documents: Candidate documents, e.g. over-fetched by BM25.
+        :param top_k: Maximum number of documents to return, defaults to the `top_k` of the ranker.
+        :returns: The `top_k` most relevant documents with the cross-encoder scores, most relevant first.
+        """
+        top_k = self.top_k if top_k is None else top_k
+        if not documents:
+            return {"documents": []}
+        self.warm_up()
+
+        started_at = time.perf_counter()
+        scores = get_executor().submit(self._score, query, documents).result()
+        RERANK_DURATION.observe(time.perf_counter() - started_at)
+
+        ranked = sorted(zip(scores, documents), key=lambda pair: pair[0], reverse=True)[:top_k]
+        return {"documents": [replace(document, score=score) for score, document in ranked]}
@@ -0,0 +1,405 @@
+import bisect
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+import numpy as np
+from haystack import Document, component, default_from_dict, default_to_dict, logging
+from haystack.document_stores.errors import DuplicateDocumentError
+from haystack.document_stores.types import DuplicatePolicy
+from haystack.utils.filters import document_matches_filter
+
+logger = logging.getLogger(__name__)
+
+_FORMAT_VERSION = 1
+_CURRENT = "CURRENT"
+
+
+def _memmap(path: Path, dtype) -> np.ndarray:
+    # numpy cannot map empty files
+    if path.stat().st_size == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class _IndexGeneration:
+    """
+    One immutable, memory-mapped generation of the index on disk.
+
+    Files of a generation:
+    - `index.json`: format version, document count, average document length, BM25 and vector settings
+    - `terms.txt`, `term_offsets.u64`: the sorted vocabulary, newline separated, and the byte offset of each term
+    - `postings_offsets.u64`, `postings_docs.u32`, `postings_tfs.u16`: the postings of term i are the documents and
+      term frequencies between `postings_offsets[i]` and `postings_offsets[i + 1]`
+    - `doc_lengths.u32`: tokens per document
+    - `documents.jsonl`, `doc_offsets.u64`: the documents as JSON lines and the byte offset of each line
+    - `vectors.f32`: optional, the normalized embeddings, one row per document
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.info = json.loads((path / "index.json").read_text())
+        if self.info["format_version"] != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedded index format {self.info['format_version']} in {path}.")
+        self.count = self.info["documents"]
+        self.terms_count = self.info["terms"]
+
+        self.terms = self._map_bytes("terms.txt")
+        self.term_offsets = _memmap(path / "term_offsets.u64", np.uint64)
+        self.postings_offsets = _memmap(path / "postings_offsets.u64", np.uint64)
+        self.postings_docs = _memmap(path / "postings_docs.u32", np.uint32)
+        self.postings_tfs = _memmap(path / "postings_tfs.u16", np.uint16)
+        self.doc_lengths = _memmap(path / "doc_lengths.u32", np.uint32)
+        self.documents = self._map_bytes("documents.jsonl")
+        self.doc_offsets = _memmap(path / "doc_offsets.u64", np.uint64)
+        self.vectors = None
+        if self.info.get("embedding_dim"):
+            self.vectors = _memmap(path / "vectors.f32", np.float32).reshape(self.count, self.info["embedding_dim"])
+
+    def _map_bytes(self, name: str) -> Union[mmap.mmap, bytes]:
+        with open(self.path / name, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def term(self, position: int) -> str:
+        start, end = int(self.term_offsets[position]), int(self.term_offsets[position + 1])
+        return self.terms[start:end - 1].decode("utf-8")
+
+    def find_term(self, term: str) -> Optional[int]:
+        """
+        Returns the position of a term in the sorted vocabulary by binary search over the mapped terms.
+        """
+        position = bisect.bisect_left(range(self.terms_count), term, key=self.term)
+        if position < self.terms_count and self.term(position) == term:
+            return position
+        return None
+
+    def document(self, position: int) -> Document:
+        start, end = int(self.doc_offsets[position]), int(self.doc_offsets[position + 1])
+        return Document.from_dict(json.loads(self.documents[start:end]))
+
+    def iter_documents(self) -> Iterable[Document]:
+        for position in range(self.count):
+            yield self.document(position)
+
+
+def _write_generation(
+    path: Path, documents: List[Document], tokenize, embedding_dim: Optional[int]
+) -> Dict[str, Any]:
+    path.mkdir(parents=True)
+
+    postings: Dict[str, List[tuple]] = {}
+    doc_lengths = np.zeros(len(documents), dtype=np.uint32)
+    for position, document in enumerate(documents):
+        tokens = tokenize((document.content or "").lower())
+        doc_lengths[position] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append((position, min(tf, np.iinfo(np.uint16).max)))
+
+    terms = sorted(postings)
+    encoded_terms = [f"{term}\n".encode("utf-8") for term in terms]
+    (path / "terms.txt").write_bytes(b"".join(encoded_terms))
+    np.cumsum([0] + [len(term) for term in encoded_terms], dtype=np.uint64).tofile(path / "term_offsets.u64")
+    np.cumsum([0] + [len(postings[term]) for term in terms], dtype=np.uint64).tofile(path / "postings_offsets.u64")
+    np.array([doc for term in terms for doc, _ in postings[term]], dtype=np.uint32).tofile(path / "postings_docs.u32")
+    np.array([tf for term in terms for _, tf in postings[term]], dtype=np.uint16).tofile(path / "postings_tfs.u16")
+    doc_lengths.tofile(path / "doc_lengths.u32")
+
+    offsets = [0]
+    with open(path / "documents.jsonl", "wb") as f:
+        for document in documents:
+            data = document.to_dict(flatten=False)
+            # embeddings go to the vector array, scores belong to a search result and not to the document
+            data.pop("embedding", None)
+            data.pop("score", None)
+            line = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.array(offsets, dtype=np.uint64).tofile(path / "doc_offsets.u64")
+
+    if embedding_dim:
+        vectors = np.array([document.embedding for document in documents], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        (vectors / np.where(norms == 0, 1, norms)).tofile(path / "vectors.f32")
+
+    info = {
+        "format_version": _FORMAT_VERSION,
+        "documents": len(documents),
+        "terms": len(terms),
+        "avg_doc_length": float(doc_lengths.mean()) if len(documents) else 0.0,
+        "embedding_dim": embedding_dim,
+    }
+    (path / "index.json").write_text(json.dumps(info))
+    return info
+
+
+class EmbeddedDocumentStore:
+    """
+    Document store backed by an on-disk, memory-mapped inverted index with BM25 scoring, running in-process.
+
+    Meant for small deployments, CI and edge installs where running OpenSearch is not worth it. Opening the index
+    only maps its files, so a store is ready within milliseconds regardless of the corpus size, and all processes
+    reading the same index share the pages of the OS cache.
+
+    The index is immutable: every write or delete builds a new generation next to the current one and switches
+    the `CURRENT` pointer atomically, so readers always see a complete index. This makes writes cost a full rebuild,
+    which is fine for corpora that are indexed in a few batches. Documents with embeddings of equal dimension also
+    get a vector array for cosine similarity search.
+    """
+
+    def __init__(self, path: Union[str, Path], bm25_k1: float = 1.5, bm25_b: float = 0.75,
+                 bm25_tokenization_regex: str = r"(?u)\b\w\w+\b"):
+        """
+        :param path: Directory of the index, created on the first write.
+        :param bm25_k1: BM25 term frequency saturation.
+        :param bm25_b: BM25 document length normalization.
+        :param bm25_tokenization_regex: Tokens of documents and queries, matched on the lowercased text.
+        """
+        self.path = Path(path)
+        self.bm25_k1 = bm25_k1
+        self.bm25_b = bm25_b
+        self.bm25_tokenization_regex = bm25_tokenization_regex
+        self._tokenize = re.compile(bm25_tokenization_regex).findall
+        # reentrant, the mutators hold it while loading the current generation
+        self._lock = threading.RLock()
+        self._generation: Optional[_IndexGeneration] = None
+        self._generation_name: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return default_to_dict(
+            self,
+            path=str(self.path),
+            bm25_k1=self.bm25_k1,
+            bm25_b=self.bm25_b,
+            bm25_tokenization_regex=self.bm25_tokenization_regex,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "EmbeddedDocumentStore":
+        return default_from_dict(cls, data)
+
+    def _current(self) -> Optional[_IndexGeneration]:
+        """
+        Returns the current generation, reopening it if another process or store switched the index.
+        """
+        for attempt in range(3):
+            try:
+                name = (self.path / _CURRENT).read_text().strip()
+            except FileNotFoundError:
+                return None
+            if name == self._generation_name:
+                return self._generation
+            with self._lock:
+                if name == self._generation_name:
+                    return self._generation
+                try:
+                    self._generation = _IndexGeneration(self.path / name)
+                except FileNotFoundError:
+                    # another store switched twice and removed the generation in between, read CURRENT again
+                    if attempt == 2:
+                        raise
+                    continue
+                self._generation_name = name
+                return self._generation
+        return self._generation
+
+    def count_documents(self) -> int:
+        generation = self._current()
+        return generation.count if generation else 0
+
+    def filter_documents(self, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        generation = self._current()
+        if generation is None:
+            return []
+        if filters and "operator" not in filters and "conditions" not in filters:
+            raise ValueError("Invalid filter syntax. See https://docs.haystack.deepset.ai/docs/metadata-filtering")
+        documents = generation.iter_documents()
+        if filters:
+            return [document for document in documents if document_matches_filter(filters, document)]
+        return list(documents)
+
+    def _all_documents(self) -> List[Document]:
+        generation = self._current()
+        if generation is None:
+            return []
+        documents = list(generation.iter_documents())
+        if generation.vectors is not None:
+            # the stored vectors are normalized, which is all cosine similarity needs
+            for document, vector in zip(documents, generation.vectors):
+                document.embedding = vector.tolist()
+        return documents
+
+    def _rebuild(self, documents: List[Document]):
+        dims = {len(document.embedding) for document in documents if document.embedding is not None}
+        embedding_dim = None
+        if len(dims) == 1 and all(document.embedding is not None for document in documents):
+            embedding_dim = dims.pop()
+        elif dims:
+            logger.warning("Not all documents have embeddings of the same size, the vector index is left out.")
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        previous = self._generation_name
+        number = int(previous.split("-")[1]) + 1 if previous else 1
+        name = f"gen-{number:06d}"
+        _write_generation(self.path / name, documents, self._tokenize, embedding_dim)
+
+        pointer = self.path / f"{_CURRENT}.tmp"
+        pointer.write_text(name)
+        os.replace(pointer, self.path / _CURRENT)
+        # the previous generation stays until the next switch, readers that already resolved CURRENT
+        # can still open it; older ones are removed
+        for directory in self.path.glob("gen-*"):
+            if directory.name not in (name, previous):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def write_documents(self, documents: List[Document], policy: DuplicatePolicy = DuplicatePolicy.NONE) -> int:
+        if policy == DuplicatePolicy.NONE:
+            policy = DuplicatePolicy.FAIL
+
+        with self._lock:
+            existing = {document.id: document for document in self._all_documents()}
+            written = 0
+            for document in documents:
+                if document.id in existing:
+                    if policy == DuplicatePolicy.FAIL:
+                        raise DuplicateDocumentError(f"ID '{document.id}' already exists.")
+                    if policy == DuplicatePolicy.SKIP:
+                        continue
+                existing[document.id] = document
+                written += 1
+            if written:
+                self._rebuild(list(existing.values()))
+        self._current()
+        return written
+
+    def replace_documents(self, documents: List[Document]) -> int:
+        """
+        Replaces all documents of the store in a single rebuild, e.g. to export another store.
+
+        :param documents: The new documents, later documents win over earlier ones with the same id.
+        :returns: The number of documents in the store.
+        """
+        unique = list({document.id: document for document in documents}.values())
+        with self._lock:
+            self._current()
+            self._rebuild(unique)
+        self._current()
+        return len(unique)
+
+    def delete_documents(self, document_ids: List[str]) -> None:
+        with self._lock:
+            ids = set(document_ids)
+            documents = self._all_documents()
+            remaining = [document for document in documents if document.id not in ids]
+            if len(remaining) != len(documents):
+                self._rebuild(remaining)
+        self._current()
+
+    def bm25_retrieval(self, query: str, top_k: int = 10, scale_score: bool = False) -> List[Document]:
+        """
+        Returns the `top_k` documents with the highest BM25 scores for the query.
+
+        :param query: The search query, tokenized like the documents.
+        :param top_k: Maximum number of documents to return.
+        :param scale_score: Scale the scores to the range 0 to 1 with a sigmoid, as the in-memory store does.
+        """
+        generation = self._current()
+        if generation is None or generation.count == 0:
+            return []
+
+        scores = np.zeros(generation.count, dtype=np.float32)
+        avg_doc_length = max(generation.info["avg_doc_length"], 1e-9)
+        for term in set(self._tokenize(query.lower())):
+            position = generation.find_term(term)
+            if position is None:
+                continue
+            start, end = int(generation.postings_offsets[position]), int(generation.postings_offsets[position + 1])
+            docs = generation.postings_docs[start:end]
+            tfs = generation.postings_tfs[start:end].astype(np.float32)
+            length_norm = self.bm25_k1 * (1 - self.bm25_b + self.bm25_b * generation.doc_lengths[docs] / avg_doc_length)
+            idf = math.log(1 + (generation.count - (end - start) + 0.5) / ((end - start) + 0.5))
+            # a term occurs at most once in the postings of a document, so the fancy-indexed add is safe
+            scores[docs] += idf * tfs * (self.bm25_k1 + 1) / (tfs + length_norm)
+
+        return self._top_k(generation, scores, top_k, scale_score, lambda score: 1 / (1 + np.exp(-score / 8)))
+
+    def embedding_retrieval(self, query_embedding: List[float], top_k: int = 10, scale_score: bool = False) -> List[Document]:
+        """
+        Returns the `top_k` documents with the highest cosine similarity to the query embedding.
+
+        :param query_embedding: Embedding of the query, of the same size as the document embeddings.
+        :param top_k: Maximum number of documents to return.
+        :param scale_score: Scale the scores to the range 0 to 1.
+        """
+        generation = self._current()
+        if generation is None or generation.vectors is None:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = generation.vectors @ (query / (np.linalg.norm(query) or 1))
+        return self._top_k(generation, scores, top_k, scale_score, lambda score: (score + 1) / 2)
+
+    @staticmethod
+    def _top_k(generation: _IndexGeneration, scores: np.ndarray, top_k: int, scale_score: bool, scale) -> List[Document]:
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        documents = []
+        for position in ranked:
+            document = generation.document(int(position))
+            score = float(scores[position])
+            document.score = float(scale(score)) if scale_score else score
+            documents.append(document)
+        return documents
+
+
+@component
+class EmbeddedBM25Retriever:
+    """
+    Retrieves documents from an `EmbeddedDocumentStore` by BM25.
+    """
+
+    def __init__(self, document_store: EmbeddedDocumentStore, top_k: int = 10, scale_score: bool = False):
+        """
+        :param document_store: The store to search.
+        :param top_k: Maximum number of documents to return.
+        :param scale_score: Scale the scores to the range 0 to 1.
+        """
+        self.document_store = document_store
+        self.top_k = top_k
+        self.scale_score = scale_score
+
+    def to_dict(self) -> Dict[str, Any]:
+        return default_to_dict(
+            self, document_store=self.document_store.to_dict(), top_k=self.top_k, scale_score=self.scale_score
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "EmbeddedBM25Retriever":
+        data["init_parameters"]["document_store"] = EmbeddedDocumentStore.from_dict(
+            data["init_parameters"]["document_store"]
+        )
+        return default_from_dict(cls, data)
+
+    @component.output_types(documents=List[Document])
+    def run(self, query: str, top_k: Optional[int] = None, scale_score: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        :param query: The search query.
+        :param top_k: Overrides the `top_k` of the retriever.
+        :param scale_score: Overrides `scale_score` of the retriever.
+        :returns: The retrieved documents, best first.
+        """
+        documents = self.document_store.bm25_retrieval(
+            query=query,
+            top_k=self.top_k if top_k is None else top_k,
+            scale_score=self.scale_score if scale_score is None else scale_score,
+        )
+        return {"documents": documents}
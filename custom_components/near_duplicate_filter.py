@@ -0,0 +1,131 @@
+import hashlib
+import random
+import re
+from dataclasses import replace
+from typing import Any, Dict, List, Literal
+import numpy as np
+from haystack import Document, component, logging
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+
+@component
+class NearDuplicateFilter:
+    """
+    Finds near-duplicate chunks with MinHash signatures and locality-sensitive hashing.
+
+    Each chunk is reduced to a signature of `num_perm` MinHash values over its word shingles. The signatures are
+    split into `bands` bands and only chunks sharing a band bucket are compared, so the cost grows with the number
+    of chunks rather than the number of pairs. Candidates whose estimated Jaccard similarity reaches `threshold`
+    end up in the cluster of the first chunk seen.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        shingle_size: int = 5,
+        num_perm: int = 64,
+        bands: int = 16,
+        policy: Literal["drop", "mark"] = "drop",
+        seed: int = 1,
+    ):
+        """
+        :param threshold: Minimum estimated Jaccard similarity of the word shingles of two near-duplicates.
+        :param shingle_size: Words per shingle.
+        :param num_perm: Number of MinHash values per chunk, must be divisible by `bands`.
+        :param bands: LSH bands, more bands find candidates with a lower similarity at a higher cost.
+        :param policy: `drop` keeps only the first chunk of each cluster, `mark` keeps all chunks and stores the id
+            of the first chunk of the cluster in `meta["near_duplicate_of"]` of the others.
+        :param seed: Seed of the hash permutations, signatures are only comparable for the same seed.
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands}).")
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.num_perm = num_perm
+        self.bands = bands
+        self.policy = policy
+        self.seed = seed
+
+        rng = random.Random(seed)
+        # a < 2**31 and 32 bit shingle hashes keep a * hash + b within 64 bits
+        self._a = np.array([rng.randrange(1, 1 << 31) for _ in range(num_perm)], dtype=np.uint64)
+        self._b = np.array([rng.randrange(0, 1 << 31) for _ in range(num_perm)], dtype=np.uint64)
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        return np.array(
+            [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), "little") for shingle in shingles],
+            dtype=np.uint64,
+        )
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Returns the MinHash signature of a text.
+        """
+        hashes = self._shingle_hashes(text)
+        return ((np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME).min(axis=0)
+
+    @component.output_types(documents=List[Document], stats=Dict[str, Any])
+    def run(self, documents: List[Document]) -> Dict[str, Any]:
+        """
+        :param documents: Chunks to deduplicate.
+        :returns: The remaining or marked chunks and `stats` with the number of chunks before and after, the
+            duplicates found, the clusters with duplicates and the characters of all and of the unique chunks.
+        """
+        rows = self.num_perm // self.bands
+        buckets: Dict[Any, List[int]] = {}
+        signatures: Dict[int, np.ndarray] = {}
+        unique: List[Document] = []
+        marked: List[Document] = []
+        clusters = set()
+
+        for position, document in enumerate(documents):
+            signature = self.signature(document.content or "")
+            keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+            # only the first chunk of each cluster is bucketed, the first one similar enough is the match
+            match = None
+            seen = set()
+            for key in keys:
+                for candidate in buckets.get(key, []):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    if np.mean(signatures[candidate] == signature) >= self.threshold:
+                        match = candidate
+                        break
+                if match is not None:
+                    break
+
+            if match is None:
+                signatures[position] = signature
+                for key in keys:
+                    buckets.setdefault(key, []).append(position)
+                unique.append(document)
+                marked.append(document)
+            else:
+                clusters.add(match)
+                marked.append(replace(document, meta={**document.meta, "near_duplicate_of": documents[match].id}))
+
+        output = marked if self.policy == "mark" else unique
+        stats = {
+            "documents_in": len(documents),
+            "documents_out": len(output),
+            "duplicates": len(documents) - len(unique),
+            "clusters": len(clusters),
+            "chars_in": sum(len(document.content or "") for document in documents),
+            "chars_out": sum(len(document.content or "") for document in unique),
+        }
+        if stats["duplicates"]:
+            logger.info(
+                "Found {duplicates} near-duplicates of {documents_in} chunks in {clusters} clusters, "
+                "the unique chunks hold {chars_out} of {chars_in} characters",
+                **stats,
+            )
+        return {"documents": output, "stats": stats}
@@ -1,24 +1,210 @@
-from typing import Any, Dict, List, Optional
-from haystack import component
-from haystack_experimental.dataclasses import ChatMessage, Tool
+from typing import Any, Dict, Iterable, List, Optional
+from haystack import component, logging, tracing
+from haystack_experimental.dataclasses import ChatMessage, ChatRole, Tool, ToolCall
 # from haystack_experimental.components.generators.chat import OpenAIChatGenerator
 from .openai_generator import OpenAIChatGenerator
+from .chat_tool_invoker import ChatToolInvoker
+from .context_packer import estimate_tokens
 from haystack.dataclasses import StreamingChunk
+from utils.admission import get_token_budget
+from utils.metrics import AGENT_TOOL_ROUNDS, LLM_CALL_DURATION, LLM_TIME_TO_FIRST_TOKEN, LLM_TOKENS
 import inspect
 import copy
+import json
+import os
 
+logger = logging.getLogger(__name__)
 
 
+def summarize_run_usage(messages: List[ChatMessage]) -> Dict[str, Any]:
+    """
+    Rolls up token usage and latency of all LLM calls of the current agent run.
+
+    The run starts after the latest user message, every assistant message after it is one LLM call
+    (one tool round if it requested tool calls).
+
+    :param messages: The chat history of the agent run.
+    :returns: Totals over the run and one entry per LLM call in `rounds`.
+    """
+    start = 0
+    for i, message in enumerate(messages):
+        if message.is_from(ChatRole.USER):
+            start = i + 1
+
+    rounds = []
+    for message in messages[start:]:
+        if not message.is_from(ChatRole.ASSISTANT):
+            continue
+        usage = message.meta.get("usage") or {}
+        timing = message.meta.get("timing") or {}
+        rounds.append({
+            "model": message.meta.get("model"),
+            "turn": message.meta.get("turn"),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "time_to_first_token_ms": timing.get("time_to_first_token_ms"),
+            "total_ms": timing.get("total_ms", 0.0),
+            "tool_calls": [tool_call.tool_name for tool_call in message.tool_calls],
+        })
+
+    prompt_tokens = sum(r["prompt_tokens"] for r in rounds)
+    completion_tokens = sum(r["completion_tokens"] for r in rounds)
+    return {
+        "llm_calls": len(rounds),
+        "tool_rounds": sum(1 for r in rounds if r["tool_calls"]),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "llm_ms": sum(r["total_ms"] for r in rounds),
+        "rounds": rounds,
+    }
+
+
+TURN_TYPES = ("tool_selection", "answer", "plan")
+
+
+def parse_model_policy(value: Optional[str]) -> Dict[str, str]:
+    """
+    Parses a model policy like `tool_selection=gpt-4o-mini,answer=gpt-4o` into a dictionary of turn type to model.
+
+    :raises ValueError: If an entry has no model or an unknown turn type.
+    """
+    policy = {}
+    for entry in (value or "").split(","):
+        if not entry.strip():
+            continue
+        turn, _, model = (part.strip() for part in entry.partition("="))
+        if turn not in TURN_TYPES or not model:
+            raise ValueError(f"Invalid model policy '{entry}', expected <turn>=<model> with a turn of {TURN_TYPES}")
+        policy[turn] = model
+    return policy
+
+
+def classify_turn(
+    messages: List[ChatMessage], tools: Optional[List[Tool]], preparation_tools: Iterable[str] = ()
+) -> str:
+    """
+    Returns the type of the next LLM call of the agent run, which starts after the latest user message.
+
+    The call is an `answer` turn if no tools are offered or a tool other than the `preparation_tools` already
+    returned a result in this run, e.g. a search. Otherwise the model is expected to select tools, a
+    `tool_selection` turn.
+    """
+    if not tools:
+        return "answer"
+    start = 0
+    for i, message in enumerate(messages):
+        if message.is_from(ChatRole.USER):
+            start = i + 1
+    preparation_tools = set(preparation_tools)
+    for message in messages[start:]:
+        for result in message.tool_call_results:
+            if result.origin.tool_name not in preparation_tools:
+                return "answer"
+    return "tool_selection"
+
+
+def _record_turn(span: tracing.Span, completion: ChatMessage) -> None:
+    model = completion.meta.get("model") or "unknown"
+    turn = completion.meta.get("turn") or "unknown"
+    usage = completion.meta.get("usage") or {}
+    timing = completion.meta.get("timing") or {}
+
+    LLM_CALL_DURATION.labels(model=model, turn=turn).observe(timing.get("total_ms", 0.0) / 1000)
+    if timing.get("time_to_first_token_ms") is not None:
+        LLM_TIME_TO_FIRST_TOKEN.labels(model=model, turn=turn).observe(timing["time_to_first_token_ms"] / 1000)
+    LLM_TOKENS.labels(model=model, kind="prompt", turn=turn).inc(usage.get("prompt_tokens", 0))
+    LLM_TOKENS.labels(model=model, kind="completion", turn=turn).inc(usage.get("completion_tokens", 0))
+
+    span.set_tags({
+        "llm.model": model,
+        "agent.turn_type": turn,
+        "llm.prompt_tokens": usage.get("prompt_tokens"),
+        "llm.completion_tokens": usage.get("completion_tokens"),
+        "llm.time_to_first_token_ms": timing.get("time_to_first_token_ms"),
+        "agent.tool_calls": [tool_call.tool_name for tool_call in completion.tool_calls],
+    })
+
+
+def estimate_call_tokens(messages: List[ChatMessage], tools: Optional[List[Tool]], max_tokens: Optional[int]) -> int:
+    """
+    Estimates the tokens an LLM call uses, for the shared token budget: the prompt with the tool definitions plus
+    `max_tokens` or `OPENAI_TPM_COMPLETION_ESTIMATE` (default 500) completion tokens.
+    """
+    parts = [text for message in messages for text in message.texts]
+    parts += [result.result for message in messages for result in message.tool_call_results]
+    parts += [json.dumps(call.arguments) for message in messages for call in message.tool_calls]
+    parts += [json.dumps([tool.tool_spec for tool in tools or []])]
+    completion = max_tokens or int(os.getenv("OPENAI_TPM_COMPLETION_ESTIMATE", "500"))
+    return sum(estimate_tokens(part) for part in parts) + completion
+
+
+def _used_tokens(completion: ChatMessage, reserved: int) -> int:
+    usage = completion.meta.get("usage") or {}
+    return usage.get("total_tokens") or reserved
+
+
+def _finish_run(completion: ChatMessage, messages: List[ChatMessage]) -> None:
+    run_usage = summarize_run_usage(messages)
+    completion.meta["run_usage"] = run_usage
+    AGENT_TOOL_ROUNDS.observe(run_usage["tool_rounds"])
+    logger.info(
+        "Agent run finished after {llm_calls} LLM calls ({tool_rounds} tool rounds), "
+        "{prompt_tokens} prompt / {completion_tokens} completion tokens, {llm_ms:.0f} ms in the LLM",
+        llm_calls=run_usage["llm_calls"],
+        tool_rounds=run_usage["tool_rounds"],
+        prompt_tokens=run_usage["prompt_tokens"],
+        completion_tokens=run_usage["completion_tokens"],
+        llm_ms=run_usage["llm_ms"],
+    )
+
 
 @component
 class OpenAIAgent(OpenAIChatGenerator):
-    def __init__(self, generator: Optional[OpenAIChatGenerator] = None, **kwargs):
+    def __init__(
+            self,
+            generator: Optional[OpenAIChatGenerator] = None,
+            tool_invoker: Optional[ChatToolInvoker] = None,
+            eager_tool_calls: bool = True,
+            model_policy: Optional[Dict[str, str]] = None,
+            preparation_tools: Iterable[str] = (),
+            **kwargs,
+    ):
+        """
+        :param generator: Generator whose settings the agent takes over, otherwise `kwargs` are used.
+        :param tool_invoker: The invoker that executes this agent's tool calls in the pipeline.
+        :param eager_tool_calls: If `True` and a `tool_invoker` is set, each streamed tool call is dispatched to it
+            as soon as its arguments are complete, while the model is still generating further tool calls. Of the
+            tools with a batch function only the first call per message starts early, the later ones are batched
+            once the message is complete, e.g. the first search runs while the model writes the others, which then
+            share one `_msearch`.
+        :param model_policy: Model per turn type (`tool_selection`, `answer`, `plan`), e.g. a small model for the
+            turns that only select tools. Turn types without an entry use the model of the generator, see
+            `classify_turn`.
+        :param preparation_tools: Tools whose results do not make the next turn an answer turn, e.g. a tool that
+            only rewrites the question.
+        """
         if generator:
             init_params = inspect.signature(OpenAIChatGenerator.__init__).parameters
             generator_kwargs = {key: value for key, value in vars(generator).items() if key in init_params}
             super(OpenAIAgent, self).__init__(**generator_kwargs)
         else:
             super(OpenAIAgent, self).__init__(**kwargs)
+        self.tool_invoker = tool_invoker
+        self.eager_tool_calls = eager_tool_calls
+        self.model_policy = dict(model_policy or {})
+        self.preparation_tools = tuple(preparation_tools)
+
+    def _apply_model_policy(self, turn: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        model = self.model_policy.get(turn)
+        if model is None:
+            return kwargs
+        # the generation kwargs of a run override the model of the generator
+        return {**kwargs, "generation_kwargs": {**(kwargs.get("generation_kwargs") or {}), "model": model}}
+
+    def _max_tokens(self, kwargs: Dict[str, Any]) -> Optional[int]:
+        generation_kwargs = {**self.generation_kwargs, **(kwargs.get("generation_kwargs") or {})}
+        return generation_kwargs.get("max_tokens") or generation_kwargs.get("max_completion_tokens")
 
     @component.output_types(replies=List[ChatMessage], tool_reply=List[ChatMessage], chat_history=List[ChatMessage])
     def run(
@@ -35,8 +221,24 @@ class OpenAIAgent(OpenAIChatGenerator):
             messages = followup_messages
 
 
-        parent_result = super(OpenAIAgent, self).run(messages, tools=tools, streaming_callback = streaming_callback, *args, **kwargs)
-        completions = parent_result["replies"]
+        turn = classify_turn(messages, tools, self.preparation_tools)
+        kwargs = self._apply_model_policy(turn, kwargs)
+        budget = get_token_budget()
+        with tracing.tracer.trace("agent.turn", tags={"agent.messages": len(messages)}) as span:
+            if budget is not None:
+                reserved = estimate_call_tokens(messages, tools, self._max_tokens(kwargs))
+                span.set_tag("llm.token_budget_wait_s", budget.reserve(reserved))
+            used = 0
+            try:
+                parent_result = super(OpenAIAgent, self).run(messages, tools=tools, streaming_callback = streaming_callback, *args, **kwargs)
+                completions = parent_result["replies"]
+                used = _used_tokens(completions[0], reserved) if budget is not None else 0
+            finally:
+                # a failed call gives its reservation back instead of holding it until the window rolls
+                if budget is not None:
+                    budget.settle(reserved, used)
+            completions[0].meta["turn"] = turn
+            _record_turn(span, completions[0])
 
         messages.append(completions[0])
 
@@ -46,6 +248,7 @@ class OpenAIAgent(OpenAIChatGenerator):
             #     streaming_callback(chunk)
             return {"tool_reply": messages}
 
+        _finish_run(completions[0], messages)
         return {"replies": completions, "chat_history": messages}
 
     @component.output_types(replies=List[ChatMessage], tool_reply=List[ChatMessage], chat_history=List[ChatMessage])
@@ -65,8 +268,40 @@ class OpenAIAgent(OpenAIChatGenerator):
                 await streaming_callback(chunk)
             messages = followup_messages
 
-        parent_result = await super(OpenAIAgent, self).run_async(messages, tools=tools, streaming_callback = streaming_callback,  *args, **kwargs)
-        completions = parent_result["replies"]
+        dispatched = []
+        started_batch_tools = set()
+
+        def dispatch(tool_call: ToolCall):
+            if tool_call.tool_name in self.tool_invoker.batch_functions:
+                if tool_call.tool_name in started_batch_tools:
+                    return
+                started_batch_tools.add(tool_call.tool_name)
+            dispatched.append(tool_call.id)
+            self.tool_invoker.dispatch(tool_call)
+
+        tool_call_callback = dispatch if self.tool_invoker is not None and self.eager_tool_calls else None
+
+        turn = classify_turn(messages, tools, self.preparation_tools)
+        kwargs = self._apply_model_policy(turn, kwargs)
+        budget = get_token_budget()
+        with tracing.tracer.trace("agent.turn", tags={"agent.messages": len(messages)}) as span:
+            if budget is not None:
+                reserved = estimate_call_tokens(messages, tools, self._max_tokens(kwargs))
+                span.set_tag("llm.token_budget_wait_s", await budget.reserve_async(reserved))
+            used = 0
+            try:
+                parent_result = await super(OpenAIAgent, self).run_async(messages, tools=tools, streaming_callback = streaming_callback, tool_call_callback=tool_call_callback, *args, **kwargs)
+                completions = parent_result["replies"]
+                used = _used_tokens(completions[0], reserved) if budget is not None else 0
+            except BaseException:
+                if dispatched:
+                    self.tool_invoker.discard(dispatched)
+                raise
+            finally:
+                if budget is not None:
+                    budget.settle(reserved, used)
+            completions[0].meta["turn"] = turn
+            _record_turn(span, completions[0])
 
         messages.append(completions[0])
 
@@ -74,4 +309,5 @@ class OpenAIAgent(OpenAIChatGenerator):
         if completions[0].tool_calls:
             return {"tool_reply": messages}
 
+        _finish_run(completions[0], messages)
         return {"replies": completions, "chat_history": messages}
@@ -4,7 +4,9 @@
 
 import json
 import os
-from typing import Any, Dict, List, Optional, Union
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
 
 from haystack import component, default_from_dict, default_to_dict, logging
 from haystack.dataclasses import StreamingChunk
@@ -84,6 +86,239 @@ def _convert_message_to_openai_format(message: ChatMessage) -> Dict[str, Any]:
     return openai_msg
 
 
+def _timing(started_at: float, first_token_at: Optional[float] = None) -> Dict[str, Optional[float]]:
+    """
+    Builds the latency meta of a single LLM call in milliseconds.
+
+    :param started_at: `time.perf_counter()` value taken right before the request was sent.
+    :param first_token_at: `time.perf_counter()` value of the first generated delta, for streaming calls.
+    """
+    now = time.perf_counter()
+    return {
+        "time_to_first_token_ms": (first_token_at - started_at) * 1000 if first_token_at is not None else None,
+        "total_ms": (now - started_at) * 1000,
+    }
+
+
+# characters that change the nesting of a JSON document, escape sequences are matched as a whole so they are skipped
+_JSON_STRUCTURE = re.compile(r'\\.|[{}\[\]"\\]', re.DOTALL)
+
+
+class _ToolCallBuffer:
+    """
+    Collects the streamed deltas of one tool call and tracks whether its argument JSON is complete.
+    """
+
+    __slots__ = ("id", "name", "arguments", "depth", "in_string", "escaped", "complete")
+
+    def __init__(self):
+        self.id: Optional[str] = None
+        self.name = ""
+        self.arguments: List[str] = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.complete = False
+
+    def feed(self, fragment: str) -> bool:
+        """
+        Appends an argument fragment and returns `True` once the top-level JSON object has been closed.
+        """
+        self.arguments.append(fragment)
+        start = 0
+        if self.escaped:
+            # the previous fragment ended with a backslash that escapes the first character of this one
+            self.escaped = False
+            start = 1
+        for match in _JSON_STRUCTURE.finditer(fragment, start):
+            char = match.group()
+            if char[0] == "\\":
+                self.escaped = len(char) == 1
+            elif char == '"':
+                self.in_string = not self.in_string
+            elif self.in_string:
+                continue
+            elif char in "{[":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+
+class StreamingToolCallAssembler:
+    """
+    Assembles tool calls incrementally from streamed `ChoiceDeltaToolCall` deltas.
+
+    A tool call is complete as soon as its argument JSON closes, when a delta for a later tool call arrives,
+    or when the stream ends, so callers can start executing it while the model is still generating the others.
+    """
+
+    def __init__(self):
+        self._buffers: Dict[int, _ToolCallBuffer] = {}
+        self._tool_calls: Dict[int, ToolCall] = {}
+
+    def add(self, deltas: Optional[List[Any]]) -> List[ToolCall]:
+        """
+        Adds the tool call deltas of one chunk.
+
+        :returns: The tool calls completed by these deltas.
+        """
+        completed = []
+        for delta in deltas or []:
+            buffer = self._buffers.get(delta.index)
+            if buffer is None:
+                # a new tool call starts, so the model is done with the previous ones
+                for index, previous in self._buffers.items():
+                    if not previous.complete:
+                        completed.extend(self._complete(index))
+                buffer = self._buffers[delta.index] = _ToolCallBuffer()
+            buffer.id = delta.id or buffer.id
+            if delta.function:
+                buffer.name += delta.function.name or ""
+                if delta.function.arguments and not buffer.complete and buffer.feed(delta.function.arguments):
+                    completed.extend(self._complete(delta.index))
+        return completed
+
+    def finish(self) -> List[ToolCall]:
+        """
+        Completes all pending tool calls at the end of the stream.
+
+        :returns: The tool calls completed by the end of the stream.
+        """
+        completed = []
+        for index, buffer in self._buffers.items():
+            if not buffer.complete:
+                completed.extend(self._complete(index))
+        return completed
+
+    @property
+    def tool_calls(self) -> List[ToolCall]:
+        """
+        All successfully parsed tool calls in the order of their index.
+        """
+        return [self._tool_calls[index] for index in sorted(self._tool_calls)]
+
+    def _complete(self, index: int) -> List[ToolCall]:
+        buffer = self._buffers[index]
+        buffer.complete = True
+        arguments_str = "".join(buffer.arguments)
+        try:
+            arguments = json.loads(arguments_str)
+        except json.JSONDecodeError:
+            logger.warning(
+                "OpenAI returned a malformed JSON string for tool call arguments. This tool call "
+                "will be skipped. To always generate a valid JSON, set `tools_strict` to `True`. "
+                "Tool call ID: {_id}, Tool name: {_name}, Arguments: {_arguments}",
+                _id=buffer.id,
+                _name=buffer.name,
+                _arguments=arguments_str,
+            )
+            return []
+        tool_call = ToolCall(id=buffer.id, tool_name=buffer.name, arguments=arguments)
+        self._tool_calls[index] = tool_call
+        return [tool_call]
+
+
+class _OpenAIStreamingChunk(StreamingChunk):
+    """
+    `StreamingChunk` for a chunk of the OpenAI stream that builds its `meta` on the first read.
+
+    Streaming callbacks usually only look at `content`, so no meta dict is allocated per token. Once built, the
+    dict is kept, so callbacks can update it like the meta of any other chunk. The chunk has no `__slots__`: the
+    dataclass it extends has none, so every instance has a `__dict__` anyway.
+    """
+
+    def __init__(self, chunk: ChatCompletionChunk):
+        self._chunk = chunk
+        # `None` stands for the meta that was not built yet, see the property
+        super(_OpenAIStreamingChunk, self).__init__(content=chunk.choices[0].delta.content or "", meta=None)
+
+    @property
+    def meta(self) -> Dict[str, Any]:  # type: ignore[override]
+        if self._meta is None:
+            choice: ChunkChoice = self._chunk.choices[0]
+            self._meta = {
+                "model": self._chunk.model,
+                "index": choice.index,
+                "tool_calls": choice.delta.tool_calls,
+                "finish_reason": choice.finish_reason,
+            }
+        return self._meta
+
+    @meta.setter
+    def meta(self, value: Optional[Dict[str, Any]]):
+        self._meta = value
+
+
+class StreamAccumulator:
+    """
+    Builds the reply of a streamed chat completion incrementally, without retaining the streamed chunks.
+
+    Text deltas are collected in a string builder, tool call deltas in the per-index buffers of a
+    `StreamingToolCallAssembler`, and only the model, finish reason, usage and timing are kept from the chunks.
+    """
+
+    __slots__ = ("_started_at", "_first_token_at", "_text", "_tool_calls", "_model", "_finish_reason", "_usage")
+
+    def __init__(self, started_at: float):
+        """
+        :param started_at: `time.perf_counter()` value taken right before the request was sent.
+        """
+        self._started_at = started_at
+        self._first_token_at: Optional[float] = None
+        self._text: List[str] = []
+        self._tool_calls = StreamingToolCallAssembler()
+        self._model: Optional[str] = None
+        self._finish_reason: Optional[str] = None
+        self._usage: Any = None
+
+    def add(self, chunk: ChatCompletionChunk) -> List[ToolCall]:
+        """
+        Adds a chunk of the stream.
+
+        :returns: The tool calls completed by this chunk.
+        """
+        if chunk.usage:
+            self._usage = chunk.usage
+        # the usage chunk requested via `stream_options` has no choices
+        if not chunk.choices:
+            return []
+        assert len(chunk.choices) == 1, "Streaming responses should have only one choice."
+
+        choice: ChunkChoice = chunk.choices[0]
+        delta = choice.delta
+        if self._first_token_at is None and (delta.content or delta.tool_calls):
+            self._first_token_at = time.perf_counter()
+        self._model = chunk.model
+        self._finish_reason = choice.finish_reason or self._finish_reason
+        if delta.content:
+            self._text.append(delta.content)
+        return self._tool_calls.add(delta.tool_calls)
+
+    def finish(self) -> List[ToolCall]:
+        """
+        Ends the stream.
+
+        :returns: The tool calls that were still pending.
+        """
+        return self._tool_calls.finish()
+
+    def to_chat_message(self) -> ChatMessage:
+        """
+        Connects the accumulated stream into a single ChatMessage.
+        """
+        meta = {
+            "model": self._model,
+            "index": 0,
+            "finish_reason": self._finish_reason,
+            "usage": dict(self._usage or {}),
+            "timing": _timing(self._started_at, self._first_token_at),
+        }
+        return ChatMessage.from_assistant(text="".join(self._text), tool_calls=self._tool_calls.tool_calls, meta=meta)
+
+
 @component
 class OpenAIChatGenerator:
     """
@@ -277,6 +512,7 @@ class OpenAIChatGenerator:
         generation_kwargs: Optional[Dict[str, Any]] = None,
         tools: Optional[List[Tool]] = None,
         tools_strict: Optional[bool] = None,
+        tool_call_callback: Optional[Callable[[ToolCall], None]] = None,
     ):
         """
         Invokes chat completion based on the provided messages and generation parameters.
@@ -297,6 +533,9 @@ class OpenAIChatGenerator:
             Whether to enable strict schema adherence for tool calls. If set to `True`, the model will follow exactly
             the schema provided in the `parameters` field of the tool definition, but this may increase latency.
             If set, it will override the `tools_strict` parameter set during component initialization.
+        :param tool_call_callback:
+            A function that is called with each tool call as soon as it has been fully streamed, while the model
+            may still be generating further tool calls. Only used for streaming responses.
 
         :returns:
             A list containing the generated responses as ChatMessage instances.
@@ -312,6 +551,7 @@ class OpenAIChatGenerator:
         api_args = self._prepare_api_call(
             messages, streaming_callback, generation_kwargs, tools, tools_strict
         )
+        started_at = time.perf_counter()
         chat_completion: Union[Stream[ChatCompletionChunk], ChatCompletion] = (
             self.client.chat.completions.create(**api_args)
         )
@@ -323,6 +563,8 @@ class OpenAIChatGenerator:
             completions = self._handle_stream_response(
                 chat_completion,  # type: ignore
                 streaming_callback,  # type: ignore
+                started_at,
+                tool_call_callback,
             )
         else:
             assert isinstance(
@@ -332,6 +574,8 @@ class OpenAIChatGenerator:
                 self._convert_chat_completion_to_chat_message(chat_completion, choice)
                 for choice in chat_completion.choices
             ]
+            for message in completions:
+                message.meta["timing"] = _timing(started_at)
 
         # before returning, do post-processing of the completions
         for message in completions:
@@ -349,6 +593,7 @@ class OpenAIChatGenerator:
         generation_kwargs: Optional[Dict[str, Any]] = None,
         tools: Optional[List[Tool]] = None,
         tools_strict: Optional[bool] = None,
+        tool_call_callback: Optional[Callable[[ToolCall], None]] = None,
     ):
         """
         Invokes chat completion based on the provided messages and generation parameters.
@@ -369,6 +614,9 @@ class OpenAIChatGenerator:
             Whether to enable strict schema adherence for tool calls. If set to `True`, the model will follow exactly
             the schema provided in the `parameters` field of the tool definition, but this may increase latency.
             If set, it will override the `tools_strict` parameter set during component initialization.
+        :param tool_call_callback:
+            A function that is called with each tool call as soon as it has been fully streamed, while the model
+            may still be generating further tool calls. Only used for streaming responses.
 
         :returns:
             A list containing the generated responses as ChatMessage instances.
@@ -382,6 +630,7 @@ class OpenAIChatGenerator:
         api_args = self._prepare_api_call(
             messages, streaming_callback, generation_kwargs, tools, tools_strict
         )
+        started_at = time.perf_counter()
         chat_completion: Union[AsyncStream[ChatCompletionChunk], ChatCompletion] = (
             await self.async_client.chat.completions.create(**api_args)
         )
@@ -393,6 +642,8 @@ class OpenAIChatGenerator:
             completions = await self._handle_async_stream_response(
                 chat_completion,  # type: ignore
                 streaming_callback,  # type: ignore
+                started_at,
+                tool_call_callback,
             )
         else:
             assert isinstance(
@@ -402,6 +653,8 @@ class OpenAIChatGenerator:
                 self._convert_chat_completion_to_chat_message(chat_completion, choice)
                 for choice in chat_completion.choices
             ]
+            for message in completions:
+                message.meta["timing"] = _timing(started_at)
 
         # before returning, do post-processing of the completions
         for message in completions:
@@ -461,6 +714,13 @@ class OpenAIChatGenerator:
         if is_streaming and num_responses > 1:
             raise ValueError("Cannot stream multiple responses, please set n=1.")
 
+        if is_streaming:
+            # ask OpenAI to append a final chunk carrying the token usage of the whole stream
+            generation_kwargs["stream_options"] = {
+                "include_usage": True,
+                **generation_kwargs.get("stream_options", {}),
+            }
+
         return {
             "model": self.model,
             "messages": openai_formatted_messages,  # type: ignore[arg-type] # openai expects list of specific message types
@@ -474,43 +734,53 @@ class OpenAIChatGenerator:
         self,
         chat_completion: Stream,
         callback: StreamingCallbackT,
+        started_at: float,
+        tool_call_callback: Optional[Callable[[ToolCall], None]] = None,
     ) -> List[ChatMessage]:
-        chunks: List[StreamingChunk] = []
-        chunk = None
+        accumulator = StreamAccumulator(started_at)
 
         for chunk in chat_completion:  # pylint: disable=not-an-iterable
-            assert (
-                len(chunk.choices) == 1
-            ), "Streaming responses should have only one choice."
-            chunk_delta: StreamingChunk = (
-                self._convert_chat_completion_chunk_to_streaming_chunk(chunk)
-            )
-            chunks.append(chunk_delta)
+            completed_tool_calls = accumulator.add(chunk)
+            if not chunk.choices:
+                continue
+
+            callback(self._convert_chat_completion_chunk_to_streaming_chunk(chunk))
+
+            if tool_call_callback:
+                for tool_call in completed_tool_calls:
+                    tool_call_callback(tool_call)
 
-            callback(chunk_delta)
+        for tool_call in accumulator.finish():
+            if tool_call_callback:
+                tool_call_callback(tool_call)
 
-        return [self._convert_streaming_chunks_to_chat_message(chunk, chunks)]
+        return [accumulator.to_chat_message()]
 
     async def _handle_async_stream_response(
         self,
         chat_completion: AsyncStream,
         callback: AsyncStreamingCallbackT,
+        started_at: float,
+        tool_call_callback: Optional[Callable[[ToolCall], None]] = None,
     ) -> List[ChatMessage]:
-        chunks: List[StreamingChunk] = []
-        chunk = None
+        accumulator = StreamAccumulator(started_at)
 
         async for chunk in chat_completion:  # pylint: disable=not-an-iterable
-            assert (
-                len(chunk.choices) == 1
-            ), "Streaming responses should have only one choice."
-            chunk_delta: StreamingChunk = (
-                self._convert_chat_completion_chunk_to_streaming_chunk(chunk)
-            )
-            chunks.append(chunk_delta)
+            completed_tool_calls = accumulator.add(chunk)
+            if not chunk.choices:
+                continue
+
+            await callback(self._convert_chat_completion_chunk_to_streaming_chunk(chunk))
 
-            await callback(chunk_delta)
+            if tool_call_callback:
+                for tool_call in completed_tool_calls:
+                    tool_call_callback(tool_call)
 
-        return [self._convert_streaming_chunks_to_chat_message(chunk, chunks)]
+        for tool_call in accumulator.finish():
+            if tool_call_callback:
+                tool_call_callback(tool_call)
+
+        return [accumulator.to_chat_message()]
 
     def _check_finish_reason(self, meta: Dict[str, Any]) -> None:
         if meta["finish_reason"] == "length":
@@ -527,64 +797,6 @@ class OpenAIChatGenerator:
                 finish_reason=meta["finish_reason"],
             )
 
-    def _convert_streaming_chunks_to_chat_message(
-        self, chunk: Any, chunks: List[StreamingChunk]
-    ) -> ChatMessage:
-        """
-        Connects the streaming chunks into a single ChatMessage.
-
-        :param chunk: The last chunk returned by the OpenAI API.
-        :param chunks: The list of all `StreamingChunk` objects.
-        """
-
-        text = "".join([chunk.content for chunk in chunks])
-        tool_calls = []
-
-        # if it's a tool call , we need to build the payload dict from all the chunks
-        if bool(chunks[0].meta.get("tool_calls")):
-            tools_len = len(chunks[0].meta.get("tool_calls", []))
-
-            payloads = [{"arguments": "", "name": ""} for _ in range(tools_len)]
-            for chunk_payload in chunks:
-                deltas = chunk_payload.meta.get("tool_calls") or []
-
-                # deltas is a list of ChoiceDeltaToolCall or ChoiceDeltaFunctionCall
-                for i, delta in enumerate(deltas):
-                    payloads[i]["id"] = delta.id or payloads[i].get("id", "")
-                    if delta.function:
-                        payloads[i]["name"] += delta.function.name or ""
-                        payloads[i]["arguments"] += delta.function.arguments or ""
-
-            for payload in payloads:
-                arguments_str = payload["arguments"]
-                try:
-                    arguments = json.loads(arguments_str)
-                    tool_calls.append(
-                        ToolCall(
-                            id=payload["id"],
-                            tool_name=payload["name"],
-                            arguments=arguments,
-                        )
-                    )
-                except json.JSONDecodeError:
-                    logger.warning(
-                        "OpenAI returned a malformed JSON string for tool call arguments. This tool call "
-                        "will be skipped. To always generate a valid JSON, set `tools_strict` to `True`. "
-                        "Tool call ID: {_id}, Tool name: {_name}, Arguments: {_arguments}",
-                        _id=payload["id"],
-                        _name=payload["name"],
-                        _arguments=arguments_str,
-                    )
-
-        meta = {
-            "model": chunk.model,
-            "index": 0,
-            "finish_reason": chunk.choices[0].finish_reason,
-            "usage": {},  # we don't have usage data for streaming responses
-        }
-
-        return ChatMessage.from_assistant(text=text, tool_calls=tool_calls, meta=meta)
-
     def _convert_chat_completion_to_chat_message(
         self, completion: ChatCompletion, choice: Choice
     ) -> ChatMessage:
@@ -637,22 +849,10 @@ class OpenAIChatGenerator:
         """
         Converts the streaming response chunk from the OpenAI API to a StreamingChunk.
 
+        We stream the content of the chunk if it's not a tool or function call, the tool calls and function call
+        are available in the meta if they are present.
+
         :param chunk: The chunk returned by the OpenAI API.
-        :param choice: The choice returned by the OpenAI API.
         :return: The StreamingChunk.
         """
-        # we stream the content of the chunk if it's not a tool or function call
-        choice: ChunkChoice = chunk.choices[0]
-        content = choice.delta.content or ""
-        chunk_message = StreamingChunk(content)
-        # but save the tool calls and function call in the meta if they are present
-        # and then connect the chunks in the _convert_streaming_chunks_to_chat_message method
-        chunk_message.meta.update(
-            {
-                "model": chunk.model,
-                "index": choice.index,
-                "tool_calls": choice.delta.tool_calls,
-                "finish_reason": choice.finish_reason,
-            }
-        )
-        return chunk_message
+        return _OpenAIStreamingChunk(chunk)
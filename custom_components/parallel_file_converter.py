@@ -0,0 +1,105 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+from haystack import Document, component, logging
+from haystack.dataclasses import ByteStream
+from utils.metrics import CONVERSION_DURATION, CONVERTED_FILES
+
+logger = logging.getLogger(__name__)
+
+Source = Union[str, Path, ByteStream]
+
+
+def _source_name(source: Source) -> str:
+    if isinstance(source, ByteStream):
+        return str(source.meta.get("file_path", "<bytes>"))
+    return str(source)
+
+
+@component
+class ParallelFileConverter:
+    """
+    Converts the outputs of a `FileTypeRouter` with one converter per MIME type, all branches concurrently.
+
+    Every file is converted on its own on a shared thread pool, so a few large PDFs do not hold back the text and
+    Markdown files and the converters can overlap their file reads. Files of unknown MIME types (the `unclassified`
+    output of the router) and files a converter extracted no text from are reported as skipped.
+    """
+
+    def __init__(self, converters: Dict[str, Any], max_workers: int = 4):
+        """
+        :param converters: Converter components by MIME type, each gets an input of that name.
+        :param max_workers: Files converted at the same time.
+        """
+        self.converters = converters
+        self.max_workers = max_workers
+        for mime_type in converters:
+            component.set_input_type(self, mime_type, Optional[List[Source]], default=None)
+        component.set_input_type(self, "unclassified", Optional[List[Source]], default=None)
+
+    def _convert(self, mime_type: str, source: Source) -> Dict[str, Any]:
+        started_at = time.perf_counter()
+        try:
+            documents = self.converters[mime_type].run(sources=[source])["documents"]
+        except Exception as error:  # noqa: BLE001 - a broken file must not abort the whole indexing run
+            logger.warning("Could not convert {source}: {error}", source=_source_name(source), error=error)
+            documents = []
+        finished_at = time.perf_counter()
+        CONVERSION_DURATION.labels(mime_type=mime_type).observe(finished_at - started_at)
+        return {"documents": documents, "started_at": started_at, "finished_at": finished_at}
+
+    @component.output_types(documents=List[Document], skipped=Dict[str, List[str]], stats=Dict[str, Dict[str, Any]])
+    def run(self, **sources_by_type: Optional[List[Source]]) -> Dict[str, Any]:
+        """
+        :param sources_by_type: Sources per MIME type, as routed by the `FileTypeRouter`.
+        :returns:
+            - `documents`: The converted documents, in the order of the converters and sources.
+            - `skipped`: Names of the files that were not converted, by MIME type.
+            - `stats`: Per MIME type the files, converted files, documents, the wall-clock seconds from the first
+              file of that branch starting until its last file finished and the resulting files per second.
+        """
+        skipped: Dict[str, List[str]] = {}
+        unclassified = sources_by_type.pop("unclassified", None) or []
+        if unclassified:
+            skipped["unclassified"] = [_source_name(source) for source in unclassified]
+            CONVERTED_FILES.labels(mime_type="unclassified", outcome="skipped").inc(len(unclassified))
+
+        tasks = [
+            (mime_type, source)
+            for mime_type in self.converters
+            for source in sources_by_type.get(mime_type) or []
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="convert") as executor:
+            results = list(executor.map(lambda task: self._convert(*task), tasks))
+
+        documents = []
+        stats: Dict[str, Dict[str, Any]] = {}
+        for (mime_type, source), result in zip(tasks, results):
+            # e.g. scanned PDFs without a text layer convert to empty documents
+            converted = [document for document in result["documents"] if document.content and document.content.strip()]
+            branch = stats.setdefault(
+                mime_type,
+                {"files": 0, "converted": 0, "documents": 0, "started_at": result["started_at"], "finished_at": 0.0},
+            )
+            branch["files"] += 1
+            # the files of a branch overlap on the workers, so the branch takes its wall-clock time
+            branch["started_at"] = min(branch["started_at"], result["started_at"])
+            branch["finished_at"] = max(branch["finished_at"], result["finished_at"])
+            branch["documents"] += len(converted)
+            if converted:
+                branch["converted"] += 1
+                documents.extend(converted)
+            else:
+                skipped.setdefault(mime_type, []).append(_source_name(source))
+            CONVERTED_FILES.labels(mime_type=mime_type, outcome="converted" if converted else "skipped").inc()
+
+        for branch in stats.values():
+            branch["seconds"] = branch.pop("finished_at") - branch.pop("started_at")
+            branch["files_per_s"] = branch["files"] / branch["seconds"] if branch["seconds"] else None
+
+        for mime_type, names in skipped.items():
+            logger.warning(
+                "Skipped {count} {mime_type} files: {names}", count=len(names), mime_type=mime_type, names=names[:20]
+            )
+        return {"documents": documents, "skipped": skipped, "stats": stats}
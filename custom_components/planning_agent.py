@@ -0,0 +1,166 @@
+import json
+from typing import Any, Callable, Dict, List, Optional
+from haystack import component, logging, tracing
+from haystack.dataclasses import StreamingChunk
+from haystack_experimental.dataclasses import ChatMessage, ChatRole, Tool, ToolCall
+from utils.admission import get_token_budget
+from .openai_agent import OpenAIAgent, _record_turn, _used_tokens, estimate_call_tokens
+from .openai_generator import OpenAIChatGenerator
+
+logger = logging.getLogger(__name__)
+
+PLANNING_PROMPT = """
+Du planst die Suche eines RAG-Systems. Antworte ausschließlich mit dem JSON-Objekt des vorgegebenen Schemas:
+- "umformulierte_frage": Die letzte Frage des Benutzers, angepasst an interne Begriffe und Abkürzungen, ohne neue Inhalte.
+- "suchanfragen": Präzise, in sich geschlossene Suchanfragen mit "query" und "top_k".
+  - Zerlege die Frage nur bei einem expliziten Vergleich oder mehreren klar abgegrenzten Themen, sonst genau eine Suchanfrage mit der umformulierten Frage.
+  - Verteile insgesamt 6 Textfragmente (top_k) auf die Suchanfragen.
+  - Ergänze keine Aspekte, die nicht in der Frage stehen.
+"""
+
+_PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "umformulierte_frage": {"type": "string"},
+        "suchanfragen": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"query": {"type": "string"}, "top_k": {"type": "integer"}},
+                "required": ["query", "top_k"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["umformulierte_frage", "suchanfragen"],
+    "additionalProperties": False,
+}
+
+
+@component
+class PlanningAgent(OpenAIAgent):
+    """
+    Agent that plans all searches for a question in one LLM call instead of one round trip per step.
+
+    A structured-output call returns the rewritten question and all sub-queries. The rewrite and the searches are
+    then run at once by the tool invoker, and a single call without tools writes the answer, so a decomposed
+    question takes two LLM calls. If the plan is unusable or no search finds anything, the agent continues with
+    the iterative tool loop of `OpenAIAgent`. Only `run_async` plans; `run` always uses the iterative loop.
+    """
+
+    def __init__(
+        self,
+        has_results: Callable[[str], bool],
+        planning_prompt: str = PLANNING_PROMPT,
+        rewrite_tool: str = "umformulieren_anfrage",
+        search_tool: str = "suche_interne_kenntnisse",
+        max_searches: int = 4,
+        **kwargs,
+    ):
+        """
+        :param has_results: Returns whether the result of a search tool call found anything.
+        :param planning_prompt: System prompt of the planning call.
+        :param rewrite_tool: Tool the rewritten question is passed to, so it appears in the history like in the
+            iterative loop. Skipped if the tool is not offered.
+        :param search_tool: Tool the sub-queries are passed to, with the arguments `query` and `top_k`.
+        :param max_searches: Maximum number of sub-queries run for a plan.
+        :param kwargs: Arguments of `OpenAIAgent`, a `tool_invoker` is required.
+        """
+        super(PlanningAgent, self).__init__(**kwargs)
+        if self.tool_invoker is None:
+            raise ValueError("PlanningAgent needs a tool_invoker to run the planned searches.")
+        self.has_results = has_results
+        self.planning_prompt = planning_prompt
+        self.rewrite_tool = rewrite_tool
+        self.search_tool = search_tool
+        self.max_searches = max_searches
+
+    async def _plan(self, messages: List[ChatMessage], tools: List[Tool]) -> Optional[List[ToolCall]]:
+        conversation = [message for message in messages if not message.is_from(ChatRole.SYSTEM)]
+        plan_messages = [ChatMessage.from_system(self.planning_prompt)] + conversation
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": "search_plan", "strict": True, "schema": _PLAN_SCHEMA},
+        }
+
+        budget = get_token_budget()
+        with tracing.tracer.trace("agent.plan", tags={"agent.messages": len(plan_messages)}) as span:
+            if budget is not None:
+                reserved = estimate_call_tokens(plan_messages, None, None)
+                span.set_tag("llm.token_budget_wait_s", await budget.reserve_async(reserved))
+            kwargs = self._apply_model_policy("plan", {"generation_kwargs": {"response_format": response_format}})
+            used = 0
+            try:
+                reply = (await OpenAIChatGenerator.run_async(self, plan_messages, **kwargs))["replies"][0]
+                used = _used_tokens(reply, reserved) if budget is not None else 0
+            finally:
+                if budget is not None:
+                    budget.settle(reserved, used)
+            reply.meta["turn"] = "plan"
+            _record_turn(span, reply)
+
+            try:
+                plan = json.loads(reply.text or "")
+                searches = [
+                    {"query": str(search["query"]), "top_k": max(1, int(search["top_k"]))}
+                    for search in plan["suchanfragen"][:self.max_searches]
+                    if str(search["query"]).strip()
+                ]
+                question = str(plan["umformulierte_frage"])
+            except (ValueError, KeyError, TypeError) as error:
+                logger.warning("Unusable search plan, falling back to the tool loop: {error}", error=error)
+                return None
+            span.set_content_tag("agent.plan", plan)
+
+        if not searches:
+            return None
+        tool_names = {tool.name for tool in tools}
+        tool_calls = []
+        if self.rewrite_tool in tool_names:
+            tool_calls.append(ToolCall(tool_name=self.rewrite_tool, arguments={"originalfrage": question}, id="plan_0"))
+        tool_calls.extend(
+            ToolCall(tool_name=self.search_tool, arguments=search, id=f"plan_{position}")
+            for position, search in enumerate(searches, start=1)
+        )
+        # the usage of the planning call is reported for the message that requested the tool calls
+        return [ChatMessage.from_assistant(tool_calls=tool_calls, meta=reply.meta)]
+
+    @component.output_types(replies=List[ChatMessage], tool_reply=List[ChatMessage], chat_history=List[ChatMessage])
+    async def run_async(
+        self,
+        messages: Optional[List[ChatMessage]] = None,
+        followup_messages: Optional[List[ChatMessage]] = None,
+        tools: Optional[List[Tool]] = None,
+        streaming_callback=None,
+        *args,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        if followup_messages or not tools or self.search_tool not in {tool.name for tool in tools}:
+            # the iterative loop is running, or there is nothing to plan
+            return await super(PlanningAgent, self).run_async(
+                messages, followup_messages, tools, streaming_callback, *args, **kwargs
+            )
+
+        plan = await self._plan(messages, tools)
+        if plan is not None:
+            history = (await self.tool_invoker.run_async(messages=messages + plan))["tool_messages"]
+            tool_messages = history[len(messages) + 1:]
+            if streaming_callback:
+                for message in tool_messages:
+                    await streaming_callback(StreamingChunk(content=message))
+
+            found = any(
+                not message.tool_call_result.error and self.has_results(message.tool_call_result.result)
+                for message in tool_messages
+                if message.tool_call_result.origin.tool_name == self.search_tool
+            )
+            if found:
+                # the final answer, without tools the model cannot start another round
+                return await super(PlanningAgent, self).run_async(
+                    history, tools=None, streaming_callback=streaming_callback, *args, **kwargs
+                )
+            logger.info("The planned searches found nothing, falling back to the tool loop")
+
+        return await super(PlanningAgent, self).run_async(
+            messages, tools=tools, streaming_callback=streaming_callback, *args, **kwargs
+        )
@@ -1,9 +1,21 @@
+import contextvars
+import hashlib
+import json
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
-from haystack import Pipeline
+from haystack import Document, Pipeline, logging, tracing
 from haystack.utils import Secret
+from haystack.document_stores.errors import DocumentStoreError
 from haystack.document_stores.types import DuplicatePolicy
+from haystack.document_stores.in_memory import InMemoryDocumentStore
 from haystack_integrations.document_stores.opensearch import OpenSearchDocumentStore
 from haystack.components.writers import DocumentWriter
 from haystack.components.converters import (
@@ -15,94 +27,803 @@ from haystack.components.preprocessors import DocumentSplitter, DocumentCleaner
 from haystack.components.routers import FileTypeRouter
 from haystack.components.joiners import DocumentJoiner
 from haystack_integrations.components.retrievers.opensearch import OpenSearchBM25Retriever
+from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
 from haystack.components.builders import ChatPromptBuilder
 from haystack.dataclasses import ChatMessage
+from custom_components.batch_bm25_retriever import OPENSEARCH_BM25_QUERY, BatchBM25Retriever
+from custom_components.cached_converter import CachedConverter, package_versions
+from custom_components.context_packer import ContextPacker
+from custom_components.cross_encoder_ranker import CrossEncoderRanker
+from custom_components.embedded_document_store import EmbeddedBM25Retriever, EmbeddedDocumentStore
+from custom_components.near_duplicate_filter import NearDuplicateFilter
+from custom_components.parallel_file_converter import ParallelFileConverter
+from utils.metrics import (
+    INDEXED_DOCUMENTS,
+    INDEXED_DUPLICATES,
+    INDEXED_FILES,
+    INDEXING_DURATION,
+    RETRIEVAL_BATCH_SIZE,
+    RETRIEVAL_QUERY_DURATION,
+    record_cache_lookup,
+)
 
 
 USER_MESSAGE_TEMPLATE = """
 Dokumente:
 {% for document in documents %}
-Document[{{ loop.index }}]
+Document[{{ loop.index }}]{% if document.meta.file_path %} ({{ document.meta.file_path.split("/")[-1] }}){% endif %}
 {{ document.content }}
 {% endfor %}
 """
 
+
+def has_documents(search_result: str) -> bool:
+    """
+    Returns whether a search result rendered with `USER_MESSAGE_TEMPLATE` contains any document.
+    """
+    return "Document[1]" in search_result
+
 # Load environment variables
 load_dotenv()
 
-def init_document_store():
+logger = logging.getLogger(__name__)
+
+_document_store = None
+# results of the searches within `shared_searches`, by normalized query, top_k and token budget
+_shared_searches: Optional["OrderedDict[Tuple[str, int, Optional[int]], Future]"] = None
+_shared_searches_max = 0
+_shared_searches_lock = threading.Lock()
+# index settings that can be changed on a live index, all others need a reindex
+_DYNAMIC_INDEX_SETTINGS = ("number_of_replicas", "refresh_interval")
+# speculative search of the current request, see `prefetch_search`
+_prefetch: contextvars.ContextVar[Optional["_Prefetch"]] = contextvars.ContextVar("retrieval_prefetch", default=None)
+_prefetch_executor: Optional[ThreadPoolExecutor] = None
+_prefetch_lock = threading.Lock()
+_QUERY_TERMS = re.compile(r"\w+")
+# ids of the documents retrieved within `collect_retrieved_ids`
+_retrieved_ids: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("retrieved_ids", default=None)
+
+def get_document_store_backend():
+    """
+    Returns the configured document store backend, `opensearch` (default), `embedded` or `memory`.
+
+    The embedded store is an on-disk BM25 index searched in-process, for deployments without OpenSearch. The
+    in-memory store lives only in this process and is meant for benchmarks and local experiments.
+    """
+    return os.getenv("DOCUMENT_STORE", "opensearch").lower()
+
+
+def get_document_store():
+    """
+    Returns the document store shared by all retrieval and indexing pipelines of this process.
+    """
+    global _document_store
+    if _document_store is None:
+        document_store = init_document_store()
+        if isinstance(document_store, OpenSearchDocumentStore):
+            ensure_opensearch_index(document_store)
+        _document_store = document_store
+    return _document_store
+
+
+def init_document_store(backend: Optional[str] = None, index: Optional[str] = None):
+    """
+    Creates a new document store.
+
+    :param backend: `opensearch`, `embedded` or `memory`, defaults to the `DOCUMENT_STORE` setting.
+    :param index: Index to use, defaults to `OPENSEARCH_INDEX` or `document`. The embedded store keeps each index
+        in a directory of that name below `EMBEDDED_INDEX_PATH` (default `.cache/embedded_index`). For OpenSearch
+        this is the alias of the current index version, see `ensure_opensearch_index`.
+    """
+    backend = backend or get_document_store_backend()
+    if backend == "memory":
+        return InMemoryDocumentStore()
+    if backend == "embedded":
+        index_path = Path(os.getenv("EMBEDDED_INDEX_PATH", ".cache/embedded_index"))
+        return EmbeddedDocumentStore(index_path / (index or os.getenv("OPENSEARCH_INDEX", "document")))
+    if backend != "opensearch":
+        raise ValueError(f"Unknown DOCUMENT_STORE '{backend}', expected 'opensearch', 'embedded' or 'memory'.")
+
+    body = get_opensearch_index_body()
     return OpenSearchDocumentStore(
         hosts=os.getenv("OPENSEARCH_HOST", "http://opensearch:9200"),
         username=os.getenv("OPENSEARCH_USERNAME", "admin"),
         password=os.getenv("OPENSEARCH_PASSWORD", "XYZ_123"),
-        index="document",
+        index=index or os.getenv("OPENSEARCH_INDEX", "document"),
         embedding_dim=768,
         similarity="cosine",
+        mappings=body["mappings"],
+        settings=body["settings"],
+        # the versioned index behind the alias is created by ensure_opensearch_index
+        create_index=False,
+    )
+
+
+def load_decompound_words() -> List[str]:
+    """
+    Returns the subwords the German analyzer splits compounds into, one per line in `OPENSEARCH_DECOMPOUND_WORDS`
+    (default `utils/decompound_words.txt`, empty to disable decompounding).
+    """
+    path = os.getenv("OPENSEARCH_DECOMPOUND_WORDS", str(Path(__file__).parent / "utils" / "decompound_words.txt"))
+    if not path:
+        return []
+    with open(path, encoding="utf-8") as f:
+        words = {line.strip().lower() for line in f if line.strip() and not line.startswith("#")}
+    return sorted(words)
+
+
+def get_opensearch_index_body() -> Dict[str, Any]:
+    """
+    Returns the settings and mappings of new OpenSearch index versions.
+
+    The content is analyzed for German: stop words, compounds split into the subwords of `load_decompound_words`,
+    umlaut normalization and light stemming, so that e.g. "Roggenbrote" matches "Brot". The `content.exact` field
+    keeps the unstemmed words for exact matches. Shards, replicas and the refresh interval are configured with
+    `OPENSEARCH_SHARDS` (default 1), `OPENSEARCH_REPLICAS` (default 0, a single node) and
+    `OPENSEARCH_REFRESH_INTERVAL` (default `1s`).
+
+    `mappings._meta.settings_version` is a hash of everything that can only be changed by a reindex.
+    """
+    filters: Dict[str, Any] = {
+        "german_stop": {"type": "stop", "stopwords": "_german_"},
+        "german_stemmer": {"type": "stemmer", "language": "light_german"},
+    }
+    chain = ["lowercase", "german_stop"]
+    words = load_decompound_words()
+    if words:
+        # before the normalization, the word list is matched with umlauts
+        filters["german_decompounder"] = {
+            "type": "dictionary_decompounder",
+            "word_list": words,
+            "min_subword_size": 4,
+            "only_longest_match": True,
+        }
+        chain.append("german_decompounder")
+    chain += ["german_normalization", "german_stemmer"]
+
+    settings = {
+        "index": {
+            "knn": True,
+            "number_of_shards": int(os.getenv("OPENSEARCH_SHARDS", "1")),
+            "number_of_replicas": int(os.getenv("OPENSEARCH_REPLICAS", "0")),
+            "refresh_interval": os.getenv("OPENSEARCH_REFRESH_INTERVAL", "1s"),
+        },
+        "analysis": {
+            "filter": filters,
+            "analyzer": {"german_text": {"type": "custom", "tokenizer": "standard", "filter": chain}},
+        },
+    }
+    mappings: Dict[str, Any] = {
+        "properties": {
+            "embedding": {"type": "knn_vector", "index": True, "dimension": 768},
+            "content": {
+                "type": "text",
+                "analyzer": "german_text",
+                "fields": {"exact": {"type": "text", "analyzer": "standard"}},
+            },
+        },
+        "dynamic_templates": [{"strings": {"match_mapping_type": "string", "mapping": {"type": "keyword"}}}],
+    }
+    static = {
+        "index": {key: value for key, value in settings["index"].items() if key not in _DYNAMIC_INDEX_SETTINGS},
+        "analysis": settings["analysis"],
+        "mappings": mappings,
+    }
+    mappings["_meta"] = {
+        "settings_version": hashlib.sha256(json.dumps(static, sort_keys=True).encode()).hexdigest()[:12]
+    }
+    return {"settings": settings, "mappings": mappings}
+
+
+def _index_versions(client, alias: str) -> List[str]:
+    names = [name for name in client.indices.get(index=f"{alias}_v*") if name[len(alias) + 2:].isdigit()]
+    return sorted(names, key=lambda name: int(name[len(alias) + 2:]))
+
+
+def _create_index_version(client, alias: str, body: Dict[str, Any], **index_settings: Any) -> str:
+    versions = _index_versions(client, alias)
+    name = f"{alias}_v{int(versions[-1][len(alias) + 2:]) + 1 if versions else 1}"
+    settings = {**body["settings"], "index": {**body["settings"]["index"], **index_settings}}
+    client.indices.create(index=name, body={"settings": settings, "mappings": body["mappings"]})
+    return name
+
+
+def ensure_opensearch_index(document_store: OpenSearchDocumentStore):
+    """
+    Prepares the index of an OpenSearch document store.
+
+    If neither the alias nor an index of that name exists, the first version (`<alias>_v1`) is created with the
+    settings of `get_opensearch_index_body` and the alias is pointed to it. For an existing index, changed replicas
+    and refresh interval are applied in place; changed analysis settings or mappings are only logged, they are
+    rolled out with `reindex_opensearch_index`.
+    """
+    from opensearchpy.exceptions import RequestError
+
+    alias = document_store._index
+    client = document_store.client
+    body = get_opensearch_index_body()
+
+    if not client.indices.exists(index=alias):
+        try:
+            name = _create_index_version(client, alias, body)
+            client.indices.put_alias(index=name, name=alias)
+        except RequestError as error:
+            # another worker was faster
+            if error.error != "resource_already_exists_exception":
+                raise
+        else:
+            logger.info("Created OpenSearch index {index} for alias {alias}", index=name, alias=alias)
+        return
+
+    dynamic = {key: str(body["settings"]["index"][key]) for key in _DYNAMIC_INDEX_SETTINGS}
+    for name, index in client.indices.get(index=alias).items():
+        current = index["settings"]["index"]
+        if any(str(current.get(key)) != value for key, value in dynamic.items()):
+            client.indices.put_settings(index=name, body={"index": dynamic})
+        version = index["mappings"].get("_meta", {}).get("settings_version")
+        if version != body["mappings"]["_meta"]["settings_version"]:
+            logger.warning(
+                "OpenSearch index {index} was created with other analysis settings or mappings, "
+                "run retrieval.reindex_opensearch_index() or POST /index/reindex to roll them out",
+                index=name,
+            )
+
+
+def reindex_opensearch_index(index: Optional[str] = None, keep_previous: bool = False) -> Dict[str, Any]:
+    """
+    Rolls out the current index settings without downtime.
+
+    Creates a new index version with the settings of `get_opensearch_index_body`, copies all documents into it
+    server-side and then moves the alias to it in one atomic step, so searches use the old version until the swap.
+    Documents written to the alias during the copy are not carried over. An unversioned index of the alias' name,
+    as created before the settings were managed, is replaced by the alias.
+
+    :param index: The alias, defaults to `OPENSEARCH_INDEX` or `document`.
+    :param keep_previous: Keep the previous index versions instead of deleting them, e.g. to swap back.
+    :returns: The alias, the new and previous index names and the number of copied documents.
+    """
+    document_store = init_document_store("opensearch", index=index)
+    alias = document_store._index
+    client = document_store.client
+    body = get_opensearch_index_body()
+
+    with tracing.tracer.trace("indexing.reindex", tags={"indexing.alias": alias}) as span:
+        if client.indices.exists_alias(name=alias):
+            previous = list(client.indices.get_alias(name=alias))
+        else:
+            previous = [alias] if client.indices.exists(index=alias) else []
+
+        # no refreshes and replicas while copying, the configured values are applied before the swap
+        name = _create_index_version(client, alias, body, refresh_interval="-1", number_of_replicas=0)
+        copied = 0
+        if previous:
+            result = client.reindex(
+                body={"source": {"index": alias}, "dest": {"index": name}},
+                wait_for_completion=True,
+                refresh=True,
+                request_timeout=3600,
+            )
+            copied = result["total"]
+            if result.get("failures"):
+                client.indices.delete(index=name)
+                raise DocumentStoreError(f"Reindexing {alias} into {name} failed: {result['failures'][:3]}")
+        client.indices.put_settings(
+            index=name, body={"index": {key: body["settings"]["index"][key] for key in _DYNAMIC_INDEX_SETTINGS}}
+        )
+
+        actions = [
+            {"remove_index": {"index": old}} if old == alias else {"remove": {"index": old, "alias": alias}}
+            for old in previous
+        ]
+        actions.append({"add": {"index": name, "alias": alias}})
+        client.indices.update_aliases(body={"actions": actions})
+        if not keep_previous:
+            for old in previous:
+                if old != alias:
+                    client.indices.delete(index=old)
+
+        span.set_tag("indexing.documents", copied)
+    logger.info(
+        "Reindexed {documents} documents of {alias} from {previous} into {index}",
+        documents=copied,
+        alias=alias,
+        previous=previous,
+        index=name,
+    )
+    return {"alias": alias, "index": name, "previous": previous, "documents": copied}
+
+
+def create_retriever(document_store, top_k: int = 5):
+    if isinstance(document_store, InMemoryDocumentStore):
+        return InMemoryBM25Retriever(document_store=document_store, top_k=top_k)
+    if isinstance(document_store, EmbeddedDocumentStore):
+        return EmbeddedBM25Retriever(document_store=document_store, top_k=top_k)
+    # The batched searches of `BatchBM25Retriever` send the same query with `_msearch` and read the hits with the
+    # store's private `_index` and `_deserialize_document`. Check them when updating opensearch-haystack, which is
+    # pinned in the Dockerfile for this reason.
+    return OpenSearchBM25Retriever(document_store=document_store, top_k=top_k, custom_query=OPENSEARCH_BM25_QUERY)
+
+
+def is_rerank_enabled() -> bool:
+    """
+    Returns whether search results are reranked by a cross-encoder, enabled with `RERANK=true`.
+    """
+    return os.getenv("RERANK", "false").lower() == "true"
+
+
+def get_rerank_top_k(top_k: int) -> Tuple[int, int]:
+    """
+    Returns how many candidates to fetch for reranking and how many of them to keep for a requested `top_k`.
+
+    BM25 over-fetches `RERANK_CANDIDATES` (default 20) candidates and at most `RERANK_TOP_K` (default 3) of the
+    reranked ones are returned, fewer but more relevant chunks than BM25's own top_k.
+    """
+    candidates = max(top_k, int(os.getenv("RERANK_CANDIDATES", "20")))
+    return candidates, min(top_k, int(os.getenv("RERANK_TOP_K", "3")))
+
+
+def create_ranker(top_k: int = 3) -> CrossEncoderRanker:
+    kwargs = {"model": os.getenv("RERANK_MODEL")} if os.getenv("RERANK_MODEL") else {}
+    return CrossEncoderRanker(top_k=top_k, quantize=os.getenv("RERANK_QUANTIZE", "true").lower() == "true", **kwargs)
+
+
+def warm_up_ranker():
+    """
+    Loads the cross-encoder if reranking is enabled, so that the first search does not wait for it.
+    """
+    if is_rerank_enabled():
+        create_ranker().warm_up()
+
+
+def is_context_packing_enabled() -> bool:
+    """
+    Returns whether search results are packed into a token budget, enabled with `CONTEXT_PACKING=true`.
+    """
+    return os.getenv("CONTEXT_PACKING", "false").lower() == "true"
+
+
+def create_context_packer() -> ContextPacker:
+    return ContextPacker(
+        token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500")),
+        max_sentences=int(os.getenv("CONTEXT_MAX_SENTENCES", "3")),
     )
 
 
-def create_pipeline():
-    document_store = init_document_store()
+def create_pipeline(document_store=None, top_k: int = 5, rerank: Optional[bool] = None, pack: Optional[bool] = None):
+    if document_store is None:
+        document_store = get_document_store()
+    if rerank is None:
+        rerank = is_rerank_enabled()
+    if pack is None:
+        pack = is_context_packing_enabled()
     pipeline = Pipeline()
 
     # Add retriever component
-    retriever = OpenSearchBM25Retriever(document_store=document_store, top_k=5)
+    candidates, reranked_top_k = get_rerank_top_k(top_k) if rerank else (top_k, top_k)
+    retriever = BatchBM25Retriever(create_retriever(document_store, top_k=candidates), document_store)
     chat_prompt_builder = ChatPromptBuilder(template=[
         ChatMessage.from_user(USER_MESSAGE_TEMPLATE)
     ])
     pipeline.add_component("retriever", retriever)
     pipeline.add_component("chat_prompt_builder", chat_prompt_builder)
 
-    pipeline.connect("retriever.documents", "chat_prompt_builder.documents")
+    # retriever -> (ranker) -> (context_packer) -> chat_prompt_builder
+    last_stage = "retriever"
+    if rerank:
+        pipeline.add_component("ranker", create_ranker(top_k=reranked_top_k))
+        pipeline.connect("retriever.documents", "ranker.documents")
+        last_stage = "ranker"
+    if pack:
+        pipeline.add_component("context_packer", create_context_packer())
+        pipeline.connect(f"{last_stage}.documents", "context_packer.documents")
+        last_stage = "context_packer"
+    pipeline.connect(f"{last_stage}.documents", "chat_prompt_builder.documents")
 
     return pipeline
 
-def run_pipeline(query: str, top_k: int):
-    pipeline = create_pipeline()
 
-    # Run retriever
-    result = pipeline.run(data={"retriever": {"query": query, "top_k": top_k}})
+def pipeline_inputs(
+    query: str, top_k: int, rerank: bool, pack: bool = False, token_budget: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Returns the inputs of a pipeline built by `create_pipeline` for a search.
+    """
+    inputs: Dict[str, Any] = {"retriever": {"query": query, "top_k": top_k}}
+    if rerank:
+        candidates, reranked_top_k = get_rerank_top_k(top_k)
+        inputs["retriever"]["top_k"] = candidates
+        inputs["ranker"] = {"query": query, "top_k": reranked_top_k}
+    if pack:
+        inputs["context_packer"] = {"query": query, "token_budget": token_budget}
+    return inputs
+
+
+@contextmanager
+def shared_searches(max_entries: int = 10000):
+    """
+    Runs identical searches only once within the block, for all threads, e.g. while a batch of questions is
+    answered that lead to the same sub-queries.
 
-    return result['chat_prompt_builder']['prompt'][0].text
+    Searches are identical if their queries only differ in whitespace or letter case, which BM25 ignores, and their
+    `top_k` and token budget match. Searches running in another thread are waited for. The results of at most
+    `max_entries` searches are kept until the block is left.
+    """
+    global _shared_searches, _shared_searches_max
+    with _shared_searches_lock:
+        _shared_searches = OrderedDict()
+        _shared_searches_max = max_entries
+    try:
+        yield
+    finally:
+        with _shared_searches_lock:
+            _shared_searches = None
 
-def init_indexing_pipeline():
-    document_store = init_document_store()
+
+def _shared_results(
+    queries: List[Tuple[str, int]],
+    token_budget: Optional[int],
+    search: Callable[[List[Tuple[str, int]]], List[str]],
+) -> List[str]:
+    if _shared_searches is None:
+        return search(queries)
+
+    keys = [(" ".join(query.lower().split()), top_k, token_budget) for query, top_k in queries]
+    futures: List[Future] = []
+    pending: List[int] = []
+    with _shared_searches_lock:
+        for key in keys:
+            future = _shared_searches.get(key)
+            if future is None:
+                future = _shared_searches[key] = Future()
+                pending.append(len(futures))
+                if len(_shared_searches) > _shared_searches_max:
+                    _shared_searches.popitem(last=False)
+            else:
+                _shared_searches.move_to_end(key)
+            futures.append(future)
+
+    for position in range(len(queries)):
+        record_cache_lookup("shared_searches", position not in pending)
+    if pending:
+        try:
+            results = search([queries[position] for position in pending])
+        except BaseException as error:
+            with _shared_searches_lock:
+                for position in pending:
+                    # failed searches are retried by the next caller
+                    if _shared_searches is not None and _shared_searches.get(keys[position]) is futures[position]:
+                        del _shared_searches[keys[position]]
+                    futures[position].set_exception(error)
+            raise
+        for position, result in zip(pending, results):
+            futures[position].set_result(result)
+    return [future.result() for future in futures]
+
+
+class _Prefetch:
+    def __init__(self, query: str, fetch_top_k: int, future: Future):
+        self.terms = _query_terms(query)
+        self.fetch_top_k = fetch_top_k
+        self.future = future
+
+
+def _query_terms(query: str) -> set:
+    return set(_QUERY_TERMS.findall(query.lower()))
+
+
+def is_prefetch_enabled() -> bool:
+    """
+    Returns whether the user's question is searched speculatively at the start of a request, enabled with
+    `RETRIEVAL_PREFETCH=true`.
+    """
+    return os.getenv("RETRIEVAL_PREFETCH", "false").lower() == "true"
+
+
+def _get_prefetch_executor() -> ThreadPoolExecutor:
+    global _prefetch_executor
+    with _prefetch_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("RETRIEVAL_PREFETCH_WORKERS", "8")), thread_name_prefix="prefetch"
+            )
+        return _prefetch_executor
+
+
+def _fetch_prefetch(query: str, fetch_top_k: int) -> List[Document]:
+    with tracing.tracer.trace("retrieval.prefetch", tags={"retrieval.top_k": fetch_top_k}) as span:
+        span.set_content_tag("retrieval.query", query)
+        with RETRIEVAL_QUERY_DURATION.labels(backend=get_document_store_backend()).time():
+            return retrieve_documents_batch([(query, fetch_top_k)])[0]
+
+
+@contextmanager
+def prefetch_search(query: Optional[str]):
+    """
+    Starts a BM25 search for `query` in the background, e.g. for the user's question while the model is still
+    deciding on its searches. Searches within the block whose query has nearly the same terms and that need at most
+    as many candidates are served from the prefetched documents, see `RETRIEVAL_PREFETCH_MIN_SIMILARITY` (Jaccard
+    similarity of the query terms, default 0.8). The prefetch fetches the candidates of a search with
+    `RETRIEVAL_PREFETCH_TOP_K` (default 6). Does nothing unless prefetching is enabled, see `is_prefetch_enabled`.
+    """
+    if not query or not query.strip() or not is_prefetch_enabled():
+        yield
+        return
+
+    top_k = int(os.getenv("RETRIEVAL_PREFETCH_TOP_K", "6"))
+    fetch_top_k = get_rerank_top_k(top_k)[0] if is_rerank_enabled() else top_k
+    # the prefetch belongs to the trace of the request
+    context = contextvars.copy_context()
+    future = _get_prefetch_executor().submit(context.run, _fetch_prefetch, query, fetch_top_k)
+    token = _prefetch.set(_Prefetch(query, fetch_top_k, future))
+    try:
+        yield
+    finally:
+        _prefetch.reset(token)
+        future.cancel()
+
+
+def _prefetched_documents(query: str, fetch_top_k: int) -> Optional[List[Document]]:
+    prefetch = _prefetch.get()
+    if prefetch is None:
+        return None
+
+    documents = None
+    terms = _query_terms(query)
+    similarity = len(terms & prefetch.terms) / len(terms | prefetch.terms) if terms | prefetch.terms else 0.0
+    if fetch_top_k <= prefetch.fetch_top_k and similarity >= float(
+        os.getenv("RETRIEVAL_PREFETCH_MIN_SIMILARITY", "0.8")
+    ):
+        # a prefetch still waiting for a worker is slower than searching right away
+        if not prefetch.future.cancel():
+            try:
+                # BM25 ranks the same way for any top_k, so the best candidates are a prefix
+                documents = prefetch.future.result()[:fetch_top_k]
+            except Exception as error:  # noqa: BLE001 - the search is run regularly instead
+                logger.warning("Prefetched search failed, searching again: {error}", error=error)
+    record_cache_lookup("prefetch", documents is not None)
+    return documents
+
+
+@contextmanager
+def collect_retrieved_ids() -> Iterator[List[str]]:
+    """
+    Collects the ids of the documents returned by the searches within the block, e.g. of one agent run, in the
+    order they were retrieved and without duplicates.
+    """
+    ids: List[str] = []
+    token = _retrieved_ids.set(ids)
+    try:
+        yield ids
+    finally:
+        _retrieved_ids.reset(token)
+
+
+def _record_retrieved(documents: List[List[Document]]):
+    ids = _retrieved_ids.get()
+    if ids is None:
+        return
+    for docs in documents:
+        for doc in docs:
+            if doc.id not in ids:
+                ids.append(doc.id)
+
+
+def run_pipeline(query: str, top_k: int, token_budget: Optional[int] = None):
+    """
+    Searches the document store and renders the result for the LLM.
+
+    :param query: The search query.
+    :param top_k: Number of chunks to retrieve.
+    :param token_budget: Maximum estimated tokens of the rendered documents if context packing is enabled,
+        defaults to `CONTEXT_TOKEN_BUDGET`.
+    """
+    return run_pipeline_batch([(query, top_k)], token_budget)[0]
+
+
+def retrieve_documents_batch(queries: List[Tuple[str, int]], document_store=None) -> List[List[Document]]:
+    """
+    Runs several BM25 searches at once, for OpenSearch as a single `_msearch` round trip.
+
+    :param queries: `(query, top_k)` pairs.
+    :param document_store: Document store to search, defaults to the shared document store.
+    :returns: The retrieved documents for each query, in the order of `queries`.
+    """
+    if document_store is None:
+        document_store = get_document_store()
+    return BatchBM25Retriever(create_retriever(document_store), document_store).run_batch(queries)
+
+
+def run_pipeline_batch(queries: List[Tuple[str, int]], token_budget: Optional[int] = None) -> List[str]:
+    """
+    Batched variant of `run_pipeline`: searches all queries in one round trip and renders one result per query.
+
+    :param queries: `(query, top_k)` pairs.
+    :param token_budget: Maximum estimated tokens of the rendered documents per query if context packing is enabled.
+    :returns: The rendered search result for each query, in the order of `queries`.
+    """
+    return _shared_results(queries, token_budget, lambda pending: _run_pipeline_batch(pending, token_budget))
+
+
+def _run_pipeline_batch(queries: List[Tuple[str, int]], token_budget: Optional[int] = None) -> List[str]:
+    with tracing.tracer.trace("retrieval.run_pipeline", tags={"retrieval.batch_size": len(queries)}) as span:
+        span.set_content_tag("retrieval.queries", [query for query, _ in queries])
+        RETRIEVAL_BATCH_SIZE.observe(len(queries))
+        rerank = is_rerank_enabled()
+        pack = is_context_packing_enabled()
+        pipeline = create_pipeline(rerank=rerank, pack=pack)
+
+        # the documents of all queries are fetched in one round trip, unless they were prefetched
+        fetch = [(query, get_rerank_top_k(top_k)[0] if rerank else top_k) for query, top_k in queries]
+        documents = [_prefetched_documents(query, fetch_top_k) for query, fetch_top_k in fetch]
+        missing = [position for position, docs in enumerate(documents) if docs is None]
+        if missing:
+            with RETRIEVAL_QUERY_DURATION.labels(backend=get_document_store_backend()).time():
+                fetched = pipeline.get_component("retriever").run_batch([fetch[position] for position in missing])
+            for position, docs in zip(missing, fetched):
+                documents[position] = docs
+
+        # then the pipeline runs once per query on its documents, every stage gets its own component span
+        last_stage = "context_packer" if pack else "ranker" if rerank else "retriever"
+        prompts = []
+        for (query, top_k), docs in zip(queries, documents):
+            inputs = pipeline_inputs(query, top_k, rerank, pack, token_budget)
+            inputs["retriever"]["documents"] = docs
+            result = pipeline.run(data=inputs, include_outputs_from={last_stage})
+            _record_retrieved([result[last_stage]["documents"]])
+            prompts.append(result["chat_prompt_builder"]["prompt"][0].text)
+        return prompts
+
+def get_parsed_document_cache_dir() -> Optional[Path]:
+    """
+    Returns the directory of the parsed document cache, `PARSED_DOCUMENT_CACHE` (default `.cache/parsed_documents`),
+    or `None` if it is set to an empty value.
+    """
+    cache_dir = os.getenv("PARSED_DOCUMENT_CACHE", ".cache/parsed_documents")
+    return Path(cache_dir) if cache_dir else None
+
+
+def create_converter(converter, *packages: str, use_cache: bool = True):
+    """
+    Wraps a converter in the parsed document cache, if the cache is enabled.
+
+    :param converter: The converter component.
+    :param packages: Packages whose versions invalidate the cached output of the converter.
+    :param use_cache: `False` to always convert.
+    """
+    cache_dir = get_parsed_document_cache_dir() if use_cache else None
+    if cache_dir is None:
+        return converter
+    return CachedConverter(converter, cache_dir, version=package_versions("haystack-ai", *packages))
+
+
+def init_indexing_pipeline(
+    document_store=None,
+    split_length: int = 250,
+    split_overlap: int = 50,
+    dedup_threshold: Optional[float] = 0.85,
+    use_cache: bool = True,
+):
+    """
+    Creates the pipeline that converts, cleans, splits, deduplicates and writes files to the document store.
+
+    :param document_store: Target document store, defaults to the shared document store.
+    :param split_length: Words per chunk.
+    :param split_overlap: Words shared by consecutive chunks.
+    :param dedup_threshold: Minimum similarity of chunks dropped as near-duplicates of an earlier chunk of the same
+        run, `None` to write all chunks.
+    :param use_cache: Read converted files from the parsed document cache, see `get_parsed_document_cache_dir`.
+    """
+    if document_store is None:
+        document_store = get_document_store()
     indexing_pipeline = Pipeline()
 
+    # One converter per MIME type, the branches run concurrently inside the file converter
+    converters = {
+        "text/plain": create_converter(TextFileToDocument(), use_cache=use_cache),
+        "application/pdf": create_converter(PyPDFToDocument(), "pypdf", use_cache=use_cache),
+        "text/markdown": create_converter(MarkdownToDocument(progress_bar=False), "markdown-it-py", "mdit-plain", use_cache=use_cache),
+    }
+
     # Add components for preprocessing and indexing
     components = [
-        ("file_type_router", FileTypeRouter(mime_types=["text/plain", "application/pdf", "text/markdown"])),
-        ("pypdf_converter", PyPDFToDocument()),
+        ("file_type_router", FileTypeRouter(mime_types=list(converters))),
+        ("file_converter", ParallelFileConverter(converters, max_workers=int(os.getenv("INDEXING_WORKERS", "4")))),
         ("document_joiner", DocumentJoiner()),
         ("document_cleaner", DocumentCleaner()),
-        ("document_splitter", DocumentSplitter(split_by="word", split_length=250, split_overlap=50)),
+        ("document_splitter", DocumentSplitter(split_by="word", split_length=split_length, split_overlap=split_overlap)),
         ("document_writer", DocumentWriter(document_store, policy=DuplicatePolicy.OVERWRITE)),
     ]
+    if dedup_threshold is not None:
+        components.insert(-1, ("near_duplicate_filter", NearDuplicateFilter(threshold=dedup_threshold)))
 
     for name, component in components:
         indexing_pipeline.add_component(name, component)
 
     # Connect components
-    indexing_pipeline.connect("file_type_router.application/pdf", "pypdf_converter.sources")
-    indexing_pipeline.connect("pypdf_converter", "document_joiner")
+    for mime_type in [*converters, "unclassified"]:
+        indexing_pipeline.connect(f"file_type_router.{mime_type}", f"file_converter.{mime_type}")
+    indexing_pipeline.connect("file_converter.documents", "document_joiner")
     indexing_pipeline.connect("document_joiner", "document_cleaner")
     indexing_pipeline.connect("document_cleaner", "document_splitter")
-    indexing_pipeline.connect("document_splitter", "document_writer")
+    if dedup_threshold is not None:
+        indexing_pipeline.connect("document_splitter", "near_duplicate_filter")
+        indexing_pipeline.connect("near_duplicate_filter.documents", "document_writer")
+    else:
+        indexing_pipeline.connect("document_splitter", "document_writer")
 
     return indexing_pipeline
 
 
+def iter_documents(document_store) -> Iterator[Document]:
+    """
+    Yields all documents of a store, for OpenSearch with a scroll instead of the first 10,000 hits.
+    """
+    if not isinstance(document_store, OpenSearchDocumentStore):
+        yield from document_store.filter_documents()
+        return
+
+    from opensearchpy.helpers import scan
+
+    for hit in scan(document_store.client, index=document_store._index, query={"query": {"match_all": {}}}):
+        yield document_store._deserialize_document(hit)
+
+
+def export_embedded_index(source=None, index: Optional[str] = None) -> int:
+    """
+    Builds the embedded index from the documents of another store, so it can be shipped alongside or instead of
+    OpenSearch.
+
+    :param source: The store to export, defaults to the OpenSearch index.
+    :param index: Name of the exported index, defaults to `OPENSEARCH_INDEX` or `document`.
+    :returns: The number of exported documents.
+    """
+    if source is None:
+        source = init_document_store("opensearch", index=index)
+    with tracing.tracer.trace("indexing.export_embedded_index") as span:
+        exported = init_document_store("embedded", index=index).replace_documents(list(iter_documents(source)))
+        span.set_tag("indexing.documents", exported)
+    return exported
+
+
 def index_files():
+    """
+    Indexes all files in `utils/data`.
+
+    :returns: A report with the files skipped per MIME type, the conversion throughput per MIME type and the
+        chunks written.
+    """
     indexing_pipeline = init_indexing_pipeline()
 
     input_dir = Path("utils/data")
     if not input_dir.exists():
         raise FileNotFoundError("Input directory does not exist. Please provide a valid path.")
 
+    sources = [path for path in input_dir.glob("**/*") if path.is_file()]
+
     # Run the indexing pipeline
-    indexing_pipeline.run(
-        {"file_type_router": {"sources": list(input_dir.glob("**/*"))}}
-    )
+    started_at = time.perf_counter()
+    with tracing.tracer.trace("indexing.index_files", tags={"indexing.sources": len(sources)}):
+        result = indexing_pipeline.run(
+            {"file_type_router": {"sources": sources}}
+        )
+    INDEXING_DURATION.observe(time.perf_counter() - started_at)
+    INDEXED_FILES.inc(len(sources))
+    # the router emits nothing for an empty data directory
+    converted = result.get("file_converter", {})
+    documents_written = result.get("document_writer", {}).get("documents_written", 0)
+    INDEXED_DOCUMENTS.inc(documents_written)
+    if "near_duplicate_filter" in result:
+        INDEXED_DUPLICATES.inc(result["near_duplicate_filter"]["stats"]["duplicates"])
+
+    if get_document_store_backend() == "opensearch" and os.getenv("EMBEDDED_INDEX_EXPORT", "false").lower() == "true":
+        export_embedded_index(get_document_store())
+
+    return {
+        "files": len(sources),
+        "skipped": converted.get("skipped", {}),
+        "conversion": converted.get("stats", {}),
+        "documents_written": documents_written,
+    }
 
 if __name__ == "__main__":
 
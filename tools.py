@@ -1,6 +1,6 @@
-from typing import Annotated, Literal
+from typing import Annotated, Any, Callable, Dict, List, Literal
 from haystack_experimental.dataclasses import Tool
-from retrieval import run_pipeline
+from retrieval import run_pipeline, run_pipeline_batch
 
 
 def umformulieren_anfrage(
@@ -19,10 +19,23 @@ def suche_interne_kenntnisse(
     return result
 
 
+def _suche_interne_kenntnisse_batch(calls: List[Dict[str, Any]]) -> List[str]:
+    """Runs several `suche_interne_kenntnisse` calls of one assistant message as a single batched search."""
+    return run_pipeline_batch([(call["query"], call["top_k"]) for call in calls])
+
+
+def get_batch_functions() -> Dict[str, Callable[[List[Dict[str, Any]]], List[Any]]]:
+    """
+    Returns the functions that handle several calls of the same tool at once, by tool name.
+
+    A batch function receives the arguments of each call and returns one result per call, in the same order.
+    """
+    return {"suche_interne_kenntnisse": _suche_interne_kenntnisse_batch}
+
 
 def get_tools():
     tools = []
     for name, obj in globals().items():
-        if callable(obj) and obj.__module__ == __name__ and name != "get_tools":
+        if callable(obj) and obj.__module__ == __name__ and not name.startswith(("_", "get_")):
             tools.append(Tool.from_function(obj))
     return tools
@@ -0,0 +1,241 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+from utils.metrics import (
+    ADMISSION_DECISIONS,
+    ADMISSION_QUEUE_WAIT,
+    CHAT_RUNS_ACTIVE,
+    CHAT_RUNS_QUEUED,
+    LLM_TOKEN_BUDGET_WAIT,
+)
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is not admitted, carries the HTTP status and the seconds after which to retry.
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(f"Request rejected ({reason}), retry after {retry_after} s")
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """
+    A slot of an admitted request, released once the request finished. Releasing twice has no effect.
+    """
+
+    def __init__(self, controller: "AdmissionController", client: str):
+        self._controller = controller
+        self._client = client
+        self._started_at = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self._client, time.perf_counter() - self._started_at)
+
+
+class AdmissionController:
+    """
+    Limits the agent runs of the chat endpoint, globally and per client.
+
+    Requests beyond `max_concurrency` wait in a FIFO queue of at most `max_queue` requests for up to
+    `queue_timeout` seconds. A client with `max_per_client` requests running or queued is rejected right away
+    with 429, a full queue or an expired wait with 503. `Retry-After` is estimated from the average run duration.
+    Limits of 0 disable the respective check. The limits apply per process.
+    """
+
+    def __init__(
+        self, max_concurrency: int = 32, max_per_client: int = 4, max_queue: int = 64, queue_timeout: float = 15.0
+    ):
+        """
+        :param max_concurrency: Agent runs at the same time.
+        :param max_per_client: Running and queued requests per client.
+        :param max_queue: Requests waiting for a free slot.
+        :param queue_timeout: Seconds a request waits for a free slot before it is rejected.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_per_client = max_per_client
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._by_client: Dict[str, int] = {}
+        self._waiters: Deque[asyncio.Future] = deque()
+        # moving average of the run duration for Retry-After, starts with a typical agent run
+        self._average_duration = 10.0
+
+    def _retry_after(self, ahead: int) -> int:
+        slots = self.max_concurrency or 1
+        return max(1, math.ceil(self._average_duration * (ahead // slots + 1)))
+
+    def _reject(self, status_code: int, reason: str, retry_after: int) -> AdmissionRejected:
+        ADMISSION_DECISIONS.labels(outcome=reason).inc()
+        return AdmissionRejected(status_code, reason, retry_after)
+
+    async def acquire(self, client: str) -> AdmissionTicket:
+        """
+        Waits for a free slot for a request of `client`.
+
+        :raises AdmissionRejected: If the client, the queue or the wait exceeds its limit.
+        """
+        if self.max_per_client and self._by_client.get(client, 0) >= self.max_per_client:
+            raise self._reject(429, "client_limit", self._retry_after(0))
+
+        self._by_client[client] = self._by_client.get(client, 0) + 1
+        try:
+            if not self.max_concurrency or (self._active < self.max_concurrency and not self._waiters):
+                self._active += 1
+                ADMISSION_DECISIONS.labels(outcome="admitted").inc()
+                return AdmissionTicket(self, client)
+
+            if self.max_queue and len(self._waiters) >= self.max_queue:
+                raise self._reject(503, "queue_full", self._retry_after(len(self._waiters)))
+
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            queued_at = time.perf_counter()
+            try:
+                # a releasing request hands its slot over by resolving the future
+                await asyncio.wait_for(future, self.queue_timeout)
+            except BaseException as error:
+                if future.done() and not future.cancelled():
+                    # the slot was handed over just as the wait ended
+                    self._release_slot()
+                if isinstance(error, asyncio.TimeoutError):
+                    raise self._reject(503, "queue_timeout", self._retry_after(len(self._waiters))) from None
+                raise
+            finally:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+                ADMISSION_QUEUE_WAIT.observe(time.perf_counter() - queued_at)
+            ADMISSION_DECISIONS.labels(outcome="queued").inc()
+            return AdmissionTicket(self, client)
+        except BaseException:
+            self._release_client(client)
+            raise
+
+    def _release_client(self, client: str):
+        self._by_client[client] -= 1
+        if not self._by_client[client]:
+            del self._by_client[client]
+
+    def _release(self, client: str, duration: float):
+        self._average_duration = 0.9 * self._average_duration + 0.1 * duration
+        self._release_client(client)
+        self._release_slot()
+
+    def _release_slot(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def active(self) -> int:
+        return self._active
+
+    def queued(self) -> int:
+        return len(self._waiters)
+
+
+class TokenBudget:
+    """
+    Spreads the OpenAI tokens of all agent runs over time to stay within a tokens-per-minute limit.
+
+    Each LLM call reserves its estimated tokens before it starts and settles the difference to the reported usage
+    afterwards. The budget refills continuously and may run into debt, calls then wait until it is paid off, in
+    the order they reserved.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        """
+        :param tokens_per_minute: Tokens per minute of the OpenAI organization, as in its rate limits.
+        """
+        self.tokens_per_minute = tokens_per_minute
+        self._rate = tokens_per_minute / 60
+        self._balance = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._balance = min(self.tokens_per_minute, self._balance + (now - self._updated_at) * self._rate)
+            self._updated_at = now
+            self._balance -= min(tokens, self.tokens_per_minute)
+            return max(0.0, -self._balance / self._rate)
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserves `tokens` and blocks until they are available.
+
+        :returns: The seconds waited.
+        """
+        wait = self._take(tokens)
+        if wait:
+            time.sleep(wait)
+        LLM_TOKEN_BUDGET_WAIT.observe(wait)
+        return wait
+
+    async def reserve_async(self, tokens: int) -> float:
+        """
+        Reserves `tokens` and waits until they are available.
+
+        :returns: The seconds waited.
+        """
+        wait = self._take(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        LLM_TOKEN_BUDGET_WAIT.observe(wait)
+        return wait
+
+    def settle(self, reserved: int, used: int):
+        """
+        Books the difference between the reserved and the used tokens of a finished call.
+        """
+        with self._lock:
+            self._balance += min(reserved, self.tokens_per_minute) - used
+
+
+_admission_controller: Optional[AdmissionController] = None
+_token_budget: Optional[TokenBudget] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Returns the admission controller of the chat endpoint, configured with `CHAT_MAX_CONCURRENCY` (default 32),
+    `CHAT_MAX_CONCURRENCY_PER_CLIENT` (default 4), `CHAT_MAX_QUEUE` (default 64) and `CHAT_QUEUE_TIMEOUT`
+    (seconds, default 15).
+    """
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(
+            max_concurrency=int(os.getenv("CHAT_MAX_CONCURRENCY", "32")),
+            max_per_client=int(os.getenv("CHAT_MAX_CONCURRENCY_PER_CLIENT", "4")),
+            max_queue=int(os.getenv("CHAT_MAX_QUEUE", "64")),
+            queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT", "15")),
+        )
+        CHAT_RUNS_ACTIVE.set_function(_admission_controller.active)
+        CHAT_RUNS_QUEUED.set_function(_admission_controller.queued)
+    return _admission_controller
+
+
+def get_token_budget() -> Optional[TokenBudget]:
+    """
+    Returns the OpenAI token budget shared by all agent runs of this process, `None` unless `OPENAI_TPM_LIMIT` is
+    set. With several worker processes, set it to the limit divided by the number of workers.
+    """
+    global _token_budget
+    if _token_budget is None and int(os.getenv("OPENAI_TPM_LIMIT", "0")):
+        _token_budget = TokenBudget(int(os.getenv("OPENAI_TPM_LIMIT")))
+    return _token_budget
@@ -1,14 +1,40 @@
+import os
 import time
 import json
-from fastapi import FastAPI
+import weakref
+from typing import Optional
+from fastapi import FastAPI, Request, Response
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from fastapi.encoders import jsonable_encoder
+from haystack import logging, tracing
 
-from retrieval import index_files
-from agent import query_pipeline, run_pipeline  # This is the async generator from your agent code
+from retrieval import index_files, reindex_opensearch_index, warm_up_ranker
+from agent import get_output_mode, query_pipeline, run_pipeline  # This is the async generator from your agent code
+from utils.admission import AdmissionRejected, get_admission_controller
+from utils.profiling import get_profiler, new_profile_id
+from utils.progress import ProgressEvent
+from utils.single_flight import SingleFlight, conversation_key
+from utils.tracing import setup_tracing, instrument_app
+from utils.metrics import (
+    CHAT_COALESCED_REQUESTS,
+    CHAT_REQUESTS,
+    CHAT_REQUEST_DURATION,
+    CHAT_STREAMS_IN_FLIGHT,
+    CHAT_TIME_TO_FIRST_CHUNK,
+)
+
+logger = logging.getLogger(__name__)
+
+setup_tracing()
+warm_up_ranker()
 
 app = FastAPI()
+instrument_app(app)
+
+# identical conversations in flight share one agent run, disable with CHAT_COALESCING=false
+_single_flight = SingleFlight()
 
 
 class OpenAIQuery(BaseModel):
@@ -16,13 +42,115 @@ class OpenAIQuery(BaseModel):
     messages: list
     stream: bool
     temperature: float = None
+    user: Optional[str] = None
+    # full, summarized or none, also set with the X-Output-Mode header, see agent.get_output_mode
+    output_mode: Optional[str] = None
+
+
+class ProfilingSettings(BaseModel):
+    sample_rate: float = 0.0
+    max_profiles: Optional[int] = None
+
+
+def is_coalescing_enabled() -> bool:
+    return os.getenv("CHAT_COALESCING", "true").lower() == "true"
+
+
+def get_client_id(request: Request, query: OpenAIQuery) -> str:
+    """
+    Identifies the client for the per-client limits: the `CHAT_CLIENT_HEADER` header (default the user id that
+    Open WebUI forwards), the OpenAI `user` field or the client address.
+    """
+    header = os.getenv("CHAT_CLIENT_HEADER", "X-OpenWebUI-User-Id")
+    return request.headers.get(header) or query.user or (request.client.host if request.client else "unknown")
+
+
+def _rejected(stream: bool, rejection: AdmissionRejected) -> JSONResponse:
+    CHAT_REQUESTS.labels(stream=str(stream).lower(), outcome="rejected").inc()
+    error_type = "rate_limit_exceeded" if rejection.status_code == 429 else "server_overloaded"
+    return JSONResponse(
+        status_code=rejection.status_code,
+        headers={"Retry-After": str(rejection.retry_after)},
+        content={"error": {"message": str(rejection), "type": error_type, "code": rejection.reason}},
+    )
+
+
+def _joined(stream: str, span=None):
+    def on_join():
+        CHAT_COALESCED_REQUESTS.labels(stream=stream).inc()
+        if span is not None:
+            span.set_tag("chat.coalesced", True)
+    return on_join
 
 
 @app.post("/v1/chat/completions")
-async def chat_completions_stream(query: OpenAIQuery):
+async def chat_completions_stream(query: OpenAIQuery, request: Request):
+    started_at = time.perf_counter()
+    try:
+        output_mode = get_output_mode(query.output_mode or request.headers.get("X-Output-Mode"))
+    except ValueError as error:
+        return JSONResponse(
+            status_code=400,
+            content={"error": {"message": str(error), "type": "invalid_request_error", "code": "output_mode"}},
+        )
+    key = (
+        conversation_key(query.messages, stream=query.stream, output_mode=output_mode)
+        if is_coalescing_enabled()
+        else None
+    )
+
+    # profiled on demand with the X-Profile-Token header or sampled, see utils/profiling.py
+    profiler = get_profiler()
+    profile_id = new_profile_id() if profiler.should_profile(request.headers.get("X-Profile-Token")) else None
+
+    # requests joining a run in flight add no load and are always admitted
+    ticket = None
+    if key is None or not _single_flight.running(key):
+        try:
+            ticket = await get_admission_controller().acquire(get_client_id(request, query))
+        except AdmissionRejected as rejection:
+            return _rejected(query.stream, rejection)
+
+    # the ticket belongs to the agent run once it started: a shared run outlives a caller that disconnected,
+    # and a cancelled stream keeps its slot until the run actually stopped
+    release = ticket.release if ticket is not None else None
+    run_started = False
+
+    async def run_reply():
+        nonlocal run_started
+        run_started = True
+        try:
+            return await run_pipeline(query.messages, output_mode=output_mode)
+        finally:
+            if release is not None:
+                release()
+
+    def start_stream():
+        nonlocal run_started
+        run_started = True
+        return query_pipeline(query.messages, output_mode, started_at, on_finished=release)
+
+    def release_unless_started():
+        if release is not None and not run_started:
+            release()
 
     if not query.stream:
-        reply = await run_pipeline(query.messages)
+        profile = profiler.start("chat", profile_id) if profile_id else None
+        try:
+            if key is not None:
+                reply = await _single_flight.call(key, run_reply, _joined("false"))
+            else:
+                reply = await run_reply()
+        except Exception:
+            CHAT_REQUESTS.labels(stream="false", outcome="error").inc()
+            raise
+        finally:
+            # a request that joined a run started in the meantime never ran its own
+            release_unless_started()
+            if profile is not None:
+                await profile.finish()
+        CHAT_REQUESTS.labels(stream="false", outcome="ok").inc()
+        CHAT_REQUEST_DURATION.labels(stream="false").observe(time.perf_counter() - started_at)
 
         response = {
             "id": "chatcmpl-AXXyzrd626obzrJ02HBl9LXS3AJnp",
@@ -41,32 +169,71 @@ async def chat_completions_stream(query: OpenAIQuery):
             ],
         }
 
+        if profile_id:
+            return JSONResponse(jsonable_encoder(response), headers={"X-Profile-Id": profile_id})
         return response
 
     async def stream_generator():
         i = 0
-
-        async for content in query_pipeline(query.messages):
-            chunk = {
-                "id": f"a{i}",
-                "object": "chat.completion.chunk",
-                "created": time.time(),
-                "model": "haystack-agent",
-                "choices": [
-                    {
-                        "delta": {
-                            "content": content
-                        }
+        outcome = "error"
+        CHAT_STREAMS_IN_FLIGHT.inc()
+        profile = profiler.start("chat stream", profile_id) if profile_id else None
+        try:
+            with tracing.tracer.trace("chat.stream") as span:
+                if key is not None:
+                    contents = _single_flight.stream(key, start_stream, _joined("true", span))
+                else:
+                    contents = start_stream()
+                async for content in contents:
+                    progress = content if isinstance(content, ProgressEvent) else None
+                    chunk = {
+                        "id": f"a{i}",
+                        "object": "chat.completion.chunk",
+                        "created": time.time(),
+                        "model": "haystack-agent",
+                        "choices": [
+                            {
+                                "delta": {
+                                    "content": progress.text if progress else content
+                                }
+                            }
+                        ],
                     }
-                ],
-            }
-            yield f"data: {json.dumps(jsonable_encoder(chunk))}\n\n"
-            i += 1
+                    if progress:
+                        # clients that know the field can show the progress of the tool calls separately
+                        chunk["agent_progress"] = progress.to_dict()
+                    yield f"data: {json.dumps(jsonable_encoder(chunk))}\n\n"
+                    if i == 0:
+                        CHAT_TIME_TO_FIRST_CHUNK.observe(time.perf_counter() - started_at)
+                    i += 1
+
+                span.set_tag("chat.stream.chunks", i)
 
-        # When done, send the [DONE] message
-        yield "data: [DONE]\n\n"
+            # When done, send the [DONE] message
+            yield "data: [DONE]\n\n"
+            outcome = "ok"
+        except Exception as error:  # noqa: BLE001 - the headers are sent, the client only learns of it in the stream
+            logger.exception("Chat stream failed")
+            error_chunk = {"error": {"message": str(error), "type": "server_error", "code": type(error).__name__}}
+            yield f"data: {json.dumps(error_chunk)}\n\n"
+        finally:
+            release_unless_started()
+            CHAT_STREAMS_IN_FLIGHT.dec()
+            CHAT_REQUESTS.labels(stream="true", outcome=outcome).inc()
+            if outcome == "ok":
+                # like non-streaming requests, only completed streams are timed
+                CHAT_REQUEST_DURATION.labels(stream="true").observe(time.perf_counter() - started_at)
+            if profile is not None:
+                # stops sampling even if the stream was cancelled and the profile cannot be written anymore
+                profile.stop()
+                await profile.finish()
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+    stream = stream_generator()
+    if ticket is not None:
+        # a client that disconnects before the stream started never runs the generator's finally block
+        weakref.finalize(stream, release_unless_started)
+    headers = {"X-Profile-Id": profile_id} if profile_id else None
+    return StreamingResponse(stream, media_type="text/event-stream", headers=headers)
 
 
 @app.get("/v1/models")
@@ -84,7 +251,51 @@ def get_models():
     }
 
 
+def _forbidden() -> JSONResponse:
+    return JSONResponse(
+        status_code=403,
+        content={"error": {"message": "Profiling is disabled or the X-Profile-Token is wrong.", "type": "forbidden"}},
+    )
+
+
+@app.get("/admin/profiling")
+def get_profiling(request: Request):
+    profiler = get_profiler()
+    if not profiler.is_authorized(request.headers.get("X-Profile-Token")):
+        return _forbidden()
+    return {
+        "sample_rate": profiler.sample_rate,
+        "remaining": profiler.remaining,
+        "active": profiler.active(),
+        "directory": str(profiler.directory),
+        "profiles": profiler.recent(),
+    }
+
+
+@app.post("/admin/profiling")
+def configure_profiling(settings: ProfilingSettings, request: Request):
+    """
+    Profiles a sampled fraction of the chat requests, e.g. `{"sample_rate": 0.05, "max_profiles": 20}`.
+    """
+    profiler = get_profiler()
+    if not profiler.is_authorized(request.headers.get("X-Profile-Token")):
+        return _forbidden()
+    profiler.configure(settings.sample_rate, settings.max_profiles)
+    return get_profiling(request)
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post("/index")
 def run_indexing():
-    index_files()
-    return {"message": "Indexing completed"}
+    report = index_files()
+    return {"message": "Indexing completed", **report}
+
+
+@app.post("/index/reindex")
+def run_reindexing():
+    report = reindex_opensearch_index()
+    return {"message": "Reindexing completed", **report}
@@ -0,0 +1,161 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Buckets in seconds, chat requests run for several LLM round trips
+_REQUEST_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120)
+_FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CHAT_REQUESTS = Counter(
+    "agent_chat_requests_total",
+    "Chat completion requests by streaming mode and outcome.",
+    ["stream", "outcome"],
+)
+CHAT_REQUEST_DURATION = Histogram(
+    "agent_chat_request_duration_seconds",
+    "Total duration of a chat completion request until the last chunk was sent.",
+    ["stream"],
+    buckets=_REQUEST_BUCKETS,
+)
+CHAT_TIME_TO_FIRST_CHUNK = Histogram(
+    "agent_chat_time_to_first_chunk_seconds",
+    "Time from receiving a streaming request until its first chunk was sent.",
+    buckets=_REQUEST_BUCKETS,
+)
+CHAT_TIME_TO_FIRST_ANSWER_TOKEN = Histogram(
+    "agent_chat_time_to_first_answer_token_seconds",
+    "Time from receiving a streaming request until the model streamed the first text of its answer, compare with "
+    "agent_chat_time_to_first_chunk_seconds which includes progress events and tool results.",
+    buckets=_REQUEST_BUCKETS,
+)
+CHAT_STREAMS_IN_FLIGHT = Gauge(
+    "agent_chat_streams_in_flight",
+    "Streaming responses currently being sent.",
+)
+CHAT_COALESCED_REQUESTS = Counter(
+    "agent_chat_coalesced_requests_total",
+    "Chat completion requests that joined an identical request in flight instead of running the agent.",
+    ["stream"],
+)
+CHAT_RUNS_ACTIVE = Gauge(
+    "agent_chat_runs_active",
+    "Admitted chat requests that hold an agent run slot.",
+)
+CHAT_RUNS_QUEUED = Gauge(
+    "agent_chat_runs_queued",
+    "Chat requests waiting for a free agent run slot.",
+)
+ADMISSION_DECISIONS = Counter(
+    "agent_admission_decisions_total",
+    "Admission decisions for chat requests: admitted, queued (admitted after waiting), client_limit, queue_full "
+    "or queue_timeout.",
+    ["outcome"],
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "agent_admission_queue_wait_seconds",
+    "Time chat requests waited in the admission queue, admitted or not.",
+    buckets=_REQUEST_BUCKETS,
+)
+STREAM_QUEUE_DEPTH = Gauge(
+    "agent_stream_queue_depth",
+    "Chunks produced by the pipeline but not yet written to the clients, over all open streams.",
+)
+
+AGENT_TOOL_ROUNDS = Histogram(
+    "agent_tool_rounds",
+    "LLM calls that requested tool calls, per agent run.",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15),
+)
+LLM_CALL_DURATION = Histogram(
+    "agent_llm_call_duration_seconds",
+    "Duration of a single LLM call, by model and agent turn type.",
+    ["model", "turn"],
+    buckets=_REQUEST_BUCKETS,
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "agent_llm_time_to_first_token_seconds",
+    "Time until the first generated token of a streamed LLM call, by model and agent turn type.",
+    ["model", "turn"],
+    buckets=_REQUEST_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "agent_llm_tokens_total",
+    "Tokens used by the LLM calls, by model and agent turn type.",
+    ["model", "kind", "turn"],
+)
+LLM_TOKEN_BUDGET_WAIT = Histogram(
+    "agent_llm_token_budget_wait_seconds",
+    "Time LLM calls waited for the shared OpenAI tokens-per-minute budget.",
+    buckets=(0, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+TOOL_CALL_DURATION = Histogram(
+    "agent_tool_call_duration_seconds",
+    "Duration of a single tool invocation.",
+    ["tool", "outcome"],
+    buckets=_FAST_BUCKETS,
+)
+TOOL_BATCH_DURATION = Histogram(
+    "agent_tool_batch_duration_seconds",
+    "Duration of a batched invocation of several calls of one tool.",
+    ["tool"],
+    buckets=_FAST_BUCKETS,
+)
+TOOL_BATCH_SIZE = Histogram(
+    "agent_tool_batch_size",
+    "Tool calls handled by one batched invocation.",
+    ["tool"],
+    buckets=(2, 3, 4, 6, 8, 12, 16),
+)
+
+RETRIEVAL_QUERY_DURATION = Histogram(
+    "agent_retrieval_query_duration_seconds",
+    "Duration of a search round trip to the document store.",
+    ["backend"],
+    buckets=_FAST_BUCKETS,
+)
+RETRIEVAL_BATCH_SIZE = Histogram(
+    "agent_retrieval_batch_size",
+    "Sub-queries sent to the document store in one batched search.",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+RERANK_DURATION = Histogram(
+    "agent_rerank_duration_seconds",
+    "Duration of reranking the candidates of one search, including the wait for a free rerank worker.",
+    buckets=_FAST_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "agent_cache_requests_total",
+    "Cache lookups by cache and result (hit or miss).",
+    ["cache", "result"],
+)
+
+INDEXED_FILES = Counter(
+    "agent_indexed_files_total",
+    "Files passed to the indexing pipeline.",
+)
+INDEXED_DOCUMENTS = Counter(
+    "agent_indexed_documents_total",
+    "Chunks written to the document store by the indexing pipeline.",
+)
+CONVERTED_FILES = Counter(
+    "agent_converted_files_total",
+    "Files seen by the indexing pipeline by MIME type and outcome (converted or skipped).",
+    ["mime_type", "outcome"],
+)
+CONVERSION_DURATION = Histogram(
+    "agent_conversion_duration_seconds",
+    "Duration of converting a single file, by MIME type.",
+    ["mime_type"],
+    buckets=_FAST_BUCKETS,
+)
+INDEXED_DUPLICATES = Counter(
+    "agent_indexed_duplicates_total",
+    "Chunks dropped by the indexing pipeline as near-duplicates of other chunks.",
+)
+INDEXING_DURATION = Histogram(
+    "agent_indexing_duration_seconds",
+    "Duration of an indexing run.",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600),
+)
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
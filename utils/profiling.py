@@ -0,0 +1,314 @@
+import asyncio
+import hmac
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from haystack import logging
+
+logger = logging.getLogger(__name__)
+
+# (function, file, first line) of a frame, stacks are ordered from the outermost frame to the innermost
+_Frame = Tuple[str, str, int]
+
+
+def _stack(frame) -> Tuple[_Frame, ...]:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def new_profile_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+class RequestProfile:
+    """
+    Samples of all threads and the event loop lag while one request runs, see `Profiler.start`.
+    """
+
+    def __init__(self, profiler: "Profiler", profile_id: str, name: str):
+        self.profiler = profiler
+        self.profile_id = profile_id
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        # per thread: (time of the sample, stack)
+        self.samples: Dict[int, List[Tuple[float, Tuple[_Frame, ...]]]] = {}
+        self.thread_names: Dict[int, str] = {}
+        self.lags: List[float] = []
+        self._lag_task: Optional[asyncio.Task] = None
+        self._written = False
+
+    async def _monitor_lag(self, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled_at = loop.time()
+            await asyncio.sleep(interval)
+            self.lags.append(max(0.0, loop.time() - scheduled_at - interval))
+
+    def lag_summary(self) -> Dict[str, Any]:
+        lags = sorted(self.lags)
+        if not lags:
+            return {"samples": 0}
+        return {
+            "samples": len(lags),
+            "mean_ms": round(sum(lags) / len(lags) * 1000, 3),
+            "p99_ms": round(lags[min(len(lags) - 1, math.ceil(0.99 * len(lags)) - 1)] * 1000, 3),
+            "max_ms": round(lags[-1] * 1000, 3),
+        }
+
+    def to_speedscope(self) -> Dict[str, Any]:
+        """
+        Returns the samples in the speedscope file format, one sampled profile per thread.
+        """
+        frames: List[Dict[str, Any]] = []
+        frame_index: Dict[_Frame, int] = {}
+        profiles = []
+        end = ((self.finished_at or time.perf_counter()) - self.started_at) * 1000
+        for thread_id, samples in self.samples.items():
+            stacks, weights = [], []
+            previous = 0.0
+            for at, stack in samples:
+                at_ms = (at - self.started_at) * 1000
+                indices = []
+                for frame in stack:
+                    if frame not in frame_index:
+                        frame_index[frame] = len(frames)
+                        frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                    indices.append(frame_index[frame])
+                stacks.append(indices)
+                weights.append(round(at_ms - previous, 3))
+                previous = at_ms
+            profiles.append({
+                "type": "sampled",
+                "name": self.thread_names.get(thread_id, str(thread_id)),
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(end, 3),
+                "samples": stacks,
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "haystack-rag-agent",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def to_folded(self) -> str:
+        """
+        Returns the samples as collapsed stacks for flame graph tools, weighted by sample count.
+        """
+        counts: Dict[str, int] = {}
+        for thread_id, samples in self.samples.items():
+            thread = self.thread_names.get(thread_id, str(thread_id)).replace(";", ":")
+            for _, stack in samples:
+                line = ";".join([thread] + [f"{name} ({Path(file).name}:{line})" for name, file, line in stack])
+                counts[line] = counts.get(line, 0) + 1
+        return "".join(f"{line} {count}\n" for line, count in sorted(counts.items()))
+
+    def _write(self) -> Path:
+        directory = self.profiler.directory
+        directory.mkdir(parents=True, exist_ok=True)
+        prefix = directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{self.profile_id}"
+        with open(f"{prefix}.speedscope.json", "w", encoding="utf-8") as f:
+            json.dump(self.to_speedscope(), f, separators=(",", ":"))
+        with open(f"{prefix}.folded", "w", encoding="utf-8") as f:
+            f.write(self.to_folded())
+        summary = {
+            "id": self.profile_id,
+            "name": self.name,
+            "duration_ms": round(((self.finished_at or time.perf_counter()) - self.started_at) * 1000, 3),
+            "interval_ms": self.profiler.interval * 1000,
+            "samples": sum(len(samples) for samples in self.samples.values()),
+            "event_loop_lag": self.lag_summary(),
+            "event_loop_lag_ms": [round(lag * 1000, 3) for lag in self.lags],
+        }
+        with open(f"{prefix}.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return Path(f"{prefix}.speedscope.json")
+
+    def stop(self):
+        """
+        Stops sampling, stopping twice has no effect.
+        """
+        if self.finished_at is not None:
+            return
+        self.finished_at = time.perf_counter()
+        self.profiler._remove(self)
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+
+    async def finish(self) -> Optional[Path]:
+        """
+        Stops sampling and writes the profile, returns the path of the speedscope file or `None` if it was already
+        written or could not be written.
+        """
+        self.stop()
+        if self._written:
+            return None
+        self._written = True
+        try:
+            path = await asyncio.to_thread(self._write)
+        except OSError as error:
+            logger.warning("Could not write profile {id}: {error}", id=self.profile_id, error=error)
+            return None
+        logger.info(
+            "Profile {id} of {name} written to {path}, event loop lag {lag}",
+            id=self.profile_id,
+            name=self.name,
+            path=path,
+            lag=self.lag_summary(),
+        )
+        return path
+
+
+class Profiler:
+    """
+    Sampling profiler for single requests.
+
+    While at least one request is profiled, a background thread records the stacks of all threads every `interval`
+    seconds and a task on the event loop measures how late it is woken up, the event loop lag. The samples of a
+    request cover all threads, i.e. the event loop, the tool and search threads and any concurrent requests. Without
+    a profiled request the thread is stopped and nothing is sampled.
+    """
+
+    def __init__(
+        self,
+        directory: str = "profiles",
+        interval: float = 0.005,
+        token: Optional[str] = None,
+        sample_rate: float = 0.0,
+        max_active: int = 4,
+    ):
+        """
+        :param directory: Directory the profiles are written to.
+        :param interval: Seconds between two samples.
+        :param token: Secret that enables profiling of a request or changes the settings, profiling by header and
+            the admin endpoint are disabled without it.
+        :param sample_rate: Fraction of the chat requests that are profiled without a header.
+        :param max_active: Requests profiled at the same time, further requests are not profiled.
+        """
+        self.directory = Path(directory)
+        self.interval = interval
+        self.token = token
+        self.sample_rate = sample_rate
+        self.max_active = max_active
+        # profiles taken by sampling before the sample rate is reset to 0, `None` for no limit
+        self.remaining: Optional[int] = None
+        self._active: List[RequestProfile] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def is_authorized(self, token: Optional[str]) -> bool:
+        return bool(self.token) and token is not None and hmac.compare_digest(token, self.token)
+
+    def configure(self, sample_rate: float, max_profiles: Optional[int] = None):
+        """
+        Profiles the fraction `sample_rate` of the requests, for at most `max_profiles` requests.
+        """
+        with self._lock:
+            self.sample_rate = min(1.0, max(0.0, sample_rate))
+            self.remaining = max_profiles
+
+    def should_profile(self, token: Optional[str] = None) -> bool:
+        """
+        Returns whether to profile a request, because it carries the token or was sampled.
+        """
+        if self.is_authorized(token):
+            with self._lock:
+                return len(self._active) < self.max_active
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            if len(self._active) >= self.max_active or self.remaining == 0:
+                return False
+            if self.remaining is not None:
+                self.remaining -= 1
+                if not self.remaining:
+                    self.sample_rate = 0.0
+            return True
+
+    def start(self, name: str, profile_id: Optional[str] = None) -> RequestProfile:
+        """
+        Starts profiling a request, must be called on the event loop. Call `RequestProfile.finish` when it ended.
+
+        :param name: Name of the profile, e.g. the endpoint.
+        :param profile_id: Id of the profile files, see `new_profile_id`.
+        """
+        profile = RequestProfile(self, profile_id or new_profile_id(), name)
+        profile._lag_task = asyncio.get_running_loop().create_task(profile._monitor_lag(self.interval * 2))
+        with self._lock:
+            self._active.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def _remove(self, profile: RequestProfile):
+        with self._lock:
+            if profile in self._active:
+                self._active.remove(profile)
+
+    def active(self) -> int:
+        return len(self._active)
+
+    def recent(self, limit: int = 20) -> List[str]:
+        """
+        Returns the summary files of the latest profiles, newest first.
+        """
+        if not self.directory.is_dir():
+            return []
+        summaries = [path.name for path in self.directory.glob("*.json") if not path.name.endswith(".speedscope.json")]
+        return sorted(summaries, reverse=True)[:limit]
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while True:
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = {
+                thread_id: _stack(frame) for thread_id, frame in sys._current_frames().items() if thread_id != own_id
+            }
+            # under the lock, so a stopped profile gets no further samples while it is written
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                for profile in self._active:
+                    for thread_id, stack in stacks.items():
+                        profile.samples.setdefault(thread_id, []).append((now, stack))
+                        profile.thread_names.setdefault(thread_id, names.get(thread_id, str(thread_id)))
+            time.sleep(self.interval)
+
+
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Profiler:
+    """
+    Returns the request profiler, configured with `PROFILE_TOKEN` (required to profile on demand),
+    `PROFILE_SAMPLE_RATE` (default 0), `PROFILE_DIR` (default `profiles`), `PROFILE_INTERVAL_MS` (default 5) and
+    `PROFILE_MAX_ACTIVE` (default 4).
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(
+            directory=os.getenv("PROFILE_DIR", "profiles"),
+            interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+            token=os.getenv("PROFILE_TOKEN") or None,
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            max_active=int(os.getenv("PROFILE_MAX_ACTIVE", "4")),
+        )
+    return _profiler
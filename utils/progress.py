@@ -0,0 +1,86 @@
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+_reporter: contextvars.ContextVar[Optional[Callable[["ProgressEvent"], None]]] = contextvars.ContextVar(
+    "progress_reporter", default=None
+)
+
+
+class ProgressEvent:
+    """
+    Progress of an agent run for the client: a tool call was `started` or `finished`.
+
+    `text` is the line shown to the user, set by whoever streams the event.
+    """
+
+    def __init__(
+        self,
+        event: str,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        result: Optional[Any] = None,
+        error: bool = False,
+        elapsed_ms: Optional[float] = None,
+    ):
+        self.event = event
+        self.tool_name = tool_name
+        self.arguments = arguments
+        self.result = result
+        self.error = error
+        self.elapsed_ms = elapsed_ms
+        self.text = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the event without the tool result, for the stream.
+        """
+        data = {"event": self.event, "tool": self.tool_name, "arguments": self.arguments}
+        if self.event == "finished":
+            data.update(error=self.error, elapsed_ms=round(self.elapsed_ms or 0.0, 1))
+        return data
+
+
+@contextmanager
+def report_progress(callback: Callable[[ProgressEvent], None]):
+    """
+    Passes the progress events of the tool calls within the block to `callback`, which is called on the event loop
+    of the caller, also for tools running in worker threads. Must be entered on the event loop.
+    """
+    loop = asyncio.get_running_loop()
+
+    def report(event: ProgressEvent):
+        loop.call_soon_threadsafe(callback, event)
+
+    token = _reporter.set(report)
+    try:
+        yield
+    finally:
+        _reporter.reset(token)
+
+
+def emit(event: ProgressEvent):
+    """
+    Reports `event` to the callback of the current `report_progress` block, if any.
+    """
+    report = _reporter.get()
+    if report is not None:
+        report(event)
+
+
+class ToolProgress:
+    """
+    Reports the start of a tool call on creation and its end with `finished`, if progress is reported at all.
+    """
+
+    def __init__(self, tool_name: str, arguments: Dict[str, Any]):
+        self.tool_name = tool_name
+        self.arguments = arguments
+        self.started_at = time.perf_counter()
+        emit(ProgressEvent("started", tool_name, arguments))
+
+    def finished(self, result: Any, error: bool = False):
+        elapsed_ms = (time.perf_counter() - self.started_at) * 1000
+        emit(ProgressEvent("finished", self.tool_name, self.arguments, result, error, elapsed_ms))
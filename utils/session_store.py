@@ -0,0 +1,174 @@
+import gzip
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+from haystack import logging
+from haystack_experimental.dataclasses import ChatMessage
+from utils.metrics import record_cache_lookup
+from utils.single_flight import conversation_key
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """
+    The agent's view of a conversation after an answer: all messages including the tool calls and results, without
+    the system message, and the ids of the documents its searches retrieved.
+    """
+
+    def __init__(self, messages: List[ChatMessage], document_ids: Optional[List[str]] = None):
+        self.messages = messages
+        self.document_ids = document_ids or []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"messages": [message.to_dict() for message in self.messages], "document_ids": self.document_ids}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Session":
+        return cls([ChatMessage.from_dict(message) for message in data["messages"]], data.get("document_ids"))
+
+
+def session_key(messages: List[Dict[str, Any]]) -> str:
+    """
+    Returns the key of the session that ends with the last of the OpenAI chat `messages`, see `conversation_key`.
+    """
+    return conversation_key(messages)
+
+
+class SessionStore:
+    """
+    Keeps the sessions of recent conversations, so a follow-up question only converts the new messages and the
+    model sees the earlier tool results again.
+
+    Clients like Open WebUI resend the whole conversation with every request. A session is stored under the key of
+    the conversation as the client will resend it, i.e. including the answer as it was sent, and found again by
+    the longest stored prefix of the next request. The most recently used `max_entries` sessions are kept in memory,
+    with a `directory` all sessions are also written to disk as gzipped JSON, so they survive restarts and memory
+    evictions. Sessions on disk that were not used for `disk_ttl` seconds are deleted.
+    """
+
+    def __init__(
+        self, max_entries: int = 1000, directory: Optional[Union[str, Path]] = None, disk_ttl: float = 7 * 86400
+    ):
+        """
+        :param max_entries: Sessions kept in memory.
+        :param directory: Directory of the disk tier, created on first write. `None` keeps sessions in memory only.
+        :param disk_ttl: Seconds after their last use that sessions are deleted from disk.
+        """
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory else None
+        self.disk_ttl = disk_ttl
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._swept_at = 0.0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json.gz"
+
+    def _read(self, key: str) -> Optional[Session]:
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                session = Session.from_dict(json.load(f))
+            # keeps sessions in use from expiring
+            os.utime(path)
+            return session
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logger.warning("Ignoring unreadable session {path}: {error}", path=path, error=error)
+            return None
+
+    def _write(self, key: str, session: Session):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(session.to_dict(), f, ensure_ascii=False, separators=(",", ":"), default=str)
+        os.replace(tmp_path, path)
+
+    def _sweep(self):
+        now = time.time()
+        if now - self._swept_at < min(3600.0, self.disk_ttl):
+            return
+        self._swept_at = now
+        for path in self.directory.glob("*/*.json.gz"):
+            try:
+                if now - path.stat().st_mtime > self.disk_ttl:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[Session]:
+        """
+        Returns the session stored under `key`, from memory or disk, or `None`.
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+        if session is None and self.directory is not None:
+            session = self._read(key)
+            if session is not None:
+                self._remember(key, session)
+        if session is None:
+            return None
+        # the agent appends to the messages of a run
+        return Session(list(session.messages), list(session.document_ids))
+
+    def put(self, key: str, session: Session):
+        """
+        Stores `session` under `key`, see `session_key`.
+        """
+        self._remember(key, session)
+        if self.directory is not None:
+            try:
+                self._write(key, session)
+                self._sweep()
+            except OSError as error:
+                logger.warning("Could not write session {key}: {error}", key=key, error=error)
+
+    def _remember(self, key: str, session: Session):
+        with self._lock:
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def find(self, messages: List[Dict[str, Any]]) -> Tuple[Optional[Session], int]:
+        """
+        Returns the session of the longest prefix of the OpenAI chat `messages` that ends with an answer, and the
+        number of messages it covers. Without a stored prefix, returns `None` and 0.
+        """
+        for end in range(len(messages), 0, -1):
+            if messages[end - 1].get("role") != "assistant":
+                continue
+            session = self.get(session_key(messages[:end]))
+            if session is not None:
+                record_cache_lookup("sessions", True)
+                return session, end
+        record_cache_lookup("sessions", False)
+        return None, 0
+
+
+_session_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> Optional[SessionStore]:
+    """
+    Returns the session store of the chat endpoint, `None` unless `CHAT_SESSIONS=true`. Configured with
+    `CHAT_SESSION_MAX_ENTRIES` (default 1000), `CHAT_SESSION_DIR` (disk tier, disabled by default) and
+    `CHAT_SESSION_DISK_TTL` (seconds, default 7 days).
+    """
+    global _session_store
+    if _session_store is None and os.getenv("CHAT_SESSIONS", "false").lower() == "true":
+        _session_store = SessionStore(
+            max_entries=int(os.getenv("CHAT_SESSION_MAX_ENTRIES", "1000")),
+            directory=os.getenv("CHAT_SESSION_DIR") or None,
+            disk_ttl=float(os.getenv("CHAT_SESSION_DISK_TTL", str(7 * 86400))),
+        )
+    return _session_store
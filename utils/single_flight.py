@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import json
+import re
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def conversation_key(messages: List[Dict[str, Any]], **options: Any) -> str:
+    """
+    Returns a key that is equal for conversations that only differ in whitespace or letter case.
+
+    :param messages: OpenAI chat messages with `role` and `content`.
+    :param options: Further request options that change the response, e.g. whether it is streamed.
+    """
+    normalized = [
+        [message.get("role"), _WHITESPACE.sub(" ", str(message.get("content") or "")).strip().lower()]
+        for message in messages
+    ]
+    return hashlib.sha256(json.dumps([normalized, options], sort_keys=True).encode()).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """
+    Runs identical concurrent requests only once and shares the result with every caller.
+
+    The first request for a key starts the work in a background task, all requests for the same key that arrive
+    before it finished attach to it. Streams are recorded, so late joiners first get the chunks sent so far and
+    then follow the live stream. The work is cancelled once no caller is left. Finished flights are forgotten,
+    later requests start new work.
+    """
+
+    def __init__(self):
+        self._streams: Dict[str, _Flight] = {}
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    def running(self, key: str) -> bool:
+        """
+        Returns whether a stream or call for `key` is running, i.e. a request for it would join.
+        """
+        return key in self._streams or key in self._calls
+
+    def in_flight(self) -> int:
+        """
+        Returns the number of running flights.
+        """
+        return len(self._streams) + len(self._calls)
+
+    async def stream(
+        self, key: str, factory: Callable[[], AsyncIterator[Any]], on_join: Optional[Callable[[], None]] = None
+    ) -> AsyncIterator[Any]:
+        """
+        Yields all chunks of the stream for `key`, started with `factory` unless it is already running.
+
+        :param key: Key of the request, see `conversation_key`.
+        :param factory: Returns the async iterator of the chunks.
+        :param on_join: Called if the request joins a running stream.
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = self._streams[key] = _Flight()
+            flight.task = asyncio.create_task(self._produce(key, flight, factory))
+        elif on_join is not None:
+            on_join()
+
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                while position < len(flight.chunks):
+                    position += 1
+                    yield flight.chunks[position - 1]
+                if flight.done:
+                    break
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: position < len(flight.chunks) or flight.done)
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if not flight.subscribers and not flight.done:
+                # every client disconnected, nobody needs the result anymore
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+                flight.task.cancel()
+
+    async def _produce(self, key: str, flight: _Flight, factory: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for chunk in factory():
+                flight.chunks.append(chunk)
+                async with flight.changed:
+                    flight.changed.notify_all()
+        except asyncio.CancelledError:
+            flight.error = ConnectionAbortedError("The shared request was cancelled.")
+        except Exception as error:  # noqa: BLE001 - re-raised in every subscriber
+            flight.error = error
+        finally:
+            flight.done = True
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    async def call(
+        self, key: str, factory: Callable[[], Awaitable[Any]], on_join: Optional[Callable[[], None]] = None
+    ) -> Any:
+        """
+        Returns the result of the call for `key`, started with `factory` unless it is already running.
+
+        :param key: Key of the request, see `conversation_key`.
+        :param factory: Returns the awaitable of the result.
+        :param on_join: Called if the request joins a running call.
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+        elif on_join is not None:
+            on_join()
+        # a caller that disconnects must not cancel the call of the others
+        return await asyncio.shield(future)
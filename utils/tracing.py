@@ -0,0 +1,70 @@
+import atexit
+import os
+from typing import Optional, TextIO
+from haystack import logging, tracing
+
+logger = logging.getLogger(__name__)
+
+
+def setup_tracing(service_name: str = "haystack-rag-agent"):
+    """
+    Configures OpenTelemetry and routes Haystack's tracer to it.
+
+    The exporter is selected with `TRACING_EXPORTER`:
+    - `otlp`: exports via OTLP/HTTP, configured by the standard `OTEL_EXPORTER_OTLP_*` variables.
+    - `file`: appends one JSON span per line to `TRACING_FILE` (default `traces.jsonl`) for offline analysis.
+    - unset: tracing stays disabled and all spans are no-ops.
+
+    :param service_name: Service name reported if `OTEL_SERVICE_NAME` is not set.
+    :returns: `True` if tracing was enabled.
+    """
+    exporter_name = os.getenv("TRACING_EXPORTER", "").lower()
+    if not exporter_name:
+        return False
+
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from haystack.tracing import OpenTelemetryTracer
+
+    out = None
+    if exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif exporter_name == "file":
+        out = open(os.getenv("TRACING_FILE", "traces.jsonl"), "a", encoding="utf-8")
+        exporter = ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + os.linesep)
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER '{exporter_name}', expected 'otlp' or 'file'.")
+
+    resource = Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", service_name)})
+    # shut down by `_shutdown`, which flushes the pending spans before the trace file is closed
+    provider = TracerProvider(resource=resource, shutdown_on_exit=False)
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    atexit.register(_shutdown, provider, out)
+
+    tracing.enable_tracing(OpenTelemetryTracer(trace.get_tracer("haystack")))
+    logger.info("Tracing enabled with the {exporter} exporter", exporter=exporter_name)
+    return True
+
+
+def _shutdown(provider, out: Optional[TextIO]):
+    provider.shutdown()
+    if out is not None:
+        out.close()
+
+
+def instrument_app(app):
+    """
+    Adds OpenTelemetry HTTP server spans to a FastAPI app, if tracing is enabled and the instrumentation is installed.
+    """
+    if not tracing.is_tracing_enabled():
+        return
+    try:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    except ImportError:
+        logger.warning("opentelemetry-instrumentation-fastapi is not installed, HTTP server spans are disabled")
+        return
+    FastAPIInstrumentor.instrument_app(app)